@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+## @package bench_import
+#
+#  experimentスクリプトおよびexp_wrapperの各モジュールのimport時間を計測するベンチマーク
+#
+#  計測は毎回新しいインタプリタで行い, 中央値を報告する.@n
+#  experimentのimport時間が--budgetを超えた場合, もしくは起動時にimportすべきでない
+#  モジュール(GitPython, NumPy)がimportされた場合は終了コード1で終了する.@n
+#  実行例: python bench/bench_import.py -n 10 --budget 100
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+## 計測するモジュール
+MODULES = [
+    'exp_wrapper.template',
+    'exp_wrapper.gitlog',
+    'exp_wrapper.runindex',
+    'exp_wrapper.cache',
+    'exp_wrapper.collect',
+    'exp_wrapper.profiler',
+    'exp_wrapper.daemon',
+]
+
+## 起動時にimportすべきでないモジュール
+LAZY_MODULES = ['git', 'numpy', 'multiprocessing']
+
+## experimentスクリプトのパス
+EXPERIMENT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src', 'experiment'
+)
+
+_SNIPPET = """
+import sys, time, json
+start = time.time()
+%s
+elapsed = time.time() - start
+print(json.dumps({'elapsed': elapsed, 'loaded': [
+    m for m in %r if m in sys.modules
+]}))
+"""
+
+
+## 新しいインタプリタでimport時間を1回計測する関数
+#  @param statement importを行う文
+#  @return 経過時間(秒)とimportされたLAZY_MODULESのリスト
+def measure_once(statement):
+    output = subprocess.check_output(
+        [sys.executable, '-c', _SNIPPET % (statement, LAZY_MODULES)]
+    )
+    result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    return result['elapsed'], result['loaded']
+
+
+## import時間を繰り返し計測する関数
+#  @param name 計測対象の名前
+#  @param statement importを行う文
+#  @param n 計測回数
+#  @return 計測結果の辞書
+def measure(name, statement, n):
+    times = []
+    loaded = []
+    for _ in range(n):
+        elapsed, loaded = measure_once(statement)
+        times.append(elapsed)
+    times.sort()
+    return {
+        'name': name,
+        'runs': n,
+        'median_ms': times[len(times) // 2] * 1e3,
+        'min_ms': times[0] * 1e3,
+        'lazy_modules_loaded': loaded,
+    }
+
+
+## メイン関数
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the import time of the wrapper.'
+    )
+    parser.add_argument(
+        '-n', '--runs', type=int, default=10,
+        help='number of interpreters started for each measurement'
+    )
+    parser.add_argument(
+        '--budget', type=float, default=None,
+        help='maximum median import time of experiment in milliseconds'
+    )
+    parser.add_argument(
+        '-o', '--output', type=str, default=None,
+        help='json file to write the result'
+    )
+    args = parser.parse_args()
+
+    results = [
+        measure(
+            'experiment',
+            'import imp; imp.load_source("experiment", %r)' % EXPERIMENT,
+            args.runs
+        )
+    ]
+    for module in MODULES:
+        results.append(measure(module, 'import %s' % module, args.runs))
+    results_json = json.dumps(
+        {'benchmark': 'import', 'results': results}, indent=4
+    )
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(results_json)
+    print(results_json)
+
+    failures = []
+    experiment = results[0]
+    if args.budget is not None and experiment['median_ms'] > args.budget:
+        failures.append('import of experiment took %.1f ms (budget %.1f ms)' % (
+            experiment['median_ms'], args.budget
+        ))
+    for result in results:
+        if result['lazy_modules_loaded']:
+            failures.append('%s imports %s at startup' % (
+                result['name'], ', '.join(result['lazy_modules_loaded'])
+            ))
+    if failures:
+        sys.exit('\n'.join(failures))
+
+
+if __name__ == '__main__':
+    main()
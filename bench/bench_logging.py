@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+## @package bench_logging
+#
+#  同期および非同期のログ出力について, 1回のログ呼び出しあたりの時間を計測するベンチマーク
+#
+#  実行例: python bench/bench_logging.py -n 100000
+import argparse
+import json
+import os
+import tempfile
+import time
+from logging import getLogger, DEBUG, INFO
+from logging import StreamHandler, FileHandler, Formatter
+
+from exp_wrapper import logutil
+
+
+## ロガーを生成する関数
+#
+#  template.Main.make_logger()と同様に, 標準出力とファイルへのハンドラを登録する.@n
+#  標準出力の代わりに/dev/nullへ出力する.
+#  @param name ロガーの名前
+#  @param logfile ログファイルのパス文字列
+#  @param devnull /dev/nullのファイルオブジェクト
+#  @param async_log 非同期にログを出力するかどうかのbool変数
+#  @return ロガーオブジェクト
+def make_logger(name, logfile, devnull, async_log):
+    logger = getLogger(name)
+    logger.setLevel(DEBUG)
+    logger.propagate = False
+    formatter = Formatter(
+        "[%(asctime) -15s]\n%(filename)s,"
+        "L%(lineno)s:%(levelname)s\t%(message)s"
+    )
+    sh = StreamHandler(devnull)
+    sh.setLevel(DEBUG)
+    fh = FileHandler(logfile, 'w')
+    fh.setLevel(DEBUG)
+    for handler in (sh, fh):
+        handler.setFormatter(formatter)
+    logutil.install(logger, [sh, fh], async_log)
+    return logger
+
+
+## ログ呼び出しの時間を計測する関数
+#  @param async_log 非同期にログを出力するかどうかのbool変数
+#  @param n ログ呼び出しの回数
+#  @return 計測結果の辞書
+def measure(async_log, n):
+    fd, logfile = tempfile.mkstemp(suffix='.log')
+    os.close(fd)
+    devnull = open(os.devnull, 'w')
+    try:
+        logger = make_logger(
+            'bench_async' if async_log else 'bench_sync',
+            logfile, devnull, async_log
+        )
+        start = time.time()
+        for i in range(n):
+            logger.debug('step %d loss = %.6f', i, 1.0 / (i + 1))
+        call_time = time.time() - start
+        logutil.flush(logger)
+        total_time = time.time() - start
+        logutil.uninstall(logger)
+    finally:
+        devnull.close()
+        os.remove(logfile)
+    return {
+        'mode': 'async' if async_log else 'sync',
+        'calls': n,
+        'per_call_us': call_time / n * 1e6,
+        'total_s': total_time,
+    }
+
+
+## メイン関数
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark of per-call logging overhead.'
+    )
+    parser.add_argument(
+        '-n', '--calls', type=int, default=100000,
+        help='number of logging calls'
+    )
+    parser.add_argument(
+        '-o', '--output', type=str, default=None,
+        help='json file to write the result'
+    )
+    args = parser.parse_args()
+
+    results = [measure(False, args.calls), measure(True, args.calls)]
+    results_json = json.dumps(
+        {'benchmark': 'logging', 'results': results}, indent=4
+    )
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(results_json)
+    print(results_json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,460 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+## @package bench_overhead
+#
+#  ラッパーの1回の実行あたりのオーバーヘッドを, 処理ごとおよび全体で計測するベンチマーク
+#
+#  一時ディレクトリに合成したGitリポジトリ, パラメータ, 出力ファイルを用いて,
+#  以下の処理を計測する.
+#  - gitlog.make_repo(): indexのエントリが多いリポジトリの解決(キャッシュの有無)
+#  - gitlog.gitlog.write_commit(): 大きな差分を含むコミットログの書き込み
+#  - template.Main.make_output_json(): 多数のパラメータのjsonへの変換
+#  - experimentのmove_output(): 多数の小さなファイルおよび大きなファイルの移動とコピー
+#  - experimentのcheck_dir_name()およびmake_outputdir(): 多数の同名ディレクトリとの衝突
+#  - experiment全体: 対象のスクリプトを直接実行した場合との差
+#
+#  各処理はn回計測して中央値を報告する.
+#  --baselineに以前の結果のjsonファイルを指定した場合,
+#  中央値が基準の--tolerance倍を超えた処理があれば終了コード1で終了する.@n
+#  実行例: PYTHONPATH=src python bench/bench_overhead.py -n 5 -o overhead.json
+import argparse
+import codecs
+import imp
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from logging import getLogger, NullHandler
+
+from exp_wrapper import gitlog, template
+from exp_wrapper.timing import monotonic
+
+## experimentスクリプトのパス
+EXPERIMENT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src', 'experiment'
+)
+
+## 合成するリポジトリで管理する対象のスクリプト
+SCRIPT = """# -*- coding:utf-8 -*-
+from exp_wrapper import template
+
+
+class Bench(template.Main):
+    def execute(self):
+        self.out_params['result'] = 1
+
+
+if __name__ == '__main__':
+    import sys
+    template.main(Bench(sys.argv[1:]))
+"""
+
+## 基準との比較で無視する差(ミリ秒)
+NOISE_MS = 1.0
+
+
+## make_output_json()の計測に用いるクラス
+class BenchMain(template.Main):
+    pass
+
+
+## 処理の実行時間を繰り返し計測する関数
+#
+#  setupおよびteardownの時間は計測に含めない.
+#  @param name 計測対象の名前
+#  @param func 計測する関数(setupの戻り値を受け取る)
+#  @param n 計測回数
+#  @param setup 計測の前に毎回呼び出す関数
+#  @param teardown 計測の後に毎回funcの戻り値を受け取って呼び出す関数
+#  @param params 結果に記録する計測条件
+#  @return 計測結果の辞書
+def measure(name, func, n, setup=None, teardown=None, **params):
+    times = []
+    for _ in range(n):
+        state = setup() if setup is not None else None
+        start = monotonic()
+        value = func(state)
+        times.append(monotonic() - start)
+        if teardown is not None:
+            teardown(value)
+    times.sort()
+    result = {
+        'name': name,
+        'runs': n,
+        'median_ms': times[len(times) // 2] * 1e3,
+        'min_ms': times[0] * 1e3,
+    }
+    result.update(params)
+    sys.stderr.write('%s: %.2f ms\n' % (name, result['median_ms']))
+    return result
+
+
+## gitコマンドを実行する関数
+#  @param repo_dir リポジトリのパス文字列
+#  @param args gitコマンドの引数のリスト
+def git(repo_dir, *args):
+    subprocess.check_call(
+        ['git', '-c', 'user.name=bench', '-c', 'user.email=bench@localhost']
+        + list(args), cwd=repo_dir, stdout=open(os.devnull, 'w')
+    )
+
+
+## 合成したGitリポジトリを作成する関数
+#
+#  files個のファイルをコミットし, indexのエントリを多くする.
+#  差分用のファイルdata.txtにはdiff_lines行を書き込んでコミットし,
+#  作業ツリーでは全ての行を変更して大きな差分を作る.
+#  @param work_dir 作業用の一時ディレクトリのパス文字列
+#  @param files 管理するファイル数
+#  @param diff_lines 差分の行数
+#  @return リポジトリのパス文字列と対象のスクリプトのパス文字列
+def make_synthetic_repo(work_dir, files, diff_lines):
+    repo_dir = os.path.join(work_dir, 'repo')
+    os.makedirs(os.path.join(repo_dir, 'scripts'))
+    git(repo_dir, 'init', '-q')
+    for i in range(files):
+        sub_dir = os.path.join(repo_dir, 'files', '%03d' % (i % 100))
+        if not os.path.isdir(sub_dir):
+            os.makedirs(sub_dir)
+        with open(os.path.join(sub_dir, 'f%06d.txt' % i), 'w') as f:
+            f.write('%d\n' % i)
+    script_path = os.path.join(repo_dir, 'scripts', 'bench_script.py')
+    with open(script_path, 'w') as f:
+        f.write(SCRIPT)
+    data_path = os.path.join(repo_dir, 'data.txt')
+    with open(data_path, 'w') as f:
+        f.writelines('line %d\n' % i for i in range(diff_lines))
+    git(repo_dir, 'add', '-A')
+    git(repo_dir, 'commit', '-q', '-m', 'synthetic')
+    with open(data_path, 'w') as f:
+        f.writelines('changed %d\n' % i for i in range(diff_lines))
+    return repo_dir, script_path
+
+
+## gitlog.make_repo()を計測する関数
+#  @param script_path 対象のスクリプトのパス文字列
+#  @param work_dir 作業用の一時ディレクトリのパス文字列
+#  @param n 計測回数
+#  @param files indexのエントリ数
+#  @return 計測結果の辞書のリスト
+def bench_make_repo(script_path, work_dir, n, files):
+    cache_path = os.path.join(work_dir, 'repo_cache.json')
+
+    def clear(_=None):
+        gitlog._repo_cache.clear()
+
+    results = [
+        measure(
+            'make_repo/uncached',
+            lambda _: gitlog.make_repo(script_path, cache_path=False),
+            n, setup=clear, index_entries=files
+        ),
+    ]
+    gitlog.make_repo(script_path, cache_path=cache_path)
+    results.append(measure(
+        'make_repo/disk_cache',
+        lambda _: gitlog.make_repo(script_path, cache_path=cache_path),
+        n, setup=clear, index_entries=files
+    ))
+    gitlog.make_repo(script_path, cache_path=cache_path)
+    results.append(measure(
+        'make_repo/process_cache',
+        lambda _: gitlog.make_repo(script_path, cache_path=cache_path),
+        n, index_entries=files
+    ))
+    return results
+
+
+## gitlog.gitlog.write_commit()を計測する関数
+#  @param script_path 対象のスクリプトのパス文字列
+#  @param work_dir 作業用の一時ディレクトリのパス文字列
+#  @param n 計測回数
+#  @param diff_lines 差分の行数
+#  @return 計測結果の辞書のリスト
+def bench_write_commit(script_path, work_dir, n, diff_lines):
+    repo = gitlog.make_repo(script_path, cache_path=False)
+    log = gitlog.gitlog(repo)
+    path = os.path.join(work_dir, 'commitlog.txt')
+
+    def write(_):
+        with codecs.open(path, 'w', 'utf-8') as f:
+            log.write_commit(f)
+
+    result = measure('write_commit', write, n, diff_lines=diff_lines)
+    result['commitlog_bytes'] = os.path.getsize(path)
+    return [result]
+
+
+## template.Main.make_output_json()を計測する関数
+#
+#  スカラーのパラメータと, サイドカーに保存される数値のリストを含む.
+#  @param work_dir 作業用の一時ディレクトリのパス文字列
+#  @param n 計測回数
+#  @param params パラメータ数
+#  @return 計測結果の辞書のリスト
+def bench_make_output_json(work_dir, n, params):
+    obj = BenchMain([])
+    obj.output_dir = os.path.join(work_dir, 'json_run')
+    os.makedirs(obj.output_dir)
+    for i in range(params):
+        obj.in_params['in_%06d' % i] = i
+        obj.out_params['out_%06d' % i] = {'value': i * 0.5, 'name': str(i)}
+    obj.out_params['curve'] = [i * 0.1 for i in range(params)]
+
+    def dump(_):
+        io_params, io_files = obj.make_output_json()
+        return len(io_params) + len(io_files)
+
+    result = measure('make_output_json', dump, n, params=params)
+    return [result]
+
+
+## experimentのmove_output()を計測する関数
+#
+#  多数の小さなファイルの移動(rename)と, 大きなファイルの移動およびコピーを計測する.
+#  @param experiment experimentモジュール
+#  @param work_dir 作業用の一時ディレクトリのパス文字列
+#  @param n 計測回数
+#  @param outputs 小さなファイルの数
+#  @param huge_mb 大きなファイルの大きさ(MB)
+#  @param logger ロガーオブジェクト
+#  @return 計測結果の辞書のリスト
+def bench_move_output(experiment, work_dir, n, outputs, huge_mb, logger):
+    base = os.path.join(work_dir, 'move')
+    block = os.urandom(1024 * 1024)
+
+    def make_tree(files, size_mb):
+        if os.path.isdir(base):
+            shutil.rmtree(base)
+        src_dir = os.path.join(base, 'src')
+        run_dir = os.path.join(base, 'run')
+        os.makedirs(src_dir)
+        os.makedirs(run_dir)
+        output_files = {}
+        for i in range(files):
+            path = os.path.join(src_dir, 'out_%06d.bin' % i)
+            with open(path, 'wb') as f:
+                if size_mb:
+                    for _ in range(size_mb):
+                        f.write(block)
+                else:
+                    f.write(block[:1024])
+            output_files['out_%06d' % i] = path
+        return output_files, run_dir
+
+    def move(strategy):
+        def func(state):
+            output_files, run_dir = state
+            return experiment.move_output(
+                output_files, run_dir, logger, strategy
+            )
+        return func
+
+    return [
+        measure(
+            'move_output/many_files', move('auto'), n,
+            setup=lambda: make_tree(outputs, 0), files=outputs
+        ),
+        measure(
+            'move_output/huge_file', move('auto'), n,
+            setup=lambda: make_tree(1, huge_mb), size_mb=huge_mb
+        ),
+        measure(
+            'move_output/huge_file_copy', move('copy'), n,
+            setup=lambda: make_tree(1, huge_mb), size_mb=huge_mb
+        ),
+    ]
+
+
+## experimentのcheck_dir_name()およびmake_outputdir()を計測する関数
+#  @param experiment experimentモジュール
+#  @param work_dir 作業用の一時ディレクトリのパス文字列
+#  @param n 計測回数
+#  @param collisions 既に存在する同名のディレクトリの数
+#  @param logger ロガーオブジェクト
+#  @return 計測結果の辞書のリスト
+def bench_dir_name(experiment, work_dir, n, collisions, logger):
+    root = os.path.join(work_dir, 'root')
+    class_dir = os.path.join(root, 'bench.Bench')
+    os.makedirs(class_dir)
+    base = os.path.join(class_dir, 'run')
+    os.mkdir(base)
+    for i in range(1, collisions):
+        os.mkdir('%s_%d' % (base, i))
+
+    return [
+        measure(
+            'check_dir_name', lambda _: experiment.check_dir_name(base), n,
+            collisions=collisions
+        ),
+        measure(
+            'make_outputdir',
+            lambda _: experiment.make_outputdir(
+                root, 'bench.Bench', 'run', logger
+            ),
+            n, teardown=os.rmdir, collisions=collisions
+        ),
+    ]
+
+
+## experiment全体のオーバーヘッドを計測する関数
+#
+#  対象のスクリプトを直接実行した場合と, experimentから実行した場合の時間の差を求める.@n
+#  差分の影響はwrite_commitで計測するため, 作業ツリーの変更を元に戻してから計測する.
+#  @param repo_dir リポジトリのパス文字列
+#  @param script_path 対象のスクリプトのパス文字列
+#  @param work_dir 作業用の一時ディレクトリのパス文字列
+#  @param n 計測回数
+#  @return 計測結果の辞書のリスト
+def bench_end_to_end(repo_dir, script_path, work_dir, n):
+    git(repo_dir, 'checkout', '--', 'data.txt')
+    env = dict(os.environ)
+    src_dir = os.path.abspath(os.path.dirname(EXPERIMENT))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [src_dir] + [p for p in [env.get('PYTHONPATH')] if p]
+    )
+    run_cwd = os.path.join(work_dir, 'e2e')
+    os.makedirs(run_cwd)
+    devnull = open(os.devnull, 'w')
+
+    def run(argv):
+        def func(_):
+            subprocess.check_call(
+                argv, cwd=run_cwd, env=env, stdout=devnull, stderr=devnull
+            )
+        return func
+
+    try:
+        direct = measure(
+            'end_to_end/direct', run([sys.executable, script_path]), n
+        )
+        wrapped = measure(
+            'end_to_end/experiment',
+            run([
+                sys.executable, EXPERIMENT, script_path, 'Bench',
+                '+r', os.path.join(run_cwd, 'output')
+            ]), n
+        )
+    finally:
+        devnull.close()
+    wrapped['overhead_ms'] = wrapped['median_ms'] - direct['median_ms']
+    return [direct, wrapped]
+
+
+## 基準の結果と比較する関数
+#  @param results 計測結果の辞書のリスト
+#  @param baseline_path 基準の結果のjsonファイルのパス文字列
+#  @param tolerance 許容する中央値の倍率
+#  @return 基準を超えた処理を説明する文字列のリスト
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path, 'r') as f:
+        baseline = dict(
+            (r['name'], r) for r in json.load(f)['results']
+        )
+    failures = []
+    for result in results:
+        base = baseline.get(result['name'])
+        if base is None:
+            continue
+        limit = max(base['median_ms'] * tolerance, base['median_ms'] + NOISE_MS)
+        if result['median_ms'] > limit:
+            failures.append('%s took %.2f ms (baseline %.2f ms)' % (
+                result['name'], result['median_ms'], base['median_ms']
+            ))
+    return failures
+
+
+## メイン関数
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the per-run overhead of the wrapper '
+        'on synthetic repositories, parameters and output files.'
+    )
+    parser.add_argument(
+        '-n', '--runs', type=int, default=5,
+        help='number of measurements of each stage'
+    )
+    parser.add_argument(
+        '--files', type=int, default=20000,
+        help='number of files in the index of the synthetic repository'
+    )
+    parser.add_argument(
+        '--diff_lines', type=int, default=100000,
+        help='number of changed lines in the working tree'
+    )
+    parser.add_argument(
+        '--params', type=int, default=20000,
+        help='number of input and output parameters'
+    )
+    parser.add_argument(
+        '--outputs', type=int, default=1000,
+        help='number of small output files'
+    )
+    parser.add_argument(
+        '--huge_mb', type=int, default=256,
+        help='size of the huge output file in MB'
+    )
+    parser.add_argument(
+        '--collisions', type=int, default=10000,
+        help='number of existing directories with the same name'
+    )
+    parser.add_argument(
+        '--baseline', type=str, default=None,
+        help='json file of a previous result to compare with'
+    )
+    parser.add_argument(
+        '--tolerance', type=float, default=1.5,
+        help='allowed ratio of the median time to the baseline'
+    )
+    parser.add_argument(
+        '-o', '--output', type=str, default=None,
+        help='json file to write the result'
+    )
+    args = parser.parse_args()
+
+    # BenchMainのロガー(モジュール名)と異なる名前にする
+    logger = getLogger('bench_overhead.wrapper')
+    logger.addHandler(NullHandler())
+    logger.propagate = False
+    experiment = imp.load_source('experiment', EXPERIMENT)
+    work_dir = tempfile.mkdtemp(prefix='bench_overhead_')
+    try:
+        repo_dir, script_path = make_synthetic_repo(
+            work_dir, args.files, args.diff_lines
+        )
+        results = []
+        results += bench_make_repo(script_path, work_dir, args.runs, args.files)
+        results += bench_write_commit(
+            script_path, work_dir, args.runs, args.diff_lines
+        )
+        results += bench_make_output_json(work_dir, args.runs, args.params)
+        results += bench_move_output(
+            experiment, work_dir, args.runs, args.outputs, args.huge_mb, logger
+        )
+        results += bench_dir_name(
+            experiment, work_dir, args.runs, args.collisions, logger
+        )
+        results += bench_end_to_end(
+            repo_dir, script_path, work_dir, args.runs
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results_json = json.dumps(
+        {'benchmark': 'overhead', 'results': results}, indent=4
+    )
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(results_json)
+    print(results_json)
+
+    if args.baseline is not None:
+        failures = compare(results, args.baseline, args.tolerance)
+        if failures:
+            sys.exit('\n'.join(failures))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,414 @@
+# -*- coding:utf-8 -*-
+## @package aggregate
+#
+#  あるクラス(module.Class)の全ての実行の入出力パラメータを,
+#  列ごとに型の揃った1つの表(NumPyの構造化配列)に集約するためのパッケージ
+#
+#  表は<root>/<module.Class>/.aggregate/に, 固定長のレコードを並べたバイナリファイル
+#  (table.bin)と, 列の型や行数を記録したマニフェスト(manifest.json)として保存される.@n
+#  更新時には未集約の実行のみを読み込んで追記し, 列が増えたり型が変わった場合にのみ
+#  表全体を書き直す. 読み込みはnumpy.memmapで行うため, 1回のmmapで表全体を参照できる.@n
+#  NumPyのimportには時間がかかるため, 必要になった時点でimportする.
+import errno
+import fcntl
+import json
+import os
+import tempfile
+import time
+
+from exp_wrapper import rundir, runindex, sidecar
+
+## 集約結果を保存するディレクトリの名前
+AGGREGATE_DIRNAME = '.aggregate'
+
+## マニフェストのファイル名
+MANIFEST_FILENAME = 'manifest.json'
+
+## 表のファイル名
+TABLE_FILENAME = 'table.bin'
+
+## 各実行に共通する列
+RUN_COLUMNS = [
+    'path', 'name', 'date', 'status', 'commit_sha', 'started', 'finished',
+    'elapsed'
+]
+
+## 型の種類の順序(右ほど多くの値を表せる)
+_KIND_ORDER = ['b', 'i', 'f', 'U']
+
+
+## numpyモジュールを返す関数
+#  @return numpyモジュール
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('numpy is required to aggregate results')
+    return numpy
+
+
+## 集約結果を保存するディレクトリのパスを返す関数
+#  @param class_dir クラスのディレクトリのパス文字列
+#  @return ディレクトリのパス文字列
+def aggregate_dir(class_dir):
+    return os.path.join(class_dir, AGGREGATE_DIRNAME)
+
+
+## 値の型の種類を返す関数
+#  @param value 値
+#  @return 'b'(bool), 'i'(整数), 'f'(実数), 'U'(文字列)のいずれか(Noneの場合はNone)
+def _kind(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 'b'
+    if isinstance(value, (int, long)):
+        return 'i'
+    if isinstance(value, float):
+        return 'f'
+    return 'U'
+
+
+## 値を文字列の列に格納する文字列に変換する関数
+#  @param value 値
+#  @return 文字列
+def _to_text(value):
+    if value is None:
+        return u''
+    if isinstance(value, unicode):
+        return value
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, (bool, int, long, float)):
+        return unicode(value)
+    return json.dumps(value, sort_keys=True).decode('utf-8')
+
+
+## 既存の列の値を文字列の列に格納する文字列に変換する関数
+#
+#  欠損値(NaN)は空文字列とし, 欠損値を表すために実数として格納された
+#  boolおよび整数の列は元の型の値として変換する.
+#  @param values 既存の列の配列
+#  @param info 既存の列の型の情報
+#  @return 文字列のリスト
+def _column_texts(values, info):
+    if values.dtype.kind == 'U':
+        return list(values)
+    texts = []
+    for value in values.tolist():
+        if isinstance(value, float) and value != value:
+            texts.append(u'')
+        elif info['kind'] == 'b':
+            texts.append(_to_text(bool(value)))
+        elif info['kind'] == 'i':
+            texts.append(_to_text(int(value)))
+        else:
+            texts.append(_to_text(value))
+    return texts
+
+
+## 文字列の列の幅を返す関数
+#
+#  幅が広がるたびに表を書き直さずに済むように, 2のべき乗に切り上げる.
+#  @param length 文字列の長さ
+#  @return 列の幅
+def _round_width(length):
+    width = 8
+    while width < length:
+        width *= 2
+    return width
+
+
+## 入出力パラメータの辞書を平坦化する関数
+#
+#  入れ子の辞書のキーは'.'で連結する. サイドカーへの参照はそのパスに置き換え,
+#  リスト等のスカラーでない値はjson文字列として扱う.
+#  @param params パラメータの辞書
+#  @param prefix キーに付加するprefix
+#  @return 平坦化した辞書
+def _flatten(params, prefix):
+    flat = {}
+    for key, value in params.items():
+        key = prefix + unicode(key)
+        if sidecar.is_sidecar(value):
+            flat[key] = value['path']
+        elif isinstance(value, dict):
+            flat.update(_flatten(value, key + '.'))
+        else:
+            flat[key] = value
+    return flat
+
+
+## 実行ディレクトリから表の1行分の辞書を生成する関数(ワーカープロセス用)
+#  @param run_dir 実行ディレクトリのパス文字列
+#  @return 列名をキーとする辞書(読み込めなかった場合はNone)
+def _make_row(run_dir):
+    try:
+        record = runindex.make_record(run_dir)
+    except (IOError, OSError, ValueError):
+        return None
+    if record is None:
+        return None
+    row = dict((c, record[c]) for c in RUN_COLUMNS)
+    row.update(_flatten(record['input_params'], u'input_params.'))
+    row.update(_flatten(record['output_params'], u'output_params.'))
+    return row
+
+
+## 列の型を推定して更新する関数
+#
+#  bool < 整数 < 実数 < 文字列の順に, 全ての値を表せる型に拡張する.@n
+#  欠損値を含むboolおよび整数の列は, NaNを表せるように実数の列とする.@n
+#  一部の行(失敗した実行のoutput_params等)にしか無い列も欠損値を含むものとする.@n
+#  文字列の列に拡張された列の幅は, 既存の値を切り詰めないように既存の行の値も含めて決める.
+#  @param columns 列名をキーとし, 型の情報('kind', 'width', 'nullable')を値とする辞書
+#  @param rows 新たに追加する行のリスト
+#  @param old_rows 既存の行数
+#  @param old_array 既存の行の構造化配列(既存の行が無い場合はNone)
+#  @return 型の情報を更新した辞書
+def infer_schema(columns, rows, old_rows=0, old_array=None):
+    old_columns = columns
+    columns = dict((name, dict(info)) for name, info in columns.items())
+    for row in rows:
+        for name, value in row.items():
+            kind = _kind(value)
+            info = columns.get(name)
+            if info is None:
+                info = {'kind': kind, 'width': 0, 'nullable': old_rows > 0}
+                columns[name] = info
+            if kind is None:
+                info['nullable'] = True
+                continue
+            if info['kind'] is None or \
+                    _KIND_ORDER.index(kind) > _KIND_ORDER.index(info['kind']):
+                info['kind'] = kind
+    for name, info in columns.items():
+        if any(name not in row for row in rows):
+            info['nullable'] = True
+    for row in rows:
+        for name, info in columns.items():
+            if info['kind'] == 'U' and name in row:
+                info['width'] = max(
+                    info['width'], _round_width(len(_to_text(row[name])))
+                )
+    if old_array is not None:
+        for name, info in columns.items():
+            old_info = old_columns.get(name)
+            if info['kind'] != 'U' or old_info is None or \
+                    old_info['kind'] == 'U':
+                continue
+            texts = _column_texts(old_array[_field_name(name)], old_info)
+            info['width'] = max(
+                [info['width']] + [_round_width(len(t)) for t in texts]
+            )
+    return columns
+
+
+## 列の型の情報から構造化配列のdtypeを生成する関数
+#  @param columns 列の型の情報の辞書
+#  @return numpy.dtypeオブジェクト
+def make_dtype(columns):
+    numpy = _numpy()
+    fields = []
+    for name in sorted(columns):
+        info = columns[name]
+        kind = info['kind']
+        if kind == 'U':
+            fmt = '<U%d' % max(info['width'], 1)
+        elif kind == 'f' or kind is None or info['nullable']:
+            fmt = '<f8'
+        elif kind == 'i':
+            fmt = '<i8'
+        else:
+            fmt = '?'
+        fields.append((_field_name(name), fmt))
+    return numpy.dtype(fields)
+
+
+## 構造化配列のフィールド名を返す関数
+#
+#  Python 2のNumPyはunicodeのフィールド名を扱えないため, utf-8のstrに変換する.
+#  @param name 列名
+#  @return フィールド名
+def _field_name(name):
+    if isinstance(name, str):
+        return name
+    return name.encode('utf-8')
+
+
+## 行のリストを構造化配列に変換する関数
+#  @param rows 行のリスト
+#  @param dtype 構造化配列のdtype
+#  @return 構造化配列
+def _rows_to_array(rows, dtype):
+    numpy = _numpy()
+    array = numpy.zeros(len(rows), dtype=dtype)
+    for field in dtype.names:
+        name = field.decode('utf-8') if isinstance(field, bytes) else field
+        kind = dtype[field].kind
+        if kind == 'U':
+            array[field] = [_to_text(row.get(name)) for row in rows]
+        elif kind == 'f':
+            array[field] = [
+                numpy.nan if row.get(name) is None else float(row[name])
+                for row in rows
+            ]
+        else:
+            array[field] = [row.get(name) for row in rows]
+    return array
+
+
+## 構造化配列を別のdtypeに変換する関数
+#
+#  新たな列は欠損値(実数の列はNaN, 文字列の列は空文字列)で埋める.
+#  文字列の列に拡張された列は_column_texts()で変換し, 欠損値は空文字列のままとする.
+#  @param array 変換する構造化配列
+#  @param dtype 変換後のdtype
+#  @param old_columns 変換前の列の型の情報の辞書
+#  @return 変換後の構造化配列
+def _convert(array, dtype, old_columns):
+    numpy = _numpy()
+    converted = numpy.zeros(len(array), dtype=dtype)
+    for field in dtype.names:
+        if array.dtype.names is not None and field in array.dtype.names:
+            if dtype[field].kind == 'U' and array[field].dtype.kind != 'U':
+                name = field.decode('utf-8') \
+                    if isinstance(field, bytes) else field
+                converted[field] = _column_texts(
+                    array[field], old_columns[name]
+                )
+            else:
+                converted[field] = array[field].astype(dtype[field])
+        elif dtype[field].kind == 'f':
+            converted[field] = numpy.nan
+    return converted
+
+
+## マニフェストを読み込む関数
+#  @param class_dir クラスのディレクトリのパス文字列
+#  @return マニフェストの辞書(存在しない場合は空の表を表す辞書)
+def read_manifest(class_dir):
+    path = os.path.join(aggregate_dir(class_dir), MANIFEST_FILENAME)
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    return {'rows': 0, 'columns': {}}
+
+
+## ファイルをアトミックに書き込む関数
+#  @param path ファイルのパス文字列
+#  @param write ファイルオブジェクトを受け取って書き込む関数
+def _atomic_write(path, write):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+## 集約した表を読み込む関数
+#
+#  表全体を読み込み専用のmemmapとして返す.
+#  @param class_dir クラスのディレクトリのパス文字列
+#  @return 構造化配列
+def load(class_dir):
+    numpy = _numpy()
+    manifest = read_manifest(class_dir)
+    dtype = make_dtype(manifest['columns'])
+    if manifest['rows'] == 0:
+        return numpy.zeros(0, dtype=dtype)
+    return numpy.memmap(
+        os.path.join(aggregate_dir(class_dir), TABLE_FILENAME),
+        dtype=dtype, mode='r', shape=(manifest['rows'],)
+    )
+
+
+## クラスの全ての実行を表に集約する関数
+#
+#  未集約の実行のみを読み込む. 列の型が変わらない場合は表の末尾に追記し,
+#  変わる場合は表全体を書き直す.@n
+#  削除されたり名前が変わった(+resumeでエラーの接尾辞が除かれた)実行の行は,
+#  表全体を書き直して取り除く.@n
+#  同時に実行された場合に備え, 更新中はロックファイルを排他ロックする.
+#  @param class_dir クラスのディレクトリのパス文字列
+#  @param jobs jsonファイルを読み込むワーカープロセス数(Noneの場合はCPU数)
+#  @param full Trueの場合は既存の表を破棄して全ての実行を集約し直す
+#  @return 表の行数と追加した行数
+def update(class_dir, jobs=None, full=False):
+    import multiprocessing
+    agg_dir = aggregate_dir(class_dir)
+    rundir.makedirs(agg_dir)
+    table_path = os.path.join(agg_dir, TABLE_FILENAME)
+    with open(os.path.join(agg_dir, '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if full:
+            manifest = {'rows': 0, 'columns': {}}
+            done = set()
+        else:
+            manifest = read_manifest(class_dir)
+            done = set(load(class_dir)['path']) if manifest['rows'] else set()
+
+        run_dirs = [
+            os.path.abspath(d)
+            for d in rundir.iter_class_dir(class_dir, runindex.is_run_dir)
+        ]
+        stale = done - set(_to_text(d) for d in run_dirs)
+        run_dirs = [d for d in run_dirs if _to_text(d) not in done]
+        if jobs is None:
+            jobs = multiprocessing.cpu_count()
+        if jobs > 1 and len(run_dirs) > 1:
+            pool = multiprocessing.Pool(jobs)
+            try:
+                rows = list(pool.imap(_make_row, run_dirs, 64))
+                pool.close()
+            except KeyboardInterrupt:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            rows = [_make_row(d) for d in run_dirs]
+        rows = [r for r in rows if r is not None]
+        if not rows and not stale and not full:
+            return manifest['rows'], 0
+
+        old_rows = manifest['rows']
+        old_dtype = make_dtype(manifest['columns'])
+        old_array = load(class_dir) if old_rows else None
+        columns = infer_schema(manifest['columns'], rows, old_rows, old_array)
+        dtype = make_dtype(columns)
+        new_array = _rows_to_array(rows, dtype)
+        if old_rows and dtype == old_dtype and not stale:
+            # 前回の更新が中断された場合に残った末尾を切り詰めてから追記する
+            with open(table_path, 'r+b') as f:
+                f.truncate(old_rows * dtype.itemsize)
+                f.seek(0, os.SEEK_END)
+                new_array.tofile(f)
+        else:
+            if old_rows:
+                numpy = _numpy()
+                if stale:
+                    old_array = old_array[numpy.array(
+                        [p not in stale for p in old_array['path']], dtype=bool
+                    )]
+                old_array = _convert(old_array, dtype, manifest['columns'])
+                new_array = numpy.concatenate([old_array, new_array])
+                old_rows = len(old_array)
+            _atomic_write(table_path, new_array.tofile)
+
+        manifest = {
+            'rows': old_rows + len(rows),
+            'columns': columns,
+            'updated': time.time(),
+        }
+        _atomic_write(
+            os.path.join(agg_dir, MANIFEST_FILENAME),
+            lambda f: f.write(json.dumps(manifest, indent=4))
+        )
+    return manifest['rows'], len(rows)
@@ -0,0 +1,198 @@
+# -*- coding:utf-8 -*-
+## @package cache
+#
+#  実行結果のキャッシュに関するパッケージ
+#
+#  スクリプト, クラス名, 入力パラメータ, コミットログ(HEADのハッシュIDと差分)から
+#  計算したハッシュ値をキーとして, 過去の実行の出力ディレクトリを記録する.
+import errno
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+
+## jsonに変換できないオブジェクトをキー計算用に変換する関数
+#
+#  argparse.Namespaceのように属性を持つオブジェクトは辞書に,
+#  ファイルオブジェクトはファイル名に, それ以外はrepr()の文字列に変換する.
+#  @param o jsonに変換できないオブジェクト
+#  @return jsonに変換可能なオブジェクト
+def _key_default(o):
+    if isinstance(o, file):
+        return o.name
+    if hasattr(o, '__dict__'):
+        return vars(o)
+    return repr(o)
+
+
+## キャッシュのキーを計算する関数
+#  @param script_path 実行するpythonスクリプトのパス文字列
+#  @param class_name モジュール名/クラス名の文字列
+#  @param in_params 入力パラメータの辞書
+#  @param commitlog gitlog.make_commitlog()で生成したコミットログの文字列
+#  @param extra キーに含めたいその他の情報(jsonに変換可能なオブジェクト)
+#  @return キーとなる16進数の文字列
+def make_key(script_path, class_name, in_params, commitlog, extra=None):
+    h = hashlib.sha1()
+    with open(script_path, 'rb') as f:
+        h.update(f.read())
+    h.update('\0')
+    h.update(class_name)
+    h.update('\0')
+    h.update(json.dumps(in_params, sort_keys=True, default=_key_default))
+    h.update('\0')
+    if commitlog is not None:
+        h.update(commitlog.encode('utf-8'))
+    h.update('\0')
+    if extra is not None:
+        h.update(json.dumps(extra, sort_keys=True, default=_key_default))
+    return h.hexdigest()
+
+
+## 実行結果のキャッシュを扱うクラス
+#
+#  キャッシュのエントリはcache_dir/<キーの先頭2文字>/<キー>.jsonに保存され,
+#  過去の実行の出力ディレクトリのパスを保持する.@n
+#  エントリのmtimeは最終参照時刻として扱い, 期限切れおよび上限数を超えた
+#  エントリは最終参照時刻の古いものから削除する.@n
+#  エントリの削除では, 出力ディレクトリ自体は削除しない.
+class ResultCache(object):
+    ## コンストラクタ
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param cache_dir キャッシュのルートディレクトリのパス文字列
+    #  @param max_age 最終参照からのエントリの有効期限(日数, Noneの場合は無期限)
+    #  @param max_entries エントリ数の上限(Noneの場合は無制限)
+    def __init__(self, cache_dir, max_age=None, max_entries=None):
+        ## @var cache_dir
+        #  キャッシュのルートディレクトリのパス文字列
+        self.cache_dir = cache_dir
+        ## @var max_age
+        #  エントリの有効期限(日数)
+        self.max_age = max_age
+        ## @var max_entries
+        #  エントリ数の上限
+        self.max_entries = max_entries
+
+    ## キーに対応するエントリのパスを返すメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param key キャッシュのキー
+    #  @return エントリのパス文字列
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    ## キーに対応する出力ディレクトリを検索するメソッド
+    #
+    #  出力ディレクトリが削除されている場合や, 有効期限が切れている場合には
+    #  エントリを削除してNoneを返す.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param key キャッシュのキー
+    #  @return 出力ディレクトリのパス文字列(存在しない場合はNone)
+    def lookup(self, key):
+        path = self.entry_path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        output_dir = entry.get('output_dir')
+        if output_dir is None or not os.path.isdir(output_dir) or \
+                self._expired(path, time.time()):
+            self._remove(path)
+            return None
+        # 最終参照時刻を更新
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return output_dir
+
+    ## エントリを保存するメソッド
+    #
+    #  並列実行時に不完全なエントリが読まれないように,
+    #  一時ファイルに書き込んだ後にrenameする.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param key キャッシュのキー
+    #  @param output_dir 出力ディレクトリのパス文字列
+    #  @param info エントリに記録するその他の情報の辞書
+    def store(self, key, output_dir, info=None):
+        path = self.entry_path(key)
+        entry_dir = os.path.dirname(path)
+        try:
+            os.makedirs(entry_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        entry = dict(info or {})
+        entry['output_dir'] = os.path.abspath(output_dir)
+        entry['created'] = time.time()
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f, indent=4)
+        os.rename(tmp_path, path)
+
+    ## 期限切れのエントリおよび上限数を超えたエントリを削除するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @return 削除したエントリ数
+    def evict(self):
+        if self.max_age is None and self.max_entries is None:
+            return 0
+        now = time.time()
+        entries = []
+        removed = 0
+        for path in self._iter_entries():
+            if self._expired(path, now):
+                removed += self._remove(path)
+                continue
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        if self.max_entries is not None and len(entries) > self.max_entries:
+            entries.sort()
+            for _, path in entries[:len(entries) - self.max_entries]:
+                removed += self._remove(path)
+        return removed
+
+    ## エントリのパスを列挙するジェネレータ
+    #  @param self オブジェクト自身に対するポインタ
+    def _iter_entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for sub in os.listdir(self.cache_dir):
+            sub_dir = os.path.join(self.cache_dir, sub)
+            if not os.path.isdir(sub_dir):
+                continue
+            for name in os.listdir(sub_dir):
+                if name.endswith('.json'):
+                    yield os.path.join(sub_dir, name)
+
+    ## エントリの有効期限が切れているかを判定するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param path エントリのパス文字列
+    #  @param now 現在時刻
+    #  @return 有効期限が切れている場合はTrue
+    def _expired(self, path, now):
+        if self.max_age is None:
+            return False
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return True
+        return now - mtime > self.max_age * 24 * 60 * 60
+
+    ## エントリを削除するメソッド
+    #
+    #  並列実行時に他のプロセスがすでに削除している場合は無視する.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param path エントリのパス文字列
+    #  @return 削除した場合は1, それ以外は0
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return 1
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return 0
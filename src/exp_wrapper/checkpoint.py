@@ -0,0 +1,116 @@
+# -*- coding:utf-8 -*-
+## @package checkpoint
+#
+#  実行途中の状態(チェックポイント)の保存と読み込みに関するパッケージ
+#
+#  チェックポイントは出力ディレクトリのcheckpoints/にステップ数を名前に含む
+#  pickleファイルとして保存される.@n
+#  書きかけのファイルが読まれないように, 同じディレクトリの一時ファイルに書き込み,
+#  fsyncしてからrenameする. そのため, 保存中に中断されても直前のチェックポイントは壊れない.
+import errno
+import os
+import re
+import tempfile
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+## チェックポイントを保存するディレクトリの名前
+CHECKPOINT_DIRNAME = 'checkpoints'
+
+## チェックポイントのファイル名の書式
+CHECKPOINT_FORMAT = 'checkpoint_%010d.pkl'
+
+_CHECKPOINT_PATTERN = re.compile(r'^checkpoint_(\d+)\.pkl$')
+
+
+## チェックポイントを列挙する関数
+#  @param checkpoint_dir チェックポイントのディレクトリのパス文字列
+#  @return ステップ数とパス文字列のタプルのリスト(ステップ数の昇順)
+def list_checkpoints(checkpoint_dir):
+    try:
+        names = os.listdir(checkpoint_dir)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return []
+    checkpoints = []
+    for name in names:
+        m = _CHECKPOINT_PATTERN.match(name)
+        if m is not None:
+            checkpoints.append(
+                (int(m.group(1)), os.path.join(checkpoint_dir, name))
+            )
+    return sorted(checkpoints)
+
+
+## ディレクトリのエントリの変更をディスクに書き出す関数
+#  @param path ディレクトリのパス文字列
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+## チェックポイントを保存する関数
+#
+#  保存後, 新しいものからkeep個を残して古いチェックポイントを削除する.
+#  @param checkpoint_dir チェックポイントのディレクトリのパス文字列
+#  @param state 保存する状態(pickle化できるオブジェクト)
+#  @param step ステップ数
+#  @param keep 残すチェックポイントの数(0以下の場合は全て残す)
+#  @return 保存したファイルのパス文字列
+def save(checkpoint_dir, state, step, keep=3):
+    try:
+        os.makedirs(checkpoint_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    path = os.path.join(checkpoint_dir, CHECKPOINT_FORMAT % step)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=checkpoint_dir, prefix='.tmp', suffix='.pkl'
+    )
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    _fsync_dir(checkpoint_dir)
+
+    if keep > 0:
+        for _, old_path in list_checkpoints(checkpoint_dir)[:-keep]:
+            try:
+                os.remove(old_path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+    return path
+
+
+## 最新のチェックポイントを読み込む関数
+#
+#  読み込めないファイルは飛ばし, その前のチェックポイントを読み込む.
+#  @param checkpoint_dir チェックポイントのディレクトリのパス文字列
+#  @param logger 読み込めなかったファイルを報告するロガーオブジェクト
+#  @return ステップ数と状態のタプル(チェックポイントが無い場合は(None, None))
+def load_latest(checkpoint_dir, logger=None):
+    for step, path in reversed(list_checkpoints(checkpoint_dir)):
+        try:
+            with open(path, 'rb') as f:
+                return step, pickle.load(f)
+        except Exception as e:
+            if logger is not None:
+                logger.warning('failed to load %s: %r' % (path, e))
+    return None, None
@@ -0,0 +1,345 @@
+# -*- coding:utf-8 -*-
+## @package collect
+#
+#  出力ファイルを出力ディレクトリに集める処理に関するパッケージ
+#
+#  同一デバイス上ではrenameやハードリンクのようにデータを複製しない方法を優先し,
+#  いずれも利用できない場合にのみ, チャンク単位の並列コピーを行う.@n
+#  同一デバイス上ではrenameが成功し, 異なるデバイス間ではreflinkもEXDEVで失敗するため,
+#  reflinkは'auto'では試さず, renameが許可されない環境で明示的に指定した場合にのみ用いる.
+import bisect
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import threading
+
+## 集める方法の一覧(先頭から順に試す)
+METHODS = ['rename', 'hardlink', 'reflink', 'copy']
+
+## 'auto'の場合に試す方法の一覧
+AUTO_METHODS = ['rename', 'hardlink', 'copy']
+
+## reflinkを作成するioctlの番号(Linuxのlinux/fs.hにおけるFICLONE)
+FICLONE = 0x40049409
+
+## 次の方法を試すべきエラー番号
+_FALLBACK_ERRNOS = set([
+    errno.EXDEV, errno.EPERM, errno.EACCES, errno.EINVAL, errno.ENOTTY,
+    errno.EOPNOTSUPP, errno.EMLINK, errno.ENOSYS,
+])
+
+## 1回の読み書きの大きさ
+_BLOCK_SIZE = 1024 * 1024
+
+
+## 出力ファイル名に対応するファイルを列挙する関数
+#
+#  出力ファイルそのものと, 出力ファイル名に'.'で始まる拡張子が付いたファイル
+#  (例: model.ckptに対するmodel.ckpt.index)を対象とする.@n
+#  出力ファイルが多い場合に備え, 各ディレクトリは一度だけ列挙し,
+#  ソートした一覧を二分探索して拡張子の付いたファイルを探す.
+#  列挙した後に削除されたファイルは対象としない.
+#  @param output_files 出力ファイルのパス文字列のリスト
+#  @return 対象となるファイルのパス文字列のリスト(重複は含まない)
+def find_outputs(output_files):
+    listings = {}
+    outputs = []
+    found = set()
+    for output_file in output_files:
+        dir, name = os.path.split(output_file)
+        if dir not in listings:
+            listings[dir] = sorted(os.listdir(dir or os.curdir))
+        listing = listings[dir]
+        candidates = [output_file]
+        i = bisect.bisect_left(listing, name + '.')
+        while i < len(listing) and listing[i].startswith(name + '.'):
+            candidates.append(os.path.join(dir, listing[i]))
+            i += 1
+        for path in candidates:
+            if path in found:
+                continue
+            try:
+                os.lstat(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            found.add(path)
+            outputs.append(path)
+    return outputs
+
+
+## 集める方法の文字列から, 試す方法のリストを返す関数
+#
+#  'auto'の場合はAUTO_METHODSを, それ以外の場合は指定された方法以降を順に試す.
+#  @param strategy 集める方法の文字列('auto'もしくはMETHODSのいずれか)
+#  @return 試す方法のリスト
+def method_chain(strategy):
+    if strategy == 'auto':
+        return list(AUTO_METHODS)
+    return METHODS[METHODS.index(strategy):]
+
+
+## 集める先で使われていないパスを返す関数
+#
+#  異なるディレクトリにある同じ名前の出力ファイルが上書きされないように,
+#  名前が使われている場合は最初の'.'の前に番号を付加する(例: model.ckpt -> model_1.ckpt).
+#  @param dst_dir 集める先のディレクトリのパス文字列
+#  @param name ファイル名
+#  @return パス文字列
+def _free_path(dst_dir, name):
+    path = os.path.join(dst_dir, name)
+    if not os.path.lexists(path):
+        return path
+    dot = name.find('.', 1)
+    if dot < 0:
+        dot = len(name)
+    i = 1
+    while True:
+        path = os.path.join(dst_dir, '%s_%d%s' % (name[:dot], i, name[dot:]))
+        if not os.path.lexists(path):
+            return path
+        i += 1
+
+
+## ファイルもしくはディレクトリを指定ディレクトリに集める関数
+#
+#  集める先に同じ名前のファイルがある場合は, どの方法でも上書きせずに
+#  番号を付加した名前で集める(_free_path()を参照).@n
+#  コピーした場合は, チャンクごとにsha1を計算して読み直したデータと照合する
+#  (ディレクトリの場合は含まれる各ファイルについて照合する).
+#  @param src 集めるファイルのパス文字列
+#  @param dst_dir 集める先のディレクトリのパス文字列
+#  @param strategy 集める方法の文字列('auto'もしくはMETHODSのいずれか)
+#  @param jobs コピーに用いるスレッド数
+#  @param chunk_size コピーおよび照合の単位となるチャンクの大きさ
+#  @return 集めたファイルに関する情報の辞書
+def collect(
+    src, dst_dir, strategy='auto', jobs=4, chunk_size=64 * 1024 * 1024
+):
+    dst = _free_path(dst_dir, os.path.basename(src))
+    if os.path.isdir(src) and not os.path.islink(src):
+        size = _tree_size(src)
+    else:
+        try:
+            size = os.path.getsize(src)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            # リンク先の無いシンボリックリンクはリンク自体の大きさとする
+            size = os.lstat(src).st_size
+    record = {'source': src, 'path': dst, 'size': size}
+
+    for method in method_chain(strategy):
+        try:
+            if method == 'rename':
+                os.rename(src, dst)
+            elif method == 'hardlink':
+                _hardlink(src, dst)
+            elif method == 'reflink':
+                _reflink(src, dst)
+            else:
+                record['checksum'] = _copy(src, dst, jobs, chunk_size)
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS:
+                raise
+            continue
+        except IOError as e:
+            if e.errno not in _FALLBACK_ERRNOS:
+                raise
+            continue
+        record['method'] = method
+        return record
+    raise OSError(errno.EXDEV, 'failed to collect %s' % src)
+
+
+## ハードリンクを作成して元のファイルを削除する関数
+#  @param src 元のファイルのパス文字列
+#  @param dst 作成するファイルのパス文字列
+def _hardlink(src, dst):
+    if os.path.isdir(src):
+        raise OSError(errno.EPERM, 'hardlink to a directory', src)
+    os.link(src, dst)
+    os.remove(src)
+
+
+## reflink(ブロックを共有するコピー)を作成して元のファイルを削除する関数
+#  @param src 元のファイルのパス文字列
+#  @param dst 作成するファイルのパス文字列
+def _reflink(src, dst):
+    if os.path.isdir(src) or os.path.islink(src):
+        raise OSError(errno.EINVAL, 'reflink of a non-regular file', src)
+    with open(src, 'rb') as fsrc:
+        try:
+            with open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except IOError:
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+    os.remove(src)
+
+
+## ファイルをコピーして元のファイルを削除する関数
+#
+#  ファイルはチャンクに分割して複数のスレッドでコピーする.@n
+#  ディレクトリは含まれるファイルごとに同様にコピーし, シンボリックリンクは作成し直す.
+#  @param src 元のファイルのパス文字列
+#  @param dst 作成するファイルのパス文字列
+#  @param jobs コピーに用いるスレッド数
+#  @param chunk_size チャンクの大きさ
+#  @return ファイルの場合はチャンクごとのsha1を連結したもののsha1
+#  ('sha1-chunks:'を付加した文字列), ディレクトリの場合は_copy_tree()の返り値,
+#  シンボリックリンクの場合はNone
+def _copy(src, dst, jobs, chunk_size):
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), dst)
+        os.remove(src)
+        return None
+    if os.path.isdir(src):
+        checksum = _copy_tree(src, dst, jobs, chunk_size)
+        shutil.rmtree(src)
+        return checksum
+    digest = _copy_file(src, dst, jobs, chunk_size)
+    os.remove(src)
+    return 'sha1-chunks:' + digest
+
+
+## ディレクトリ以下をコピーする関数
+#
+#  元のディレクトリは削除しない. 失敗した場合はコピー先を削除する.
+#  @param src 元のディレクトリのパス文字列
+#  @param dst 作成するディレクトリのパス文字列
+#  @param jobs コピーに用いるスレッド数
+#  @param chunk_size チャンクの大きさ
+#  @return 相対パスとファイルごとのsha1の組をパス順に連結したもののsha1
+#  ('sha1-tree:'を付加した文字列)
+def _copy_tree(src, dst, jobs, chunk_size):
+    digests = []
+    try:
+        for dirpath, dirnames, filenames in os.walk(src):
+            rel = os.path.relpath(dirpath, src)
+            os.mkdir(os.path.normpath(os.path.join(dst, rel)))
+            for name in dirnames + filenames:
+                sp = os.path.join(dirpath, name)
+                dp = os.path.normpath(os.path.join(dst, rel, name))
+                if os.path.islink(sp):
+                    os.symlink(os.readlink(sp), dp)
+                elif not os.path.isdir(sp):
+                    digest = _copy_file(sp, dp, jobs, chunk_size)
+                    digests.append(
+                        os.path.normpath(os.path.join(rel, name)) + '\0' +
+                        digest
+                    )
+            shutil.copystat(dirpath, os.path.join(dst, rel))
+    except Exception:
+        shutil.rmtree(dst, ignore_errors=True)
+        raise
+    digests.sort()
+    return 'sha1-tree:' + hashlib.sha1('\n'.join(digests)).hexdigest()
+
+
+## ファイルをチャンクに分割して並列にコピーし, 読み直して照合する関数
+#
+#  元のファイルは削除しない. 失敗した場合はコピー先を削除する.
+#  @param src 元のファイルのパス文字列
+#  @param dst 作成するファイルのパス文字列
+#  @param jobs コピーに用いるスレッド数
+#  @param chunk_size チャンクの大きさ
+#  @return チャンクごとのsha1を連結したもののsha1(16進数の文字列)
+def _copy_file(src, dst, jobs, chunk_size):
+    size = os.path.getsize(src)
+    offsets = range(0, size, chunk_size) or [0]
+    digests = [None] * len(offsets)
+    errors = []
+    with open(dst, 'wb') as f:
+        f.truncate(size)
+
+    def worker(indices):
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'r+b') as fdst:
+                for i in indices:
+                    digests[i] = _copy_chunk(
+                        fsrc, fdst, offsets[i], chunk_size
+                    )
+        except Exception as e:
+            errors.append(e)
+
+    jobs = max(1, min(jobs, len(offsets)))
+    threads = [
+        threading.Thread(target=worker, args=(range(i, len(offsets), jobs),))
+        for i in range(jobs)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        os.remove(dst)
+        raise errors[0]
+
+    # コピー先を読み直して照合する
+    with open(dst, 'rb') as fdst:
+        for i, offset in enumerate(offsets):
+            if _hash_chunk(fdst, offset, chunk_size) != digests[i]:
+                os.remove(dst)
+                raise IOError(
+                    errno.EIO, 'checksum mismatch while copying %s' % src
+                )
+
+    shutil.copystat(src, dst)
+    return hashlib.sha1(''.join(digests)).hexdigest()
+
+
+## 1つのチャンクをコピーする関数
+#  @param fsrc 元のファイルオブジェクト
+#  @param fdst コピー先のファイルオブジェクト
+#  @param offset チャンクの先頭位置
+#  @param chunk_size チャンクの大きさ
+#  @return チャンクのsha1(バイト列)
+def _copy_chunk(fsrc, fdst, offset, chunk_size):
+    h = hashlib.sha1()
+    fsrc.seek(offset)
+    fdst.seek(offset)
+    remain = chunk_size
+    while remain > 0:
+        buf = fsrc.read(min(_BLOCK_SIZE, remain))
+        if not buf:
+            break
+        h.update(buf)
+        fdst.write(buf)
+        remain -= len(buf)
+    return h.digest()
+
+
+## 1つのチャンクのsha1を計算する関数
+#  @param f ファイルオブジェクト
+#  @param offset チャンクの先頭位置
+#  @param chunk_size チャンクの大きさ
+#  @return チャンクのsha1(バイト列)
+def _hash_chunk(f, offset, chunk_size):
+    h = hashlib.sha1()
+    f.seek(offset)
+    remain = chunk_size
+    while remain > 0:
+        buf = f.read(min(_BLOCK_SIZE, remain))
+        if not buf:
+            break
+        h.update(buf)
+        remain -= len(buf)
+    return h.digest()
+
+
+## ディレクトリ以下のファイルの合計サイズを返す関数
+#  @param path ディレクトリのパス文字列
+#  @return 合計サイズ
+def _tree_size(path):
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for fn in filenames:
+            fp = os.path.join(dirpath, fn)
+            if not os.path.islink(fp):
+                size += os.path.getsize(fp)
+    return size
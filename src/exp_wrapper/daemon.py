@@ -0,0 +1,263 @@
+# -*- coding:utf-8 -*-
+## @package daemon
+#
+#  対象のモジュールをimportした状態のプロセスを常駐させ,
+#  Unixソケット経由で受け付けた実行要求をforkした子プロセスで処理するためのパッケージ
+#
+#  インタプリタの起動やimportの時間を実行ごとに支払わずに済む.@n
+#  要求は1行のjson({"argv": [...], "cwd": "..."})であり,
+#  子プロセスの標準出力と標準エラー出力はそのままソケットに書き込まれ,
+#  最後に終了コードを表すトレーラ('\\0exit=<終了コード>\\n')が送られる.@n
+#  起動後に対象のスクリプトが変更された場合に古いコードで実行しないように,
+#  起動時のスクリプトのmtimeとハッシュ値(script_stamp())を要求ごとに照合し,
+#  変わっていれば子プロセスでimportし直す(reload_script()).
+import errno
+import hashlib
+import imp
+import json
+import os
+import random
+import re
+import signal
+import socket
+import sys
+import traceback
+
+from exp_wrapper import forkrun, logutil
+
+## 終了コードを表すトレーラの書式
+TRAILER_FORMAT = '\0exit=%d\n'
+
+_TRAILER_PATTERN = re.compile(r'\x00exit=(-?\d+)\n$')
+
+## トレーラの最大長
+_TRAILER_MAX = 32
+
+## 要求を待つ間に終了した子プロセスを回収する間隔(秒)
+REAP_INTERVAL = 1.0
+
+
+## スクリプトの内容を識別する値を返す関数
+#  @param path スクリプトのパス文字列
+#  @return mtimeとsha1のタプル(読み込めない場合はNone)
+def script_stamp(path):
+    try:
+        with open(path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        return os.path.getmtime(path), digest
+    except (IOError, OSError):
+        return None
+
+
+## スクリプトをモジュールとしてimportし直す関数
+#
+#  .pycはmtimeが変わらない変更を検出できないため, ソースから実行する.
+#  sys.modulesを置き換えるため, 以降の__import__()は新しいモジュールを返す.
+#  @param path スクリプトのパス文字列
+#  @param module_name モジュール名
+#  @return モジュールオブジェクト
+def reload_script(path, module_name):
+    with open(path, 'rb') as f:
+        code = compile(f.read(), path, 'exec')
+    module = imp.new_module(module_name)
+    module.__file__ = path
+    sys.modules[module_name] = module
+    exec code in module.__dict__
+    return module
+
+
+## ソケットファイルを使用しているデーモンが存在するかを判定する関数
+#
+#  接続できないソケットファイルは前回のデーモンの残骸であるため削除する.
+#  @param socket_path ソケットファイルのパス文字列
+#  @return デーモンが存在する場合はTrue
+def is_running(socket_path):
+    if not os.path.exists(socket_path):
+        return False
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(socket_path)
+    except socket.error as e:
+        if e.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+            raise
+        os.remove(socket_path)
+        return False
+    finally:
+        s.close()
+    return True
+
+
+## 子プロセスの終了を回収する関数
+#  @param children 子プロセスのpidの集合
+#  @param block 子プロセスが終了するまで待つかどうかのbool変数
+def _reap(children, block=False):
+    while children:
+        try:
+            pid, _ = os.waitpid(-1, 0 if block else os.WNOHANG)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            if e.errno == errno.ECHILD:
+                children.clear()
+                return
+            raise
+        if pid == 0:
+            return
+        children.discard(pid)
+        block = False
+
+
+## 1行のjsonの要求を読み込む関数
+#  @param conn 接続済みのソケット
+#  @return 要求の辞書(要求を送らずに切断された場合はNone)
+def _read_request(conn):
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = conn.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    if not data.strip():
+        return None
+    # コマンドライン引数はutf-8のstrとして渡す
+    return forkrun.native_str(json.loads(data.decode('utf-8')))
+
+
+## forkした子プロセスで要求を処理する関数
+#
+#  作業ディレクトリを要求元のものに変更し, 標準出力と標準エラー出力をソケットにつなぐ.@n
+#  親プロセスから引き継いだ乱数の状態は再初期化する.
+#  @param conn 接続済みのソケット
+#  @param handler コマンドライン引数のリストを受け取って実行する関数
+def _serve_request(conn, handler):
+    code = 1
+    try:
+        request = _read_request(conn)
+        if request is None:
+            # is_running()による接続の確認
+            os._exit(0)
+        os.chdir(request['cwd'])
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.close(devnull)
+        os.dup2(conn.fileno(), 1)
+        os.dup2(conn.fileno(), 2)
+        random.seed()
+        if 'numpy' in sys.modules:
+            sys.modules['numpy'].random.seed()
+        try:
+            handler(request['argv'])
+            code = 0
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                sys.stderr.write('%s\n' % e.code)
+    except Exception:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            conn.sendall(TRAILER_FORMAT % code)
+        finally:
+            os._exit(code)
+
+
+## デーモンを実行する関数
+#
+#  受け付けた要求ごとに子プロセスをforkして処理する.
+#  同時に実行する子プロセスの数はjobsに制限され, 上限に達した場合は
+#  いずれかの子プロセスが終了するまで次の要求を受け付けない.@n
+#  要求が来ない間もゾンビプロセスが残らないように,
+#  accept()はREAP_INTERVALごとにタイムアウトして終了した子プロセスを回収する.@n
+#  SIGTERMもしくはSIGINTを受け取ると, ソケットファイルを削除して終了する.
+#  @param socket_path ソケットファイルのパス文字列
+#  @param handler コマンドライン引数のリストを受け取って実行する関数
+#  @param jobs 同時に実行する子プロセスの数の上限
+#  @param logger ロガーオブジェクト
+def serve(socket_path, handler, jobs, logger):
+    if is_running(socket_path):
+        raise RuntimeError('daemon is already running on %s' % socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(128)
+    server.settimeout(REAP_INTERVAL)
+    children = set()
+
+    def terminate(signum, frame):
+        sys.exit(0)
+    old_handlers = [
+        (s, signal.signal(s, terminate))
+        for s in (signal.SIGTERM, signal.SIGINT)
+    ]
+    logger.info('listening on %s with %d jobs' % (socket_path, jobs))
+    try:
+        while True:
+            _reap(children, block=len(children) >= jobs)
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                continue
+            except socket.error as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            sys.stdout.flush()
+            sys.stderr.flush()
+            logutil.before_fork()
+            pid = os.fork()
+            if pid == 0:
+                logutil.after_fork()
+                server.close()
+                conn.settimeout(None)
+                for s, old in old_handlers:
+                    signal.signal(s, signal.SIG_DFL)
+                _serve_request(conn, handler)
+            conn.close()
+            children.add(pid)
+    finally:
+        for s, old in old_handlers:
+            signal.signal(s, old)
+        server.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        _reap(children, block=True)
+        logger.info('daemon on %s has been stopped' % socket_path)
+
+
+## デーモンに実行を要求する関数
+#
+#  子プロセスの出力を受け取った順に出力先に書き込み, 終了コードを返す.
+#  @param socket_path ソケットファイルのパス文字列
+#  @param argv 実行するコマンドライン引数のリスト
+#  @param out 出力先のファイルオブジェクト
+#  @return 終了コード(トレーラを受け取れなかった場合は1)
+def request(socket_path, argv, out=sys.stdout):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.connect(socket_path)
+    try:
+        s.sendall(json.dumps({'argv': argv, 'cwd': os.getcwd()}) + '\n')
+        # トレーラが分割されて届く場合に備え, 末尾は書き込まずに保持する
+        pending = b''
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            pending += chunk
+            if len(pending) > _TRAILER_MAX:
+                out.write(pending[:-_TRAILER_MAX])
+                out.flush()
+                pending = pending[-_TRAILER_MAX:]
+    finally:
+        s.close()
+    match = _TRAILER_PATTERN.search(pending)
+    if match is None:
+        out.write(pending)
+        out.flush()
+        return 1
+    out.write(pending[:match.start()])
+    out.flush()
+    return int(match.group(1))
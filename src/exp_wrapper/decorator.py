@@ -1,5 +1,6 @@
 # -*- coding:utf-8 -*-
 import functools
+from exp_wrapper import template
 
 
 def arg_decorator(name):
@@ -8,7 +9,9 @@ def arg_decorator(name):
         def wrapper(self, *args, **kwargs):
             if not hasattr(self, 'parents_dict'):
                 self.parents_dict = {}
-            parser = func(self, *args, **kwargs)
+            parser = template.cached_parser(
+                self, name, lambda: func(self, *args, **kwargs)
+            )
             self.parents_dict[name] = parser
         return wrapper
     return _arg_decorator
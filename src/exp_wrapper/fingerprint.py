@@ -0,0 +1,260 @@
+# -*- coding:utf-8 -*-
+## @package fingerprint
+#
+#  入力ファイルの内容のハッシュ値(フィンガープリント)の計算に関するパッケージ
+#
+#  ファイルはチャンクに分割し, 各チャンクをmmapして複数のスレッドでsha1を計算する.
+#  フィンガープリントはチャンクごとのsha1を連結したもののsha1であり,
+#  collect.collect()でコピーした場合のchecksumと同じ形式('sha1-chunks:<16進数>')である.@n
+#  計算結果は(デバイス, inode, サイズ, mtime)をキーとしてキャッシュに保存するため,
+#  変更されていない大きなデータセットのハッシュ値の計算は一度で済む.@n
+#  ディレクトリのフィンガープリント('sha1-tree:<16進数>')は, 含まれるファイルの
+#  相対パスとフィンガープリントの一覧のsha1である.
+import errno
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import threading
+
+## キャッシュを置くディレクトリの名前(実験のルートディレクトリ以下に作成される)
+FINGERPRINT_DIRNAME = '.fingerprints'
+
+## ハッシュ値を計算する単位となるチャンクの大きさ(collect.collect()の既定値と同じ)
+CHUNK_SIZE = 64 * 1024 * 1024
+
+## ファイルのフィンガープリントの形式を表すprefix
+PREFIX = 'sha1-chunks:'
+
+## ディレクトリのフィンガープリントの形式を表すprefix
+TREE_PREFIX = 'sha1-tree:'
+
+
+## (デバイス, inode, サイズ, mtime)からキャッシュのキーを計算する関数
+#  @param st os.stat()の結果
+#  @param chunk_size チャンクの大きさ
+#  @return キーとなる16進数の文字列
+def stat_key(st, chunk_size=CHUNK_SIZE):
+    return hashlib.sha1('%d:%d:%d:%r:%d' % (
+        st.st_dev, st.st_ino, st.st_size, st.st_mtime, chunk_size
+    )).hexdigest()
+
+
+## フィンガープリントのキャッシュを扱うクラス
+#
+#  エントリはcache_dir/<キーの先頭2文字>/<キー>.jsonに保存される.
+#  ファイルが変更されるとキーが変わるため, 古いエントリは参照されなくなる.
+class FingerprintCache(object):
+    ## コンストラクタ
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param cache_dir キャッシュのディレクトリのパス文字列
+    def __init__(self, cache_dir):
+        ## @var cache_dir
+        #  キャッシュのディレクトリのパス文字列
+        self.cache_dir = cache_dir
+
+    ## キーに対応するエントリのパスを返すメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param key キャッシュのキー
+    #  @return エントリのパス文字列
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    ## キーに対応するフィンガープリントを返すメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param key キャッシュのキー
+    #  @return フィンガープリントの文字列(存在しない場合はNone)
+    def get(self, key):
+        try:
+            with open(self.entry_path(key), 'r') as f:
+                return json.load(f)['fingerprint']
+        except (IOError, ValueError, KeyError):
+            return None
+
+    ## フィンガープリントを保存するメソッド
+    #
+    #  並列実行時に不完全なエントリが読まれないように,
+    #  一時ファイルに書き込んだ後にrenameする.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param key キャッシュのキー
+    #  @param path ファイルのパス文字列
+    #  @param value フィンガープリントの文字列
+    def put(self, key, path, value):
+        entry_dir = os.path.dirname(self.entry_path(key))
+        try:
+            os.makedirs(entry_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'path': path, 'fingerprint': value}, f, indent=4)
+        os.rename(tmp_path, self.entry_path(key))
+
+
+## 1つのチャンクをmmapしてsha1を計算する関数
+#  @param fd ファイル記述子
+#  @param offset チャンクの先頭位置(mmap.ALLOCATIONGRANULARITYの倍数)
+#  @param length チャンクの大きさ
+#  @return チャンクのsha1(バイト列)
+def _hash_chunk(fd, offset, length):
+    h = hashlib.sha1()
+    if length > 0:
+        m = mmap.mmap(fd, length, access=mmap.ACCESS_READ, offset=offset)
+        try:
+            # 大きなデータに対するupdate()はGILを解放するため, スレッドで並列に計算できる
+            h.update(m)
+        finally:
+            m.close()
+    return h.digest()
+
+
+## 複数のファイルのフィンガープリントを並列に計算する関数
+#
+#  全てのファイルのチャンクをjobs個のスレッドに分配する.
+#  @param paths ファイルのパス文字列のリスト
+#  @param jobs スレッド数
+#  @param chunk_size チャンクの大きさ
+#  @return パス文字列をキーとし, フィンガープリントを値とする辞書
+def hash_files(paths, jobs=4, chunk_size=CHUNK_SIZE):
+    tasks = []
+    sizes = {}
+    for path in paths:
+        size = os.path.getsize(path)
+        sizes[path] = size
+        for offset in range(0, size, chunk_size) or [0]:
+            tasks.append((path, offset, min(chunk_size, size - offset)))
+    digests = {}
+    errors = []
+    lock = threading.Lock()
+
+    def worker(indices):
+        fds = {}
+        try:
+            for i in indices:
+                path, offset, length = tasks[i]
+                if path not in fds:
+                    fds[path] = os.open(path, os.O_RDONLY)
+                digest = _hash_chunk(fds[path], offset, length)
+                with lock:
+                    digests[(path, offset)] = digest
+        except Exception as e:
+            errors.append(e)
+        finally:
+            for fd in fds.values():
+                os.close(fd)
+
+    jobs = max(1, min(jobs, len(tasks)))
+    # 同じファイルのチャンクが同じスレッドに偏らないように, 交互に分配する
+    threads = [
+        threading.Thread(target=worker, args=(range(i, len(tasks), jobs),))
+        for i in range(jobs)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+    results = {}
+    for path in paths:
+        chunks = ''.join(
+            digests[(path, offset)]
+            for offset in range(0, sizes[path], chunk_size) or [0]
+        )
+        results[path] = PREFIX + hashlib.sha1(chunks).hexdigest()
+    return results
+
+
+## ディレクトリ以下のファイルを列挙する関数
+#  @param path ディレクトリのパス文字列
+#  @return 相対パスとパスのタプルのリスト(相対パス順)
+def _list_files(path):
+    files = []
+    for dirpath, dirnames, filenames in os.walk(path, followlinks=True):
+        dirnames.sort()
+        for fn in filenames:
+            fp = os.path.join(dirpath, fn)
+            if os.path.isfile(fp):
+                files.append((os.path.relpath(fp, path), fp))
+    return sorted(files)
+
+
+## 入力ファイルのフィンガープリントを計算する関数
+#
+#  キャッシュに無いファイルのみを読み込み, 計算結果をキャッシュに保存する.@n
+#  存在しないパスは対象としない(make_symboliclinkと同様).
+#  @param inputs 名前をキーとし, ファイルもしくはディレクトリのパス文字列を値とする辞書
+#  @param cache_dir キャッシュのディレクトリのパス文字列(Noneの場合はキャッシュしない)
+#  @param jobs スレッド数
+#  @return 名前をキーとし, フィンガープリントの情報の辞書を値とする辞書
+def fingerprint(inputs, cache_dir=None, jobs=4):
+    fp_cache = FingerprintCache(cache_dir) if cache_dir is not None else None
+    targets = {}
+    for name, path in inputs.items():
+        if not isinstance(path, basestring) or not os.path.exists(path):
+            continue
+        if os.path.isdir(path):
+            targets[name] = _list_files(path)
+        else:
+            targets[name] = [(None, path)]
+
+    # キャッシュに無いファイルのみを読み込む
+    values = {}
+    keys = {}
+    missing = []
+    for files in targets.values():
+        for _, path in files:
+            real_path = os.path.realpath(path)
+            if real_path in values or real_path in keys:
+                continue
+            key = stat_key(os.stat(real_path))
+            value = fp_cache.get(key) if fp_cache is not None else None
+            if value is None:
+                keys[real_path] = key
+                missing.append(real_path)
+            else:
+                values[real_path] = value
+    if missing:
+        computed = hash_files(missing, jobs)
+        for real_path, value in computed.items():
+            values[real_path] = value
+            # 計算中に変更されたファイルはキャッシュしない
+            if fp_cache is not None and \
+                    stat_key(os.stat(real_path)) == keys[real_path]:
+                fp_cache.put(keys[real_path], real_path, value)
+
+    results = {}
+    for name, files in targets.items():
+        path = inputs[name]
+        if files and files[0][0] is None:
+            results[name] = {
+                'path': os.path.abspath(path),
+                'size': os.path.getsize(path),
+                'fingerprint': values[os.path.realpath(path)],
+            }
+            continue
+        listing = ''.join(
+            '%s\0%s\n' % (rel, values[os.path.realpath(fp)])
+            for rel, fp in files
+        )
+        results[name] = {
+            'path': os.path.abspath(path),
+            'size': sum(os.path.getsize(fp) for _, fp in files),
+            'files': len(files),
+            'fingerprint': TREE_PREFIX + hashlib.sha1(listing).hexdigest(),
+        }
+    return results
+
+
+## フィンガープリントの情報から名前とフィンガープリントのみの辞書を生成する関数
+#
+#  キャッシュのキー(cache.make_key()のextra)に用いる.
+#  @param fingerprints fingerprint()の戻り値
+#  @return 名前をキーとし, フィンガープリントの文字列を値とする辞書
+def digests(fingerprints):
+    return dict(
+        (name, info['fingerprint']) for name, info in fingerprints.items()
+    )
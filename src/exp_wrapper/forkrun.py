@@ -0,0 +1,118 @@
+# -*- coding:utf-8 -*-
+## @package forkrun
+#
+#  forkした子プロセスで1回分の実験を実行し, その結果をパイプで受け取るためのパッケージ
+#
+#  子プロセスは実行したハンドラの返り値(出力ディレクトリのパスとerrorに関する文字列)を
+#  jsonとしてパイプに書き込んで終了する. execute()で発生した例外は終了コードに
+#  反映されないため, 実行の状態はパイプで受け取ったerrorから判定する.
+import errno
+import json
+import os
+import random
+import sys
+import traceback
+
+from exp_wrapper import logutil, rundir
+
+
+## jsonから読み込んだ文字列をutf-8のstrに変換する関数
+#
+#  Python 2のjson.load()は文字列をunicodeとして返すが, argparseのtype=strは
+#  ASCII以外の文字を含むunicodeを変換できないため, コマンドライン引数はstrとして渡す.
+#  @param value 変換する値(リストおよび辞書の要素も再帰的に変換する)
+#  @return 変換後の値
+def native_str(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [native_str(v) for v in value]
+    if isinstance(value, dict):
+        return dict(
+            (native_str(k), native_str(v)) for k, v in value.items()
+        )
+    return value
+
+
+## 子プロセスで実験を実行する関数
+#
+#  親プロセスから引き継いだ乱数の状態とロガーのロックは再初期化する.
+#  @param handler コマンドライン引数のリストを受け取って実行し,
+#  出力ディレクトリのパス文字列とerrorに関する文字列を返す関数
+#  @param argv コマンドライン引数のリスト
+#  @param cwd 作業ディレクトリ(Noneの場合は変更しない)
+#  @return 子プロセスのpidとパイプの読み込み側のファイル記述子
+def spawn(handler, argv, cwd=None):
+    r, w = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    logutil.before_fork()
+    pid = os.fork()
+    if pid != 0:
+        os.close(w)
+        return pid, r
+    code = 1
+    try:
+        logutil.after_fork()
+        os.close(r)
+        if cwd is not None:
+            rundir.makedirs(cwd)
+            os.chdir(cwd)
+        random.seed()
+        if 'numpy' in sys.modules:
+            sys.modules['numpy'].random.seed()
+        output_dir, error_str = handler(argv)
+        if output_dir is not None:
+            output_dir = os.path.abspath(output_dir)
+        os.write(w, json.dumps({'output_dir': output_dir, 'error': error_str}))
+        code = 0
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else int(bool(e.code))
+    except Exception:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+## パイプから子プロセスの実行結果を読み込む関数
+#  @param fd パイプの読み込み側のファイル記述子
+#  @return 実行結果の辞書(書き込まれていない場合は空の辞書)
+def read_result(fd):
+    data = b''
+    while True:
+        chunk = os.read(fd, 4096)
+        if not chunk:
+            break
+        data += chunk
+    os.close(fd)
+    if not data:
+        return {}
+    return native_str(json.loads(data))
+
+
+## 子プロセスの終了を待つ関数
+#  @param pid 待つ子プロセスのpid(-1の場合はいずれかの子プロセス)
+#  @return 終了した子プロセスのpidと終了コード(シグナルで終了した場合は128+シグナル番号)
+def wait(pid=-1):
+    while True:
+        try:
+            pid, status = os.waitpid(pid, 0)
+            break
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
+    if os.WIFSIGNALED(status):
+        return pid, 128 + os.WTERMSIG(status)
+    return pid, os.WEXITSTATUS(status)
+
+
+## 実行結果と終了コードから実行の状態を返す関数
+#  @param result read_result()で読み込んだ実行結果の辞書
+#  @param code 終了コード
+#  @return 'ok', エラー名もしくは'exit=<終了コード>'
+def status(result, code):
+    if code != 0 or 'output_dir' not in result:
+        return 'exit=%d' % code
+    return result.get('error') or 'ok'
@@ -2,10 +2,29 @@
 ## @package gitlog
 #
 #  Gitに関するパッケージ
+#
+#  GitPythonのimportには時間がかかるため, リポジトリを参照する関数の中でimportする.
 import datetime
 import codecs
+import errno
+import gzip
+import hashlib
+import json
 import os
-import git
+import re
+import tempfile
+import threading
+import time
+
+
+## コミットログにおいて差分の直前に置かれる見出し
+DIFF_HEADER = u'Diff: 実行時のソースコードと上記コミットとの差分\n'
+
+## 差分保存ディレクトリへの参照を表す行の接頭辞
+DIFF_STORE_PREFIX = u'@diffstore '
+
+## 差分保存ディレクトリの名前(実験のルートディレクトリ以下に作成される)
+DIFF_STORE_DIRNAME = '.diffs'
 
 
 ## Gitのコミットログを扱うためのクラス
@@ -30,6 +49,28 @@ class gitlog(object):
             self.latest_commit = None
             raise e
 
+    ## コミットログの文字列を生成するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @return コミットログの文字列(最新のコミットが存在しない場合はNone)
+    def make_commit_text(self):
+        if self.latest_commit is None:
+            return None
+        hash_line = u'ハッシュID: %s \n' % (self.latest_commit.hexsha)
+        message_line = u'メッセージ: %s' % (self.latest_commit.message)
+        committed_date = self.latest_commit.committed_date
+        committed_date = datetime.datetime.fromtimestamp(committed_date)
+        committed_date_line = u'コミット日時: %s \n' % (committed_date)
+        stats_line = DIFF_HEADER + \
+            (self.repo.git.diff(self.latest_commit.tree))
+
+        return u''.join([
+            hash_line,
+            message_line,
+            committed_date_line,
+            u'----------------\n',
+            stats_line
+        ])
+
     ## コミットログをファイル出力するメソッド
     #
     #  メンバ変数
@@ -37,42 +78,132 @@ class gitlog(object):
     #  @param f コミットログの出力先のファイルオブジェクト
     #  @param verbose 処理内容の詳細表示を行うかどうかのbool変数
     def write_commit(self, f, verbose=False):
-        if self.latest_commit is None:
+        commit_text = self.make_commit_text()
+        if commit_text is None:
             if verbose:
                 print '最新のコミットが存在しません'
             return
-        hash_line = u'ハッシュID: %s \n' % (self.latest_commit.hexsha)
-        message_line = u'メッセージ: %s' % (self.latest_commit.message)
-        committed_date = self.latest_commit.committed_date
-        committed_date = datetime.datetime.fromtimestamp(committed_date)
-        committed_date_line = u'コミット日時: %s \n' % (committed_date)
-        stats_line = u'Diff: 実行時のソースコードと上記コミットとの差分\n%s' % \
-            (self.repo.git.diff(self.latest_commit.tree))
 
-        f.write(hash_line)
-        f.write(message_line)
-        f.write(committed_date_line)
-        f.write('----------------\n')
-        f.write(stats_line)
+        f.write(commit_text)
         if verbose:
             print u'%s の書き込みに成功しました' % f.name
             print '============'
-            print hash_line
-            print message_line
-            print committed_date_line
-            print stats_line
+            print commit_text
             print '============'
 
 
+## make_repo()で解決したリポジトリのプロセス内キャッシュ
+#
+#  スクリプトの絶対パスをキーとし, (リポジトリの状態, リポジトリオブジェクト)を保持する.
+_repo_cache = {}
+
+
+## make_repo()で解決したリポジトリのディスクキャッシュのパス文字列を返す関数
+#  @return キャッシュファイルのパス文字列
+def repo_cache_path():
+    cache_home = os.environ.get(
+        'XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')
+    )
+    return os.path.join(cache_home, 'exp_wrapper', 'repo_cache.json')
+
+
+## キャッシュの有効性の判定に用いるリポジトリの状態を返す関数
+#
+#  同じパスにリポジトリを移動もしくはcloneし直した場合にも検出できるように,
+#  indexファイルのmtimeに加えて.gitディレクトリのinodeとHEADファイルのmtimeを含める.
+#  @param git_dir リポジトリの.gitディレクトリのパス文字列
+#  @return (デバイス, inode, indexのmtime, HEADのmtime)のリスト(存在しない場合はNone)
+def _repo_stamp(git_dir):
+    try:
+        st = os.stat(git_dir)
+        return [
+            st.st_dev, st.st_ino,
+            os.path.getmtime(os.path.join(git_dir, 'index')),
+            os.path.getmtime(os.path.join(git_dir, 'HEAD')),
+        ]
+    except OSError:
+        return None
+
+
+## ディスクキャッシュを読み込む関数
+#  @param cache_path キャッシュファイルのパス文字列
+#  @return キャッシュの辞書
+def _load_repo_cache(cache_path):
+    try:
+        with open(cache_path, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+## ディスクキャッシュにリポジトリの情報を追加する関数
+#
+#  並列実行時に不完全なファイルが読まれないように,
+#  一時ファイルに書き込んだ後にrenameする.
+#  書き込みに失敗してもリポジトリの解決には影響しないため, 例外は無視する.
+#  @param cache_path キャッシュファイルのパス文字列
+#  @param script_abspath スクリプトの絶対パス文字列
+#  @param repo リポジトリオブジェクト
+#  @param stamp _repo_stamp()で得たリポジトリの状態
+def _store_repo_cache(cache_path, script_abspath, repo, stamp):
+    try:
+        cache_dir = os.path.dirname(cache_path)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        cache = _load_repo_cache(cache_path)
+        cache[script_abspath] = {
+            'working_dir': repo.working_dir,
+            'git_dir': repo.git_dir,
+            'stamp': stamp,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache, f)
+        os.rename(tmp_path, cache_path)
+    except (IOError, OSError):
+        pass
+
+
 ## 指定ディレクトリより下の階層に存在するリポジトリを示すオブジェクトを生成する関数
 #
 #  引数script_pathで指定されたディレクトリから引数depthの深さまでリポジトリの探索を行う.@n
-#  探索範囲内にGitリポジトリが存在する場合には対応するリポジトリオブジェクトを返すが,
-#  存在しない場合にはNoneを返す.
+#  探索範囲内にGitリポジトリが存在し, スクリプトがそのリポジトリで管理されている場合には
+#  対応するリポジトリオブジェクトを返すが, 存在しない場合にはNoneを返す.@n
+#  スクリプトが管理されているかどうかは, リポジトリからの相対パスがindexに
+#  含まれるかどうかで判定する.@n
+#  解決したリポジトリはスクリプトのパスをキーとしてプロセス内およびディスクにキャッシュし,
+#  リポジトリの状態(_repo_stamp())が変わるまで探索を省略する.
 #  @param script_path 探索を行いたいディレクトリの文字列
 #  @param depth 探索を行う深さ
+#  @param cache_path ディスクキャッシュのパス文字列
+#  (Noneの場合はrepo_cache_path(), Falseの場合はディスクキャッシュを用いない)
 #  @return リポジトリを示すオブジェクト(存在しなかった場合はNone)
-def make_repo(script_path, depth=5):
+def make_repo(script_path, depth=5, cache_path=None):
+    import git
+    # デーモンやワーカーは実行ごとにchdirするため, パスは呼び出し時に解決する
+    if cache_path is None:
+        cache_path = repo_cache_path()
+    script_abspath = os.path.realpath(os.path.abspath(script_path))
+
+    # プロセス内キャッシュの参照
+    cached = _repo_cache.get(script_abspath)
+    if cached is not None:
+        stamp, repo = cached
+        if stamp is not None and stamp == _repo_stamp(repo.git_dir):
+            return repo
+
+    # ディスクキャッシュの参照
+    if cache_path is not False:
+        entry = _load_repo_cache(cache_path).get(script_abspath)
+        stamp = None if entry is None else entry.get('stamp')
+        if stamp is not None and stamp == _repo_stamp(entry['git_dir']):
+            try:
+                repo = git.Repo(entry['working_dir'])
+                _repo_cache[script_abspath] = (stamp, repo)
+                return repo
+            except (git.exc.InvalidGitRepositoryError, git.exc.NoSuchPathError):
+                pass
+
     dir = os.path.dirname(script_path)
     path = os.path.abspath(dir)
     repo_exist = False
@@ -87,69 +218,251 @@ def make_repo(script_path, depth=5):
     if not repo_exist:
         return None
 
-    tracked_files = [
-        os.path.join(repo.working_dir, fn[0])
-        for fn in repo.index.entries.keys()
-    ]
-
-    script_abspath = os.path.abspath(script_path)
-
-    right_repo = False
-    for tracked_file in tracked_files:
-        if os.path.samefile(tracked_file, script_abspath):
-            right_repo = True
-            break
+    working_dir = os.path.realpath(repo.working_dir)
+    relpath = os.path.relpath(script_abspath, working_dir)
+    if relpath.startswith(os.pardir + os.sep):
+        return None
+    relpath = relpath.replace(os.sep, '/')
 
-    if not right_repo:
+    # indexのエントリは(パス, ステージ)をキーとする辞書である
+    entries = repo.index.entries
+    if not any((relpath, stage) in entries for stage in range(4)):
         return None
 
+    stamp = _repo_stamp(repo.git_dir)
+    _repo_cache[script_abspath] = (stamp, repo)
+    if cache_path is not False:
+        _store_repo_cache(cache_path, script_abspath, repo, stamp)
+
     return repo
 
 
 ## 指定したディレクトリ以下に存在するリポジトリの指定ブランチに関して
-#  最新コミットのログをファイル出力する関数
+#  最新コミットのログ文字列を生成する関数
 #
+#  パラメータスイープのように複数の実行でコミットログを共有する場合には,
+#  本関数で一度だけログを生成し, save_commitlog()で各出力先に書き込む.
 #  @param script_path コミットログを残したいスクリプトのパス文字列
-#  @param filepath コミットログファイルの出力先パスの文字列
 #  @param branch ログをとる対象となるブランチオブジェクト
 #  @param verbose 処理内容の詳細表示を行うかどうかのbool変数
-def write_commitlog(
-    script_path, filepath=None, branch=None, verbose=False
-):
+#  @return コミットログの文字列(リポジトリが存在しない場合や失敗した場合はNone)
+def make_commitlog(script_path, branch=None, verbose=False):
     # リポジトリの取得
     repo = make_repo(script_path)
     # リポジトリが存在しない場合は終了
     if repo is None:
         if verbose:
             print 'リポジトリが存在しません'
-        return
+        return None
     # ブランチの設定
     if branch is None:
         branch = repo.active_branch.name
 
+    try:
+        # gitlogインスタンスを生成
+        glog = gitlog(repo, branch)
+        return glog.make_commit_text()
+    except Exception as e:
+        print e.message
+        print 'コミットログの取得に失敗しました'
+        return None
+
+
+## コミットログの文字列をバックグラウンドで生成するスレッドクラス
+#
+#  差分の大きいリポジトリではgit diffに時間がかかるため,
+#  実験の実行と並行してコミットログを生成する.
+class CommitlogCapture(threading.Thread):
+    ## コンストラクタ
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param script_path コミットログを残したいスクリプトのパス文字列
+    #  @param branch ログをとる対象となるブランチオブジェクト
+    def __init__(self, script_path, branch=None):
+        super(CommitlogCapture, self).__init__(name='CommitlogCapture')
+        # 生成が終わらない場合でもプロセスの終了を妨げないようにする
+        self.daemon = True
+        ## @var script_path
+        #  コミットログを残したいスクリプトのパス文字列
+        self.script_path = script_path
+        ## @var branch
+        #  ログをとる対象となるブランチオブジェクト
+        self.branch = branch
+        ## @var commitlog
+        #  生成したコミットログの文字列
+        self.commitlog = None
+        ## @var status
+        #  生成の状態を表す文字列('running', 'ok', 'unavailable', 'failed')
+        self.status = 'running'
+        ## @var elapsed
+        #  生成に要した時間(秒)
+        self.elapsed = None
+
+    ## コミットログを生成するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    def run(self):
+        start = time.time()
+        try:
+            self.commitlog = make_commitlog(self.script_path, self.branch)
+            if self.commitlog is None:
+                self.status = 'unavailable'
+            else:
+                self.status = 'ok'
+        except Exception:
+            self.status = 'failed'
+        self.elapsed = time.time() - start
+
+    ## 生成の終了を待ち, 結果を返すメソッド
+    #
+    #  timeoutまでに生成が終わらない場合は, コミットログをNoneとし,
+    #  状態を'timeout'とする.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param timeout 待ち時間の上限(秒, Noneの場合は無制限)
+    #  @return コミットログの文字列と, 生成の状態を表す辞書
+    def result(self, timeout=None):
+        self.join(timeout)
+        if self.is_alive():
+            return None, {'status': 'timeout', 'timeout': timeout}
+        return self.commitlog, {'status': self.status, 'elapsed': self.elapsed}
+
+
+## 差分保存ディレクトリにおける差分ファイルのパスを返す関数
+#  @param store_dir 差分保存ディレクトリのパス文字列
+#  @param digest 差分のハッシュ値
+#  @return 差分ファイルのパス文字列
+def diff_path(store_dir, digest):
+    return os.path.join(store_dir, digest[:2], digest + '.gz')
+
+
+## コミットログの差分を差分保存ディレクトリに移し, 参照に置き換える関数
+#
+#  差分は内容のハッシュ値をファイル名としてgzip圧縮して保存するため,
+#  同じ差分は一度しか保存されない.@n
+#  差分が空の場合や, すでに参照に置き換えられている場合はそのまま返す.
+#  @param commitlog make_commitlog()で生成したコミットログの文字列
+#  @param store_dir 差分保存ディレクトリのパス文字列
+#  @return 差分を参照に置き換えたコミットログの文字列
+def dedup_commitlog(commitlog, store_dir):
+    if commitlog is None or DIFF_HEADER not in commitlog:
+        return commitlog
+    header, diff = commitlog.split(DIFF_HEADER, 1)
+    if not diff or diff.startswith(DIFF_STORE_PREFIX):
+        return commitlog
+
+    data = diff.encode('utf-8')
+    digest = hashlib.sha1(data).hexdigest()
+    path = diff_path(store_dir, digest)
+    if not os.path.exists(path):
+        dir = os.path.dirname(path)
+        try:
+            os.makedirs(dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # 並列実行時に不完全なファイルが読まれないようにrenameで配置する
+        fd, tmp_path = tempfile.mkstemp(dir=dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                gz.write(data)
+        os.rename(tmp_path, path)
+    return header + DIFF_HEADER + DIFF_STORE_PREFIX + digest + u'\n'
+
+
+## 差分保存ディレクトリを探索する関数
+#
+#  コミットログファイルのあるディレクトリから上の階層に向かって探索する.
+#  @param filepath コミットログファイルのパス文字列
+#  @param digest 差分のハッシュ値
+#  @return 差分ファイルのパス文字列(見つからない場合はNone)
+def find_diff(filepath, digest):
+    dir = os.path.dirname(os.path.abspath(filepath))
+    while True:
+        path = diff_path(os.path.join(dir, DIFF_STORE_DIRNAME), digest)
+        if os.path.exists(path):
+            return path
+        parent = os.path.dirname(dir)
+        if parent == dir:
+            return None
+        dir = parent
+
+
+## コミットログファイルを読み込む関数
+#
+#  差分が差分保存ディレクトリへの参照に置き換えられている場合には,
+#  差分を読み込んで元のコミットログの文字列を復元する.
+#  @param filepath コミットログファイルのパス文字列
+#  @return コミットログの文字列
+def read_commitlog(filepath):
+    with codecs.open(filepath, 'r', 'utf-8') as f:
+        commitlog = f.read()
+    if DIFF_HEADER not in commitlog:
+        return commitlog
+    header, diff = commitlog.split(DIFF_HEADER, 1)
+    if not diff.startswith(DIFF_STORE_PREFIX):
+        return commitlog
+    digest = diff[len(DIFF_STORE_PREFIX):].strip()
+    path = find_diff(filepath, digest)
+    if path is None:
+        raise IOError(
+            errno.ENOENT, 'diff %s referenced by %s is not found' %
+            (digest, filepath)
+        )
+    with gzip.open(path, 'rb') as gz:
+        diff = gz.read().decode('utf-8')
+    return header + DIFF_HEADER + diff
+
+
+## 生成済みのコミットログ文字列をファイル出力する関数
+#
+#  @param commitlog make_commitlog()で生成したコミットログの文字列
+#  @param filepath コミットログファイルの出力先パスの文字列
+#  @param verbose 処理内容の詳細表示を行うかどうかのbool変数
+def save_commitlog(commitlog, filepath=None, verbose=False):
+    if commitlog is None:
+        return
+
     # filepathがNoneもしくはディレクトリの場合には，自動的にファイル名を作成
     if filepath is None:
         filepath = './'
     if os.path.isdir(filepath):
-        import datetime
         tdatetime = datetime.datetime.now()
         date_str = tdatetime.strftime('%Y%m%d_%H%M')
         fpath = 'commitlog_%s.txt' % date_str
-        if filepath is not None:
-            dir = filepath
-        fpath = os.path.join(dir, fpath)
+        fpath = os.path.join(filepath, fpath)
     else:
         fpath = filepath
 
     try:
-        # gitlogインスタンスを生成
-        glog = gitlog(repo, branch)
         # 書き込みファイルをutf-8で開く
-        f = codecs.open(fpath, 'w', 'utf-8')
-        # commitlogの書き込み
-        glog.write_commit(f, verbose)
-        # ファイルを閉じる
-        f.close()
+        with codecs.open(fpath, 'w', 'utf-8') as f:
+            f.write(commitlog)
+        if verbose:
+            print u'%s の書き込みに成功しました' % fpath
     except Exception as e:
         print e.message
         print 'コミットログファイルの生成に失敗しました'
+
+
+## コミットログの文字列からコミットのハッシュIDを取り出す関数
+#  @param commitlog gitlog.make_commit_text()で生成したコミットログの文字列
+#  @return ハッシュIDの文字列(見つからない場合はNone)
+def read_hexsha(commitlog):
+    if commitlog is None:
+        return None
+    m = re.match(u'^ハッシュID: ([0-9a-f]+)', commitlog)
+    if m is None:
+        return None
+    return m.group(1)
+
+
+## 指定したディレクトリ以下に存在するリポジトリの指定ブランチに関して
+#  最新コミットのログをファイル出力する関数
+#
+#  @param script_path コミットログを残したいスクリプトのパス文字列
+#  @param filepath コミットログファイルの出力先パスの文字列
+#  @param branch ログをとる対象となるブランチオブジェクト
+#  @param verbose 処理内容の詳細表示を行うかどうかのbool変数
+def write_commitlog(
+    script_path, filepath=None, branch=None, verbose=False
+):
+    commitlog = make_commitlog(script_path, branch, verbose)
+    save_commitlog(commitlog, filepath, verbose)
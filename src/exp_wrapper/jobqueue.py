@@ -0,0 +1,304 @@
+# -*- coding:utf-8 -*-
+## @package jobqueue
+#
+#  共有ファイルシステム上のファイルによるジョブキューに関するパッケージ
+#
+#  ジョブは1つのjsonファイルであり, 状態ごとのディレクトリ(pending, running,
+#  done, failed)の間をos.rename()で移動する. rename()はNFSでもアトミックであるため,
+#  複数のノードのワーカーが同じジョブを取得することはない.@n
+#  実行中のジョブのファイルはワーカーが定期的にmtimeを更新し(ハートビート),
+#  一定時間(リース)更新されなかったジョブはワーカーが異常終了したものとみなしてpendingに戻す.@n
+#  ノード間の時計のずれの影響を受けないように, 現在時刻にはファイルサーバ上で
+#  更新したファイルのmtimeを用いる.
+import errno
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+from exp_wrapper import forkrun
+from exp_wrapper.timing import monotonic
+
+## キューを置くディレクトリの名前(実験のルートディレクトリ以下に作成される)
+QUEUE_DIRNAME = '.queue'
+
+## ジョブの状態
+STATES = ['pending', 'running', 'done', 'failed']
+
+
+## ワーカーを識別する文字列を返す関数
+#  @return 'ホスト名:プロセスID'の形式の文字列
+def worker_id():
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+## ファイルベースのジョブキューのクラス
+class JobQueue(object):
+    ## コンストラクタ
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param root 実験のルートディレクトリのパス文字列
+    def __init__(self, root):
+        ## @var queue_dir
+        #  キューのディレクトリのパス文字列
+        self.queue_dir = os.path.join(root, QUEUE_DIRNAME)
+        for state in STATES:
+            path = os.path.join(self.queue_dir, state)
+            try:
+                os.makedirs(path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    ## ジョブのファイルのパスを返すメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param state ジョブの状態
+    #  @param job_id ジョブID
+    #  @return パス文字列
+    def path(self, state, job_id):
+        return os.path.join(self.queue_dir, state, job_id + '.json')
+
+    ## ファイルサーバ上の現在時刻を返すメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @return 現在時刻(エポック秒)
+    def now(self):
+        clock_path = os.path.join(self.queue_dir, '.clock')
+        with open(clock_path, 'a'):
+            os.utime(clock_path, None)
+        return os.stat(clock_path).st_mtime
+
+    ## ジョブのファイルを書き込むメソッド
+    #
+    #  書きかけのファイルが読まれないように, 一時ファイルに書き込んでからrenameする.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param path ジョブのファイルのパス文字列
+    #  @param job ジョブの辞書
+    def _write(self, path, job):
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.queue_dir, prefix='.tmp', suffix='.json'
+        )
+        with os.fdopen(fd, 'w') as f:
+            json.dump(job, f, indent=4)
+        os.rename(tmp_path, path)
+
+    ## ジョブを追加するメソッド
+    #
+    #  ジョブIDは追加した時刻で始まるため, ジョブはおおむね追加した順に実行される.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param argv_sets experimentのコマンドライン引数のリストのリスト
+    #  @param cwd ジョブを実行する作業ディレクトリ
+    #  @return 追加したジョブIDのリスト
+    def enqueue(self, argv_sets, cwd):
+        job_ids = []
+        for i, argv in enumerate(argv_sets):
+            job_id = '%s_%06d_%s' % (
+                time.strftime('%Y%m%d_%H%M%S'), i, uuid.uuid4().hex[:8]
+            )
+            self._write(self.path('pending', job_id), {
+                'id': job_id,
+                'argv': argv,
+                'cwd': cwd,
+                'enqueued': time.time(),
+                'attempts': 0,
+            })
+            job_ids.append(job_id)
+        return job_ids
+
+    ## 状態ごとのジョブIDを返すメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param state ジョブの状態
+    #  @return ジョブIDのリスト(ID順)
+    def ids(self, state):
+        return sorted(
+            name[:-len('.json')]
+            for name in os.listdir(os.path.join(self.queue_dir, state))
+            if name.endswith('.json')
+        )
+
+    ## ジョブを読み込むメソッド
+    #
+    #  文字列(コマンドライン引数や作業ディレクトリ)はutf-8のstrに戻す.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param state ジョブの状態
+    #  @param job_id ジョブID
+    #  @return ジョブの辞書(存在しない場合はNone)
+    def read(self, state, job_id):
+        try:
+            with open(self.path(state, job_id), 'r') as f:
+                return forkrun.native_str(json.load(f))
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        return None
+
+    ## ジョブを別の状態に移すメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param job_id ジョブID
+    #  @param src 移動元の状態
+    #  @param dst 移動先の状態
+    #  @return 移動できた場合はTrue(他のワーカーが先に移動した場合はFalse)
+    def move(self, job_id, src, dst):
+        try:
+            os.rename(self.path(src, job_id), self.path(dst, job_id))
+            return True
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        return False
+
+    ## リースが切れた実行中のジョブをpendingに戻すメソッド
+    #
+    #  試行回数がmax_attemptsに達したジョブはfailedに移す.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param lease リースの時間(秒)
+    #  @param max_attempts 最大の試行回数
+    #  @return pendingに戻したジョブIDのリスト
+    def requeue_expired(self, lease, max_attempts):
+        now = self.now()
+        requeued = []
+        for job_id in self.ids('running'):
+            try:
+                mtime = os.stat(self.path('running', job_id)).st_mtime
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            if now - mtime < lease:
+                continue
+            job = self.read('running', job_id)
+            if job is None:
+                continue
+            dst = 'failed' if job['attempts'] >= max_attempts else 'pending'
+            if self.move(job_id, 'running', dst) and dst == 'pending':
+                requeued.append(job_id)
+        return requeued
+
+    ## 実行待ちのジョブを1つ取得するメソッド
+    #
+    #  pendingからrunningへのrenameに成功したワーカーのみがジョブを取得できる.@n
+    #  renameではmtimeが変わらないため, リースが切れたとみなされないように
+    #  renameの前にmtimeを更新する.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param worker ワーカーを識別する文字列
+    #  @return ジョブの辞書(実行待ちのジョブが無い場合はNone)
+    def claim(self, worker):
+        for job_id in self.ids('pending'):
+            try:
+                os.utime(self.path('pending', job_id), None)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            if not self.move(job_id, 'pending', 'running'):
+                continue
+            job = self.read('running', job_id)
+            if job is None:
+                continue
+            job['attempts'] += 1
+            job['worker'] = worker
+            job['claimed'] = time.time()
+            self._write(self.path('running', job_id), job)
+            return job
+        return None
+
+    ## リースを延長するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param job_id ジョブID
+    #  @return 延長できた場合はTrue(リースが切れて他のワーカーに移った場合はFalse)
+    def heartbeat(self, job_id):
+        try:
+            os.utime(self.path('running', job_id), None)
+            return True
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        return False
+
+    ## ジョブのファイルの内容がこのワーカーの試行のものであるかを判定するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param current ファイルから読み込んだジョブの辞書
+    #  @param job このワーカーが取得したジョブの辞書
+    #  @return このワーカーの試行のものであればTrue
+    def _owns(self, current, job):
+        return current is not None and \
+            current.get('worker') == job['worker'] and \
+            current['attempts'] == job['attempts']
+
+    ## 終了したジョブをdoneもしくはfailedに移すメソッド
+    #
+    #  runningのファイルを書き換えると, その間にリースが切れてpendingに戻された
+    #  ジョブのファイルを作り直してしまうため, 1回のrenameで移してから結果を書き込む.
+    #  renameがENOENTで失敗した場合はリースを失ったものとみなす.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param job ジョブの辞書
+    #  @param code 終了コード
+    #  @param status 実行の状態('ok'もしくはエラー名, 不明な場合はNone)
+    #  @return 移動できた場合はTrue(リースが切れて他のワーカーに移っていた場合はFalse)
+    def finish(self, job, code, status=None):
+        job_id = job['id']
+        if not self._owns(self.read('running', job_id), job):
+            return False
+        dst = 'done' if code == 0 and status in (None, 'ok') else 'failed'
+        if not self.move(job_id, 'running', dst):
+            return False
+        if not self._owns(self.read(dst, job_id), job):
+            # 確認とrenameの間に他のワーカーが取得したジョブを移した場合は戻す
+            self.move(job_id, dst, 'running')
+            return False
+        job['exit_code'] = code
+        job['status'] = status
+        job['finished'] = time.time()
+        self._write(self.path(dst, job_id), job)
+        return True
+
+
+## 実行中のジョブのリースを定期的に延長するスレッドクラス
+#
+#  延長はリースの1/3の間隔で行う. 一時的なエラー(NFSの応答なし等)で延長に失敗した場合は,
+#  最後に延長できてからリースの時間が経過するまで延長を試み続ける.@n
+#  ジョブのファイルがrunningから移されていた場合やリースが切れた場合は,
+#  他のワーカーが同じジョブを実行しうるため, lostをTrueにしてon_lostを呼び出す.
+class Heartbeat(threading.Thread):
+    ## コンストラクタ
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param queue JobQueueオブジェクト
+    #  @param job_id ジョブID
+    #  @param lease リースの時間(秒)
+    #  @param on_lost リースを失った時に(このスレッドで)呼び出す引数なしの関数
+    def __init__(self, queue, job_id, lease, on_lost=None):
+        super(Heartbeat, self).__init__(name='Heartbeat')
+        self.daemon = True
+        self.queue = queue
+        self.job_id = job_id
+        self.lease = lease
+        self.interval = lease / 3.0
+        self.on_lost = on_lost
+        ## @var lost
+        #  リースを失った場合にTrueとなるbool変数
+        self.lost = False
+        self._stop_event = threading.Event()
+
+    ## 定期的にリースを延長するメソッド(スレッドで実行される)
+    #  @param self オブジェクト自身に対するポインタ
+    def run(self):
+        renewed = monotonic()
+        while not self._stop_event.wait(self.interval):
+            try:
+                if self.queue.heartbeat(self.job_id):
+                    renewed = monotonic()
+                    continue
+            except (IOError, OSError):
+                if monotonic() - renewed < self.lease:
+                    continue
+            self.lost = True
+            if self.on_lost is not None:
+                self.on_lost()
+            return
+
+    ## 延長を終了するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    def stop(self):
+        self._stop_event.set()
+        self.join()
@@ -0,0 +1,240 @@
+# -*- coding:utf-8 -*-
+## @package logutil
+#
+#  ロガーへのハンドラの登録および非同期ログ出力に関するパッケージ
+#
+#  非同期ログ出力では, ロガーにはキューに記録を追加するだけのハンドラを登録し,
+#  書式化とファイルや端末への出力はバックグラウンドのスレッドで行う.@n
+#  バックグラウンドのスレッドはキューが空の間はQueue.get()で待機し,
+#  記録が追加されるまで起床しない.@n
+#  forkする場合は, 親プロセスでbefore_fork()を, 子プロセスでafter_fork()を呼び出す.
+#  他のスレッドがfork時に保持していたロックを子プロセスで作成し直す.
+import Queue
+import atexit
+import logging
+import os
+import threading
+
+## install()で登録したハンドラの辞書(ロガー名をキーとする)
+_installed = {}
+
+
+## ログの記録をキューに追加するハンドラ
+class QueueHandler(logging.Handler):
+    ## コンストラクタ
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param listener 記録を処理するQueueListenerオブジェクト
+    def __init__(self, listener):
+        logging.Handler.__init__(self)
+        ## @var listener
+        #  記録を処理するQueueListenerオブジェクト
+        self.listener = listener
+
+    ## 記録を処理するメソッド
+    #
+    #  Queueへの追加はスレッドセーフであるため, ハンドラのロックは取得しない.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param record ログの記録
+    #  @return フィルタを通過した場合はTrue
+    def handle(self, record):
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    ## 記録をキューに追加するメソッド
+    #
+    #  引数が後から変更されても出力内容が変わらないように,
+    #  メッセージの組み立てのみを呼び出し元のスレッドで行う.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param record ログの記録
+    def emit(self, record):
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info
+                )
+                record.exc_info = None
+            self.listener.enqueue(record)
+        except Exception:
+            self.handleError(record)
+
+
+## キューに追加された記録をバックグラウンドのスレッドで処理するクラス
+class QueueListener(object):
+    ## コンストラクタ
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param handlers 記録を出力するハンドラのリスト
+    def __init__(self, handlers):
+        ## @var handlers
+        #  記録を出力するハンドラのリスト
+        self.handlers = handlers
+        ## @var queue
+        #  記録のキュー(Noneはスレッドの終了を表す)
+        self.queue = Queue.Queue()
+        self._thread = None
+        self._pid = None
+
+    ## スレッドを開始するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    def start(self):
+        self._pid = os.getpid()
+        self._thread = threading.Thread(
+            target=self._monitor, name='QueueListener'
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    ## fork後の子プロセスで状態を初期化するメソッド
+    #
+    #  子プロセスにはスレッドが存在せず, キューのロックが保持されたままの
+    #  場合もあるため, キューを作成し直す. スレッドは次のenqueue()で開始する.
+    #  @param self オブジェクト自身に対するポインタ
+    def reset(self):
+        self.queue = Queue.Queue()
+        self._thread = None
+        self._pid = None
+
+    ## 記録をキューに追加するメソッド
+    #
+    #  fork後の子プロセスではスレッドが存在しないため, 新たにスレッドを開始する.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param record ログの記録
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self.reset()
+            self.start()
+        self.queue.put(record)
+
+    ## キューの記録を全て出力し終えるまで待つメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    def flush(self):
+        if self._thread is not None and self._pid == os.getpid():
+            self.queue.join()
+        for handler in self.handlers:
+            handler.flush()
+
+    ## キューの記録を全て出力した後にスレッドを終了するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    def stop(self):
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self.queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    ## キューから記録を取り出してハンドラに渡すメソッド(スレッドで実行される)
+    #
+    #  全ての記録をハンドラに渡した後にtask_done()を呼び出すことで,
+    #  flush()は取り出し済みで未出力の記録も待つ.
+    #  @param self オブジェクト自身に対するポインタ
+    def _monitor(self):
+        while True:
+            record = self.queue.get()
+            try:
+                if record is None:
+                    return
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+            finally:
+                self.queue.task_done()
+
+
+## ロガーにハンドラを登録する関数
+#
+#  同じ名前のロガーに対して以前に本関数で登録したハンドラは,
+#  閉じてから取り除くため, 複数回呼び出してもハンドラが重複しない.@n
+#  async_logがTrueの場合は, ハンドラをQueueListenerに登録し,
+#  ロガーにはQueueHandlerのみを登録する.
+#  @param logger ロガーオブジェクト
+#  @param handlers 登録するハンドラのリスト
+#  @param async_log 非同期にログを出力するかどうかのbool変数
+def install(logger, handlers, async_log=False):
+    uninstall(logger)
+    if async_log:
+        listener = QueueListener(handlers)
+        listener.start()
+        queue_handler = QueueHandler(listener)
+        queue_handler.setLevel(min(h.level for h in handlers))
+        logger.addHandler(queue_handler)
+        _installed[logger.name] = (handlers, listener, queue_handler)
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
+        _installed[logger.name] = (handlers, None, None)
+
+
+## install()で登録したハンドラを返す関数
+#  @param logger ロガーオブジェクト
+#  @return ハンドラのリスト
+def handlers(logger):
+    return _installed.get(logger.name, ([], None, None))[0]
+
+
+## 未出力の記録を出力する関数
+#  @param logger ロガーオブジェクト
+def flush(logger):
+    handlers, listener, _ = _installed.get(logger.name, ([], None, None))
+    if listener is not None:
+        listener.flush()
+    else:
+        for handler in handlers:
+            handler.flush()
+
+
+## install()で登録したハンドラを閉じて取り除く関数
+#  @param logger ロガーオブジェクト
+def uninstall(logger):
+    entry = _installed.pop(logger.name, None)
+    if entry is None:
+        return
+    handlers, listener, queue_handler = entry
+    if listener is not None:
+        # 取り除く前に停止すると, その間に他のスレッドが出力した記録が失われる
+        logger.removeHandler(queue_handler)
+        listener.stop()
+    for handler in handlers:
+        if listener is None:
+            logger.removeHandler(handler)
+        handler.flush()
+        handler.close()
+
+
+## forkする直前に親プロセスで呼び出す関数
+#
+#  子プロセスに未出力の記録が複製されないように, 全ての記録を出力する.
+def before_fork():
+    for handlers, listener, _ in _installed.values():
+        if listener is not None:
+            listener.flush()
+        else:
+            for handler in handlers:
+                handler.flush()
+
+
+## fork後の子プロセスで呼び出す関数
+#
+#  fork時に他のスレッド(バックグラウンドのスレッドを含む)が保持していた
+#  ハンドラおよびloggingモジュールのロックは子プロセスで解放されないため,
+#  作成し直す.
+def after_fork():
+    logging._lock = threading.RLock()
+    for handlers, listener, queue_handler in _installed.values():
+        for handler in handlers:
+            handler.createLock()
+        if listener is not None:
+            queue_handler.createLock()
+            listener.reset()
+
+
+## プロセス終了時に未出力の記録を出力する関数
+def _flush_all():
+    for handlers, listener, _ in _installed.values():
+        if listener is not None:
+            listener.stop()
+
+
+atexit.register(_flush_all)
@@ -0,0 +1,115 @@
+# -*- coding:utf-8 -*-
+## @package metrics
+#
+#  実行中に逐次記録する指標(学習の各ステップの損失等)に関するパッケージ
+#
+#  指標はJSON Lines形式(1行に1つのjsonオブジェクト)のファイルに追記される.
+import json
+import time
+
+## 指標ファイルの標準のファイル名
+METRICS_FILENAME = 'metrics.jsonl'
+
+
+## 指標をJSON Lines形式のファイルに追記するクラス
+#
+#  記録はバッファに蓄え, 一定件数もしくは一定時間ごとにファイルに書き出す.@n
+#  メモリ上には記録そのものではなく, 数値の指標ごとの要約(件数, 最新値, 最小値,
+#  最大値, 平均値)のみを保持する.
+class MetricsWriter(object):
+    ## コンストラクタ
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param path 指標ファイルのパス文字列
+    #  @param flush_every バッファに蓄える記録数の上限
+    #  @param flush_interval ファイルに書き出す時間間隔(秒)
+    def __init__(self, path, flush_every=100, flush_interval=10.0):
+        ## @var path
+        #  指標ファイルのパス文字列
+        self.path = path
+        ## @var flush_every
+        #  バッファに蓄える記録数の上限
+        self.flush_every = flush_every
+        ## @var flush_interval
+        #  ファイルに書き出す時間間隔(秒)
+        self.flush_interval = flush_interval
+        ## @var records
+        #  記録数
+        self.records = 0
+        self._buffer = []
+        self._stats = {}
+        self._last_flush = time.time()
+        self._file = open(path, 'a')
+
+    ## 記録を追加するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param record 記録の辞書
+    def append(self, record):
+        self._buffer.append(json.dumps(record))
+        self.records += 1
+        for key, value in record.items():
+            if key == 'time' or isinstance(value, bool) or \
+                    not isinstance(value, (int, long, float)):
+                continue
+            stats = self._stats.get(key)
+            if stats is None:
+                self._stats[key] = {
+                    'count': 1, 'last': value, 'min': value, 'max': value,
+                    'sum': value
+                }
+                continue
+            stats['count'] += 1
+            stats['last'] = value
+            stats['min'] = min(stats['min'], value)
+            stats['max'] = max(stats['max'], value)
+            stats['sum'] += value
+        if len(self._buffer) >= self.flush_every or \
+                time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    ## バッファの記録をファイルに書き出すメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    def flush(self):
+        if self._buffer:
+            self._file.write('\n'.join(self._buffer))
+            self._file.write('\n')
+            self._buffer = []
+        self._file.flush()
+        self._last_flush = time.time()
+
+    ## ファイルを閉じるメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    ## 記録の要約を返すメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @return 記録数と, 数値の指標ごとの要約の辞書
+    def summary(self):
+        summary = {'records': self.records}
+        for key, stats in self._stats.items():
+            summary[key] = {
+                'last': stats['last'],
+                'min': stats['min'],
+                'max': stats['max'],
+                'mean': float(stats['sum']) / stats['count'],
+            }
+        return summary
+
+
+## 指標ファイルの記録を1件ずつ読み込むジェネレータ
+#
+#  ファイル全体をメモリに読み込まずに, 1行ずつ解釈する.@n
+#  異常終了時に書きかけとなった最終行は無視する.
+#  @param path 指標ファイルのパス文字列
+def iter_metrics(path):
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
@@ -0,0 +1,186 @@
+# -*- coding:utf-8 -*-
+## @package monitor
+#
+#  実行中のプロセスの資源使用量(CPU時間, メモリ, I/O, スレッド数)を
+#  バックグラウンドで記録するためのパッケージ
+#
+#  メモリ, I/O, スレッド数はLinuxの/procから取得し, 取得できない場合は記録しない.@n
+#  いずれもプロセス全体の値であり, 最大RSS(process_max_rss_kb)はラッパーの処理も含む
+#  プロセス開始時からの最大値である. 記録開始時点の値をstart_max_rss_kbとして要約に含める.@n
+#  Python 2のEvent.wait()はタイムアウトまで短い間隔でsleepを繰り返すため,
+#  記録の間隔はパイプに対するselect()で待ち, スレッドは記録する時にのみ起床する.
+import errno
+import os
+import resource
+import select
+import threading
+import time
+
+## 時系列ファイルの標準のファイル名
+RESOURCES_FILENAME = 'resources.csv'
+
+## 時系列ファイルの列名
+COLUMNS = [
+    'wall', 'cpu_user', 'cpu_system', 'rss_kb', 'process_max_rss_kb',
+    'read_bytes', 'write_bytes', 'threads'
+]
+
+_PAGE_KB = resource.getpagesize() // 1024
+
+
+## 現在のRSS(KB)を返す関数
+#  @return RSS(KB)(取得できない場合はNone)
+def _current_rss_kb():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * _PAGE_KB
+    except (IOError, IndexError, ValueError):
+        return None
+
+
+## ストレージへの読み書きのバイト数を返す関数
+#  @return 読み込みバイト数と書き込みバイト数(取得できない場合はNone)
+def _io_bytes():
+    read_bytes = write_bytes = None
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                key, value = line.split(':')
+                if key == 'read_bytes':
+                    read_bytes = int(value)
+                elif key == 'write_bytes':
+                    write_bytes = int(value)
+    except (IOError, ValueError):
+        pass
+    return read_bytes, write_bytes
+
+
+## プロセスのスレッド数を返す関数
+#  @return スレッド数
+def _threads():
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except (IOError, ValueError):
+        pass
+    return threading.active_count()
+
+
+## 資源使用量を一定間隔で記録するスレッドクラス
+#
+#  記録はCSV形式で1行ずつファイルに追記され, 終了時には要約を返す.@n
+#  CPU時間, 読み書きのバイト数, 経過時間は開始時点からの差分を記録する.
+class ResourceMonitor(threading.Thread):
+    ## コンストラクタ
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param path 時系列ファイルのパス文字列
+    #  @param interval 記録の間隔(秒)
+    def __init__(self, path, interval=1.0):
+        super(ResourceMonitor, self).__init__(name='ResourceMonitor')
+        self.daemon = True
+        ## @var path
+        #  時系列ファイルのパス文字列
+        self.path = path
+        ## @var interval
+        #  記録の間隔(秒)
+        self.interval = interval
+        self._wakeup = None
+        self._file = None
+        self._start = None
+        self._last = None
+        self._max_threads = 0
+        self._samples = 0
+
+    ## 記録を開始するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    def start(self):
+        # stop()が書き込むことで待機中のスレッドを起こすパイプ
+        self._wakeup = os.pipe()
+        self._file = open(self.path, 'w')
+        self._file.write(','.join(COLUMNS) + '\n')
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        read_bytes, write_bytes = _io_bytes()
+        self._start = {
+            'wall': time.time(),
+            'cpu_user': usage.ru_utime,
+            'cpu_system': usage.ru_stime,
+            'read_bytes': read_bytes,
+            'write_bytes': write_bytes,
+            'max_rss_kb': usage.ru_maxrss,
+        }
+        self._sample()
+        super(ResourceMonitor, self).start()
+
+    ## 一定間隔で記録するメソッド(スレッドで実行される)
+    #  @param self オブジェクト自身に対するポインタ
+    def run(self):
+        while True:
+            try:
+                ready, _, _ = select.select(
+                    [self._wakeup[0]], [], [], self.interval
+                )
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if ready:
+                break
+            self._sample()
+
+    ## 資源使用量を1回記録するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    def _sample(self):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        read_bytes, write_bytes = _io_bytes()
+        start = self._start
+
+        def delta(value, key):
+            if value is None or start[key] is None:
+                return None
+            return value - start[key]
+
+        row = {
+            'wall': time.time() - start['wall'],
+            'cpu_user': usage.ru_utime - start['cpu_user'],
+            'cpu_system': usage.ru_stime - start['cpu_system'],
+            'rss_kb': _current_rss_kb(),
+            'process_max_rss_kb': usage.ru_maxrss,
+            'read_bytes': delta(read_bytes, 'read_bytes'),
+            'write_bytes': delta(write_bytes, 'write_bytes'),
+            'threads': _threads(),
+        }
+        self._file.write(','.join(
+            '' if row[c] is None else
+            ('%.3f' % row[c] if isinstance(row[c], float) else str(row[c]))
+            for c in COLUMNS
+        ) + '\n')
+        self._last = row
+        self._max_threads = max(self._max_threads, row['threads'])
+        self._samples += 1
+
+    ## 記録を終了し, 要約を返すメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @return 資源使用量の要約の辞書
+    def stop(self):
+        os.write(self._wakeup[1], b'\0')
+        self.join()
+        for fd in self._wakeup:
+            os.close(fd)
+        self._sample()
+        self._file.close()
+        last = self._last
+        return {
+            'wall_time': last['wall'],
+            'cpu_user': last['cpu_user'],
+            'cpu_system': last['cpu_system'],
+            'process_max_rss_kb': last['process_max_rss_kb'],
+            'start_max_rss_kb': self._start['max_rss_kb'],
+            'read_bytes': last['read_bytes'],
+            'write_bytes': last['write_bytes'],
+            'max_threads': self._max_threads,
+            'samples': self._samples,
+            'interval': self.interval,
+            'path': os.path.basename(self.path),
+        }
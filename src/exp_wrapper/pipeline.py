@@ -0,0 +1,215 @@
+# -*- coding:utf-8 -*-
+## @package pipeline
+#
+#  複数の実験(ステージ)をout_filesでつないだパイプライン(DAG)の実行に関するパッケージ
+#
+#  パイプラインはjsonファイルで定義する.
+#  @code
+#  {
+#      "stages": {
+#          "prep": {"script": "prep.py", "class": "Prep", "args": ["--n", "10"]},
+#          "train": {
+#              "script": "train.py", "class": "Train",
+#              "inputs": {"--data": "prep:dataset"}, "cwd": "work/train"
+#          },
+#          "eval": {
+#              "script": "eval.py", "class": "Eval",
+#              "inputs": {"--model": "train:model", "--data": "prep:dataset"},
+#              "experiment_args": ["++monitor", "1"]
+#          }
+#      }
+#  }
+#  @endcode
+#  inputsの値'<ステージ名>:<名前>'は, そのステージのout_filesの<名前>のファイルが
+#  出力ディレクトリに集められた後のパスに置き換えられ, キーのオプションの値として渡される.@n
+#  入力が揃ったステージから, forkした子プロセスでjobs個まで同時に実行する.
+#  同時に実行されるステージが同じ名前の出力ファイルを作成する場合は,
+#  cwdにステージごとに異なる作業ディレクトリを指定する.@n
+#  各ステージは実行結果のキャッシュ(++cache)を用いて実行されるため,
+#  入力パラメータ(上流のステージの出力ディレクトリのパスを含む)とスクリプトが
+#  変わっていないステージは実行されず, 既存の出力ディレクトリが再利用される.
+import json
+import os
+import time
+
+from exp_wrapper import forkrun, runindex
+
+## ステージの状態(ok以外はエラー名)
+#  - ok: 正常終了した
+#  - blocked: 上流のステージが失敗したため実行しなかった
+BLOCKED = 'blocked'
+
+
+## パイプラインの定義を読み込む関数
+#  @param path 定義ファイルのパス文字列
+#  @return ステージ名をキーとし, ステージの定義の辞書を値とする辞書
+def load(path):
+    with open(path, 'r') as f:
+        # コマンドライン引数はutf-8のstrとして渡す
+        definition = forkrun.native_str(json.load(f))
+    stages = definition.get('stages')
+    if not isinstance(stages, dict) or not stages:
+        raise ValueError('%s does not define any stages' % path)
+    for name, stage in stages.items():
+        for key in ('script', 'class'):
+            if key not in stage:
+                raise ValueError('stage %s has no %s' % (name, key))
+    order(stages)
+    return stages
+
+
+## 入力の参照文字列をステージ名と出力ファイル名に分ける関数
+#  @param ref '<ステージ名>:<名前>'の形式の文字列
+#  @return ステージ名と出力ファイル名のタプル
+def parse_ref(ref):
+    stage, sep, name = ref.partition(':')
+    if not sep or not stage or not name:
+        raise ValueError('invalid input reference: %s' % ref)
+    return stage, name
+
+
+## ステージが依存するステージ名の集合を返す関数
+#
+#  inputsで参照するステージに加えて, afterで指定したステージにも依存する.
+#  @param stage ステージの定義の辞書
+#  @return ステージ名の集合
+def dependencies(stage):
+    deps = set(stage.get('after', []))
+    for ref in stage.get('inputs', {}).values():
+        deps.add(parse_ref(ref)[0])
+    return deps
+
+
+## ステージをトポロジカルソートする関数
+#  @param stages ステージ名をキーとし, ステージの定義の辞書を値とする辞書
+#  @return ステージ名のリスト(依存するステージが先に来る)
+def order(stages):
+    deps = {}
+    for name, stage in stages.items():
+        deps[name] = dependencies(stage)
+        for dep in deps[name]:
+            if dep not in stages:
+                raise ValueError(
+                    'stage %s depends on unknown stage %s' % (name, dep)
+                )
+    ordered = []
+    done = set()
+    while len(ordered) < len(stages):
+        ready = sorted(
+            name for name in stages
+            if name not in done and deps[name] <= done
+        )
+        if not ready:
+            raise ValueError('stages have a cycle: %s' % ', '.join(
+                sorted(name for name in stages if name not in done)
+            ))
+        ordered.extend(ready)
+        done.update(ready)
+    return ordered
+
+
+## 実行の出力ファイルが集められた後のパスを返す関数
+#
+#  キャッシュにより再利用された場合と入力パラメータが一致するように, 絶対パスを返す.
+#  @param run_dir 実行の出力ディレクトリのパス文字列
+#  @param name out_filesに登録した名前
+#  @return パス文字列
+def output_path(run_dir, name):
+    run_dir = os.path.abspath(run_dir)
+    record = runindex.make_record(run_dir)
+    io_files = record['io_files'] if record is not None else {}
+    source = io_files.get('output_files', {}).get(name)
+    if source is None:
+        raise ValueError('%s has no output file %s' % (run_dir, name))
+    for collected in io_files.get('collected_files', []):
+        if collected['source'] == source:
+            return os.path.join(run_dir, collected['path'])
+    return os.path.join(run_dir, 'output_files', os.path.basename(source))
+
+
+## ステージを実行するexperimentのコマンドライン引数を生成する関数
+#  @param stage ステージの定義の辞書
+#  @param results 実行済みのステージ名をキーとし, 実行結果の辞書を値とする辞書
+#  @param experiment_args 全てのステージに共通するexperimentのオプションのリスト
+#  @return コマンドライン引数のリスト
+def make_argv(stage, results, experiment_args):
+    argv = [os.path.abspath(stage['script']), stage['class']]
+    argv += experiment_args + stage.get('experiment_args', [])
+    argv += stage.get('args', [])
+    for option in sorted(stage.get('inputs', {})):
+        dep, name = parse_ref(stage['inputs'][option])
+        argv += [option, output_path(results[dep]['output_dir'], name)]
+    return argv
+
+
+## パイプラインを実行する関数
+#
+#  依存するステージが全て正常終了したステージから順に, jobs個まで同時に実行する.
+#  失敗したステージに依存するステージは実行しない.@n
+#  各ステージはforkrun.spawn()で実行し, 状態はパイプで受け取ったerrorから判定する.@n
+#  既存の出力ディレクトリを再利用した(実行開始前にargs.txtが作成されていた)
+#  ステージは, 実行結果のreusedがTrueとなる.
+#  @param stages ステージ名をキーとし, ステージの定義の辞書を値とする辞書
+#  @param handler コマンドライン引数のリストを受け取って実行し,
+#  出力ディレクトリのパス文字列とerrorに関する文字列を返す関数(子プロセスで実行される)
+#  @param experiment_args 全てのステージに共通するexperimentのオプションのリスト
+#  @param jobs 同時に実行するステージの数の上限
+#  @param logger ロガーオブジェクト
+#  @return ステージ名をキーとし, 実行結果の辞書('status', 'output_dir', 'reused',
+#  'elapsed')を値とする辞書
+def run(stages, handler, experiment_args, jobs, logger):
+    pending = order(stages)
+    results = {}
+    running = {}
+    while pending or running:
+        for name in list(pending):
+            if len(running) >= jobs:
+                break
+            deps = dependencies(stages[name])
+            if any(results[d]['status'] != 'ok' for d in deps if d in results):
+                pending.remove(name)
+                results[name] = {'status': BLOCKED, 'output_dir': None}
+                logger.warning(
+                    '%s is skipped because of a failed stage' % name
+                )
+                continue
+            if not deps <= set(results):
+                continue
+            pending.remove(name)
+            try:
+                argv = make_argv(stages[name], results, experiment_args)
+            except (ValueError, IOError, OSError) as e:
+                results[name] = {
+                    'status': type(e).__name__, 'output_dir': None
+                }
+                logger.error('%s: %s' % (name, e))
+                continue
+            logger.info('%s: %s' % (name, ' '.join(argv)))
+            cwd = stages[name].get('cwd')
+            pid, fd = forkrun.spawn(handler, argv, cwd)
+            running[pid] = (name, fd, time.time())
+        if not running:
+            continue
+
+        pid, code = forkrun.wait()
+        if pid not in running:
+            continue
+        name, fd, started = running.pop(pid)
+        result = forkrun.read_result(fd)
+        status = forkrun.status(result, code)
+        output_dir = result.get('output_dir')
+        reused = False
+        if output_dir is not None:
+            args_path = os.path.join(output_dir, 'args.txt')
+            reused = os.path.exists(args_path) and \
+                os.path.getmtime(args_path) < started
+        results[name] = {
+            'status': status,
+            'output_dir': output_dir,
+            'reused': reused,
+            'elapsed': time.time() - started,
+        }
+        logger.info('%s finished: %s%s' % (
+            name, status, ' (reused %s)' % output_dir if reused else ''
+        ))
+    return results
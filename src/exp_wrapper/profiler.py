@@ -0,0 +1,231 @@
+# -*- coding:utf-8 -*-
+## @package profiler
+#
+#  excute()のCPUプロファイルおよびメモリ割り当てのプロファイルをとるためのパッケージ
+#
+#  CPUプロファイルは, cProfileによる決定的なプロファイル('cprofile')と,
+#  SIGPROFによる定期的なスタックのサンプリング('sampling')から選択できる.@n
+#  メモリ割り当てのプロファイルにはtracemallocを用いるが,
+#  利用できない場合(Python 2)はgcが追跡しているオブジェクト数の型ごとの増分を記録する.
+import cProfile
+import gc
+import os
+import pstats
+import resource
+import signal
+import time
+from collections import defaultdict
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+## CPUプロファイルの種類
+MODES = ['cprofile', 'sampling']
+
+
+## 関数を表す文字列を返す関数
+#  @param filename ファイル名
+#  @param lineno 行番号
+#  @param funcname 関数名
+#  @return 'ファイル名:行番号(関数名)'の形式の文字列
+def _func_name(filename, lineno, funcname):
+    return '%s:%d(%s)' % (filename, lineno, funcname)
+
+
+## プロファイルをとるクラス
+class Profiler(object):
+    ## コンストラクタ
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param mode CPUプロファイルの種類('cprofile'もしくは'sampling')
+    #  @param memory メモリ割り当てのプロファイルをとるかどうかのbool変数
+    #  @param top 要約に含める関数(もしくは割り当て箇所)の数
+    #  @param interval サンプリングの間隔(秒)
+    def __init__(self, mode='cprofile', memory=False, top=20, interval=0.005):
+        if mode not in MODES:
+            raise ValueError('unknown profile mode: %s' % mode)
+        ## @var mode
+        #  CPUプロファイルの種類
+        self.mode = mode
+        ## @var memory
+        #  メモリ割り当てのプロファイルをとるかどうかのbool変数
+        self.memory = memory
+        ## @var top
+        #  要約に含める関数の数
+        self.top = top
+        ## @var interval
+        #  サンプリングの間隔(秒)
+        self.interval = interval
+        self._profile = None
+        self._samples = defaultdict(int)
+        self._sample_count = 0
+        self._old_handler = None
+        self._types_before = None
+        self._memory_result = None
+        self._start_time = None
+        self._elapsed = None
+
+    ## プロファイルを開始するメソッド
+    #
+    #  'sampling'の場合, SIGPROFによってexecute()中のシステムコールがEINTRで
+    #  失敗しないように, シグナルハンドラの実行後にシステムコールを再開させる.
+    #  @param self オブジェクト自身に対するポインタ
+    def start(self):
+        if self.memory:
+            if tracemalloc is not None:
+                tracemalloc.start()
+            else:
+                self._types_before = self._count_types()
+        self._start_time = time.time()
+        if self.mode == 'cprofile':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._old_handler = signal.signal(signal.SIGPROF, self._sample)
+            signal.siginterrupt(signal.SIGPROF, False)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    ## プロファイルを終了するメソッド
+    #
+    #  'sampling'の場合, シグナルハンドラと, signal.signal()で設定した場合の
+    #  既定の状態であるシステムコールを中断する設定を元に戻す.
+    #  @param self オブジェクト自身に対するポインタ
+    def stop(self):
+        if self.mode == 'cprofile':
+            self._profile.disable()
+        else:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self._old_handler)
+            signal.siginterrupt(signal.SIGPROF, True)
+        self._elapsed = time.time() - self._start_time
+        if self.memory:
+            self._memory_result = self._memory_summary()
+
+    ## スタックをサンプリングするシグナルハンドラ
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param signum シグナル番号
+    #  @param frame 割り込まれたフレーム
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(
+                _func_name(code.co_filename, code.co_firstlineno, code.co_name)
+            )
+            frame = frame.f_back
+        self._samples[';'.join(reversed(stack))] += 1
+        self._sample_count += 1
+
+    ## gcが追跡しているオブジェクト数を型ごとに数えるメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @return 型名をキーとするオブジェクト数の辞書
+    def _count_types(self):
+        counts = defaultdict(int)
+        for o in gc.get_objects():
+            counts[type(o).__name__] += 1
+        return counts
+
+    ## メモリ割り当ての要約を作成するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @return メモリ割り当ての要約の辞書
+    def _memory_summary(self):
+        summary = {
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        }
+        if tracemalloc is not None:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            summary['method'] = 'tracemalloc'
+            summary['current_bytes'] = current
+            summary['peak_bytes'] = peak
+            summary['top'] = [
+                {
+                    'location': str(stat.traceback),
+                    'size_bytes': stat.size,
+                    'count': stat.count,
+                }
+                for stat in snapshot.statistics('lineno')[:self.top]
+            ]
+        else:
+            after = self._count_types()
+            growth = [
+                (count - self._types_before.get(name, 0), name)
+                for name, count in after.items()
+            ]
+            growth.sort(reverse=True)
+            summary['method'] = 'gc_objects'
+            summary['top'] = [
+                {'type': name, 'count_growth': diff}
+                for diff, name in growth[:self.top] if diff > 0
+            ]
+        return summary
+
+    ## プロファイルをファイルに保存し, 要約を返すメソッド
+    #
+    #  cprofileの場合はprofile.prof(pstats形式)とprofile.txtを,
+    #  samplingの場合はprofile.folded(flamegraph用の畳み込み形式)とprofile.txtを保存する.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param output_dir 保存先のディレクトリのパス文字列
+    #  @return 要約の辞書
+    def save(self, output_dir):
+        summary = {'mode': self.mode, 'elapsed': self._elapsed}
+        txt_path = os.path.join(output_dir, 'profile.txt')
+        if self.mode == 'cprofile':
+            prof_path = os.path.join(output_dir, 'profile.prof')
+            self._profile.dump_stats(prof_path)
+            with open(txt_path, 'w') as f:
+                stats = pstats.Stats(prof_path, stream=f)
+                stats.sort_stats('tottime').print_stats(self.top)
+                stats.sort_stats('cumulative').print_stats(self.top)
+            rows = []
+            for (filename, lineno, funcname), (cc, nc, tt, ct, _) in \
+                    stats.stats.items():
+                name = _func_name(filename, lineno, funcname)
+                rows.append((tt, ct, nc, name))
+            rows.sort(reverse=True)
+            summary['top'] = [
+                {'function': name, 'ncalls': nc, 'tottime': tt, 'cumtime': ct}
+                for tt, ct, nc, name in rows[:self.top]
+            ]
+        else:
+            folded_path = os.path.join(output_dir, 'profile.folded')
+            with open(folded_path, 'w') as f:
+                for stack, count in sorted(self._samples.items()):
+                    f.write('%s %d\n' % (stack, count))
+            self_counts = defaultdict(int)
+            total_counts = defaultdict(int)
+            for stack, count in self._samples.items():
+                frames = stack.split(';')
+                self_counts[frames[-1]] += count
+                for name in set(frames):
+                    total_counts[name] += count
+            rows = sorted(
+                ((c, total_counts[name], name)
+                 for name, c in self_counts.items()), reverse=True
+            )
+            n = float(max(self._sample_count, 1))
+            summary['samples'] = self._sample_count
+            summary['interval'] = self.interval
+            summary['top'] = [
+                {
+                    'function': name,
+                    'self_ratio': c / n,
+                    'total_ratio': total / n,
+                }
+                for c, total, name in rows[:self.top]
+            ]
+            with open(txt_path, 'w') as f:
+                f.write('%d samples, interval %.4f s\n' % (
+                    self._sample_count, self.interval
+                ))
+                f.write('   self%  total%  function\n')
+                for row in summary['top']:
+                    f.write('%7.2f %7.2f  %s\n' % (
+                        row['self_ratio'] * 100, row['total_ratio'] * 100,
+                        row['function']
+                    ))
+        if self._memory_result is not None:
+            summary['memory'] = self._memory_result
+        return summary
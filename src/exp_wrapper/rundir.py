@@ -0,0 +1,162 @@
+# -*- coding:utf-8 -*-
+## @package rundir
+#
+#  実行の出力ディレクトリの名前の割り当てと配置(シャーディング)に関するパッケージ
+#
+#  出力ディレクトリはos.mkdir()で作成することで, 複数のプロセスやNFSで共有された
+#  複数のノードから同時に実行された場合でも, 同じ名前が割り当てられないようにしている.@n
+#  シャーディングを行う場合は, <root>/<module.Class>/<シャード>/<ディレクトリ名>に配置し,
+#  <root>/<module.Class>に目印のファイル(.shard)を置く.
+import errno
+import hashlib
+import os
+
+## シャーディングの方法
+SHARD_MODES = ['none', 'date', 'hash']
+
+## シャーディングされたクラスのディレクトリに置く目印のファイル名
+SHARD_MARKER = '.shard'
+
+
+## index番目の候補のディレクトリ名を返す関数
+#  @param base 元のディレクトリ名
+#  @param index 番号(0の場合は元のディレクトリ名)
+#  @return ディレクトリ名
+def _candidate(base, index):
+    if index == 0:
+        return base
+    return '%s_%d' % (base, index)
+
+
+## 使われていない候補の番号を探す関数
+#
+#  start番目から番号を倍々に増やして使われていない候補を見つけた後,
+#  二分探索で最小の番号を求める. 候補が連続して使われている場合は,
+#  使われている候補の数nに対してO(log n)回のstatで済む.
+#  @param base 元のディレクトリ名
+#  @param start 探索を開始する番号
+#  @return 使われていない候補の番号
+def free_index(base, start=0):
+    if not os.path.lexists(_candidate(base, start)):
+        return start
+    lo = start
+    step = 1
+    while os.path.lexists(_candidate(base, start + step)):
+        lo = start + step
+        step *= 2
+    hi = start + step
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if os.path.lexists(_candidate(base, mid)):
+            lo = mid
+        else:
+            hi = mid
+    return hi
+
+
+## 使われていないディレクトリ名を返す関数
+#
+#  ディレクトリは作成しないため, 同時に実行された場合には同じ名前が返されうる.
+#  @param base 元のディレクトリ名
+#  @return ディレクトリ名(baseが使われていない場合はbase, それ以外はbase_<番号>)
+def free_name(base):
+    return _candidate(base, free_index(base))
+
+
+## 使われていない名前のディレクトリを作成する関数
+#
+#  os.mkdir()が失敗した場合(他のプロセスが先に作成した場合)は, 次の候補から探索し直す.
+#  @param base 元のディレクトリ名
+#  @return 作成したディレクトリのパス文字列
+def make_unique_dir(base):
+    index = free_index(base)
+    while True:
+        path = _candidate(base, index)
+        try:
+            os.mkdir(path)
+            return path
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        index = free_index(base, index + 1)
+
+
+## ディレクトリを作成する関数(既に存在する場合は何もしない)
+#  @param path ディレクトリのパス文字列
+def makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+
+## シャードのディレクトリ名を返す関数
+#  @param mode シャーディングの方法('none', 'date'もしくは'hash')
+#  @param dir_str 出力ディレクトリ名の文字列
+#  @param date_str 日付を表す文字列('%Y%m%d_%H%M_%S'の形式)
+#  @return シャードのディレクトリ名('none'の場合はNone)
+def shard_name(mode, dir_str, date_str):
+    if mode == 'none':
+        return None
+    if mode == 'date':
+        return date_str[:8]
+    if mode == 'hash':
+        return hashlib.sha1(dir_str.encode('utf-8')).hexdigest()[:2]
+    raise ValueError('unknown shard mode: %s' % mode)
+
+
+## 出力ディレクトリを作成する関数
+#
+#  シャーディングを行う場合は, クラスのディレクトリに目印のファイルを置く.
+#  @param class_dir クラスのディレクトリのパス文字列
+#  @param dir_str 出力ディレクトリ名の文字列
+#  @param mode シャーディングの方法
+#  @param date_str 日付を表す文字列
+#  @return 作成したディレクトリのパス文字列
+def make_run_dir(class_dir, dir_str, mode='none', date_str=''):
+    shard = shard_name(mode, dir_str, date_str)
+    if shard is None:
+        parent = class_dir
+    else:
+        parent = os.path.join(class_dir, shard)
+    makedirs(parent)
+    if shard is not None:
+        marker = os.path.join(class_dir, SHARD_MARKER)
+        if not os.path.exists(marker):
+            with open(marker, 'a') as f:
+                f.write(mode + '\n')
+    return make_unique_dir(os.path.join(parent, dir_str))
+
+
+## 出力ディレクトリが属するクラスのディレクトリを返す関数
+#  @param run_dir 出力ディレクトリのパス文字列
+#  @return クラスのディレクトリのパス文字列
+def class_dir_of(run_dir):
+    parent = os.path.dirname(os.path.abspath(run_dir))
+    grandparent = os.path.dirname(parent)
+    if not os.path.exists(os.path.join(parent, SHARD_MARKER)) and \
+            os.path.exists(os.path.join(grandparent, SHARD_MARKER)):
+        return grandparent
+    return parent
+
+
+## クラスのディレクトリに含まれる出力ディレクトリの候補を列挙するジェネレータ
+#
+#  シャーディングされたクラスのディレクトリでは, シャードの中のディレクトリも列挙する.@n
+#  シャーディングを途中で有効にした場合のように, 両方の配置が混在していてもよい.
+#  @param class_dir クラスのディレクトリのパス文字列
+#  @param is_run_dir ディレクトリが出力ディレクトリであるかを判定する関数
+def iter_class_dir(class_dir, is_run_dir):
+    sharded = os.path.exists(os.path.join(class_dir, SHARD_MARKER))
+    for name in sorted(os.listdir(class_dir)):
+        path = os.path.join(class_dir, name)
+        if name.startswith('.') or not os.path.isdir(path):
+            continue
+        if is_run_dir(path):
+            yield path
+        elif sharded:
+            for run_name in sorted(os.listdir(path)):
+                run_dir = os.path.join(path, run_name)
+                if is_run_dir(run_dir):
+                    yield run_dir
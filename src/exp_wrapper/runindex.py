@@ -0,0 +1,533 @@
+# -*- coding:utf-8 -*-
+## @package runindex
+#
+#  出力ディレクトリ以下の実行結果を検索するためのSQLiteインデックスに関するパッケージ
+#
+#  各実行の入出力パラメータ, エラーの有無, コミットID, 実行時間, パスを記録する.@n
+#  入出力パラメータは入れ子の辞書を'.'で連結したキーに平坦化して
+#  paramsテーブルにも保存し, 条件検索に利用する.
+import codecs
+import errno
+import glob
+import json
+import os
+import re
+import sqlite3
+
+from exp_wrapper import gitlog, metrics, rundir
+
+
+## エラー終了した実行のエラー名と出力ディレクトリ名に付加した接尾辞を記録するファイル名
+ERROR_FILENAME = 'error.json'
+
+## エラー終了した実行の出力ディレクトリ名に付加されるエラー名のパターン
+#
+#  ERROR_FILENAMEが無い(記録する前に作成された)実行の判定にのみ用いる.
+ERROR_DIR_PATTERN = re.compile(
+    r'_([A-Za-z]*(?:Error|Exception|Interrupted|Exit))(?:_\d+)?$'
+)
+
+## 検索条件の演算子(長いものから順に照合する)
+OPERATORS = ['<=', '>=', '!=', '==', '=', '<', '>']
+
+## paramsテーブルを経由せずに検索できるrunsテーブルの列名
+RUN_COLUMNS = [
+    'path', 'class', 'name', 'date', 'status', 'commit_sha',
+    'started', 'finished', 'elapsed'
+]
+
+## runsテーブルの列のうち数値の列名(これ以外の列は文字列として比較する)
+RUN_NUMERIC_COLUMNS = ['started', 'finished', 'elapsed']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE,
+    class TEXT,
+    name TEXT,
+    date TEXT,
+    status TEXT,
+    commit_sha TEXT,
+    started REAL,
+    finished REAL,
+    elapsed REAL,
+    input_params TEXT,
+    output_params TEXT,
+    io_files TEXT
+);
+CREATE TABLE IF NOT EXISTS params (
+    run_id INTEGER,
+    section TEXT,
+    key TEXT,
+    num REAL,
+    text TEXT
+);
+CREATE INDEX IF NOT EXISTS params_num ON params (key, num);
+CREATE INDEX IF NOT EXISTS params_text ON params (key, text);
+CREATE INDEX IF NOT EXISTS params_run ON params (run_id);
+CREATE INDEX IF NOT EXISTS runs_class ON runs (class);
+"""
+
+
+## 入れ子の辞書を'.'で連結したキーの辞書に平坦化する関数
+#  @param d 平坦化する辞書
+#  @param prefix キーに付加するprefix
+#  @return 平坦化した辞書
+def flatten(d, prefix=''):
+    flat = {}
+    for key, value in d.items():
+        key = prefix + unicode(key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, key + '.'))
+        else:
+            flat[key] = value
+    return flat
+
+
+## エラー終了した実行のエラー名と出力ディレクトリ名に付加した接尾辞を記録する関数
+#  @param run_dir 実行の出力ディレクトリのパス文字列
+#  @param error_str errorに関する文字列
+#  @param suffix 出力ディレクトリ名に付加した接尾辞
+def write_error(run_dir, error_str, suffix):
+    with open(os.path.join(run_dir, ERROR_FILENAME), 'w') as f:
+        json.dump({'error': error_str, 'suffix': suffix}, f)
+
+
+## write_error()で記録したエラーを読み込む関数
+#  @param run_dir 実行の出力ディレクトリのパス文字列
+#  @return 'error'と'suffix'をキーとする辞書(記録されていない場合はNone)
+def read_error(run_dir):
+    try:
+        with open(os.path.join(run_dir, ERROR_FILENAME), 'r') as f:
+            return json.load(f)
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    return None
+
+
+## write_error()で記録したエラーを削除する関数
+#  @param run_dir 実行の出力ディレクトリのパス文字列
+def remove_error(run_dir):
+    try:
+        os.remove(os.path.join(run_dir, ERROR_FILENAME))
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+## 実行のエラー名を返す関数
+#
+#  write_error()で記録したエラー名を返す. 記録されていない場合は
+#  出力ディレクトリ名からERROR_DIR_PATTERNで取り出す.
+#  @param run_dir 実行の出力ディレクトリのパス文字列
+#  @return エラー名の文字列(正常終了した実行の場合はNone)
+def parse_status(run_dir):
+    error = read_error(run_dir)
+    if error is not None:
+        return error['error']
+    m = ERROR_DIR_PATTERN.search(os.path.basename(run_dir.rstrip(os.sep)))
+    if m is None:
+        return None
+    return m.group(1)
+
+
+## 実行の出力ディレクトリを列挙するジェネレータ
+#
+#  root/<モジュール名.クラス名>/<ディレクトリ名>
+#  (シャーディングされている場合はroot/<モジュール名.クラス名>/<シャード>/<ディレクトリ名>)
+#  のうち, io_params_*.jsonを含むディレクトリを列挙する.@n
+#  '.'で始まるディレクトリ(キャッシュ等)は対象外とする.
+#  @param root 実験のルートディレクトリのパス文字列
+def iter_run_dirs(root):
+    if not os.path.isdir(root):
+        return
+    for class_name in sorted(os.listdir(root)):
+        class_dir = os.path.join(root, class_name)
+        if class_name.startswith('.') or not os.path.isdir(class_dir):
+            continue
+        for run_dir in rundir.iter_class_dir(class_dir, is_run_dir):
+            yield run_dir
+
+
+## io_params_*.jsonを含むディレクトリであるかを判定する関数
+#  @param path ディレクトリのパス文字列
+#  @return 含む場合はTrue
+def is_run_dir(path):
+    return bool(glob.glob(os.path.join(path, 'io_params_*.json')))
+
+
+## 実行中に逐次記録された指標を1件ずつ読み込むジェネレータ
+#
+#  インデックスには指標の要約のみが登録されるため, 個々の記録は本関数で読み込む.
+#  @param run_dir 実行の出力ディレクトリのパス文字列
+def iter_run_metrics(run_dir):
+    path = os.path.join(run_dir, metrics.METRICS_FILENAME)
+    if not os.path.exists(path):
+        return iter([])
+    return metrics.iter_metrics(path)
+
+
+## 実行の出力ディレクトリからインデックスに登録するレコードを生成する関数
+#
+#  status, started, finishedを省略した場合には, それぞれ出力ディレクトリ名,
+#  args.txtのmtime, io_params_*.jsonのmtimeから推定する.
+#  @param run_dir 実行の出力ディレクトリのパス文字列
+#  @param status エラーに関する文字列(正常終了の場合はNone)
+#  @param started 実行開始時刻
+#  @param finished 実行終了時刻
+#  @return レコードの辞書(jsonファイルが存在しない場合はNone)
+def make_record(run_dir, status=None, started=None, finished=None):
+    run_dir = os.path.abspath(run_dir)
+    io_params_paths = sorted(
+        glob.glob(os.path.join(run_dir, 'io_params_*.json'))
+    )
+    if not io_params_paths:
+        return None
+    io_params_path = io_params_paths[-1]
+    date = os.path.basename(io_params_path)[len('io_params_'):-len('.json')]
+    with open(io_params_path, 'r') as f:
+        io_params = json.load(f)
+    io_files = {}
+    io_files_path = os.path.join(run_dir, 'io_files_%s.json' % date)
+    if os.path.exists(io_files_path):
+        with open(io_files_path, 'r') as f:
+            io_files = json.load(f)
+
+    commit_sha = None
+    for commitlog_path in glob.glob(os.path.join(run_dir, 'commitlog_*.txt')):
+        with codecs.open(commitlog_path, 'r', 'utf-8') as f:
+            commit_sha = gitlog.read_hexsha(f.readline())
+        break
+
+    if status is None:
+        status = parse_status(run_dir)
+    if started is None:
+        # args.txtは実行開始前に作成される
+        args_path = os.path.join(run_dir, 'args.txt')
+        if os.path.exists(args_path):
+            started = os.path.getmtime(args_path)
+        else:
+            started = os.path.getmtime(run_dir)
+    if finished is None:
+        finished = os.path.getmtime(io_params_path)
+
+    return {
+        'path': run_dir,
+        'class': os.path.basename(rundir.class_dir_of(run_dir)),
+        'name': os.path.basename(run_dir),
+        'date': date,
+        'status': status or 'ok',
+        'commit_sha': commit_sha,
+        'started': started,
+        'finished': finished,
+        'elapsed': finished - started,
+        'input_params': io_params.get('input_params', {}),
+        'output_params': io_params.get('output_params', {}),
+        'io_files': io_files,
+    }
+
+
+## 実行結果のSQLiteインデックスを扱うクラス
+class RunIndex(object):
+    ## コンストラクタ
+    #
+    #  複数のプロセスから同時に更新される場合に備えて,
+    #  ロックの待ち時間を長めに設定している.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param db_path データベースファイルのパス文字列
+    #  @param timeout ロックの待ち時間(秒)
+    def __init__(self, db_path, timeout=60.0):
+        ## @var db_path
+        #  データベースファイルのパス文字列
+        self.db_path = db_path
+        ## @var conn
+        #  データベースとのコネクション
+        self.conn = sqlite3.connect(db_path, timeout=timeout)
+        self._create_schema()
+
+    ## テーブルおよびインデックスを作成するメソッド
+    #
+    #  複数のプロセスが同時にテーブルを作成するとスキーマの変更が競合するため,
+    #  排他ロックを取得してから作成する.
+    #  @param self オブジェクト自身に対するポインタ
+    def _create_schema(self):
+        c = self.conn
+        if c.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'runs_class'"
+        ).fetchone() is not None:
+            return
+        isolation_level = c.isolation_level
+        c.isolation_level = None
+        try:
+            c.execute('BEGIN EXCLUSIVE')
+            try:
+                for statement in _SCHEMA.split(';'):
+                    if statement.strip():
+                        c.execute(statement)
+                c.execute('COMMIT')
+            except Exception:
+                c.execute('ROLLBACK')
+                raise
+        finally:
+            c.isolation_level = isolation_level
+
+    ## コネクションを閉じるメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    def close(self):
+        self.conn.close()
+
+    ## レコードを登録するメソッド
+    #
+    #  同じパスのレコードがすでに存在する場合には置き換える.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param records make_record()で生成したレコードのリスト
+    def add(self, records):
+        with self.conn:
+            for record in records:
+                self._insert(record)
+
+    ## レコードを削除するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param paths 削除する実行の出力ディレクトリのパス文字列のリスト
+    def remove(self, paths):
+        with self.conn:
+            for path in paths:
+                row = self.conn.execute(
+                    'SELECT id FROM runs WHERE path = ?', (path,)
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        'DELETE FROM params WHERE run_id = ?', row
+                    )
+                    self.conn.execute('DELETE FROM runs WHERE id = ?', row)
+
+    ## 全てのレコードを削除するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    def clear(self):
+        with self.conn:
+            self.conn.execute('DELETE FROM params')
+            self.conn.execute('DELETE FROM runs')
+
+    ## 全てのレコードを置き換えるメソッド
+    #
+    #  削除と登録を1つのトランザクションで行うため, 途中で失敗した場合や
+    #  同時に検索された場合にも空のインデックスが見えることはない.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param records make_record()で生成したレコードのリスト
+    def replace_all(self, records):
+        with self.conn:
+            self.conn.execute('DELETE FROM params')
+            self.conn.execute('DELETE FROM runs')
+            for record in records:
+                self._insert(record)
+
+    ## レコードを1件登録するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param record make_record()で生成したレコード
+    def _insert(self, record):
+        c = self.conn
+        row = c.execute(
+            'SELECT id FROM runs WHERE path = ?', (record['path'],)
+        ).fetchone()
+        if row is not None:
+            c.execute('DELETE FROM params WHERE run_id = ?', row)
+            c.execute('DELETE FROM runs WHERE id = ?', row)
+        cur = c.execute(
+            'INSERT INTO runs (path, class, name, date, status, commit_sha, '
+            'started, finished, elapsed, input_params, output_params, '
+            'io_files) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                record['path'], record['class'], record['name'],
+                record['date'], record['status'], record['commit_sha'],
+                record['started'], record['finished'], record['elapsed'],
+                json.dumps(record['input_params']),
+                json.dumps(record['output_params']),
+                json.dumps(record['io_files']),
+            )
+        )
+        run_id = cur.lastrowid
+        params = []
+        for section in ('input_params', 'output_params'):
+            for key, value in flatten(record[section]).items():
+                num = None
+                if isinstance(value, (bool, int, long, float)):
+                    num = float(value)
+                    text = None
+                elif isinstance(value, basestring):
+                    text = value
+                else:
+                    text = json.dumps(value)
+                params.append((run_id, section, key, num, text))
+        c.executemany(
+            'INSERT INTO params (run_id, section, key, num, text) '
+            'VALUES (?, ?, ?, ?, ?)', params
+        )
+
+    ## 条件に合うレコードを検索するメソッド
+    #
+    #  検索条件は'KEY OP VALUE'の形式の文字列で与える(例: 'x>5', 'status=ok').@n
+    #  KEYにはrunsテーブルの列名, もしくは平坦化したパラメータ名を指定する.@n
+    #  パラメータ名の先頭に'input_params.'もしくは'output_params.'を付けた場合は
+    #  入力もしくは出力パラメータのみを対象とする.@n
+    #  VALUEが数値として解釈できる場合には数値として比較する
+    #  (runsテーブルの列は, 数値の列の場合のみ数値として比較する).
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param where 検索条件の文字列のリスト
+    #  @param sort_key 並べ替えに用いるKEY('-'を先頭に付けると降順)
+    #  @param limit 取得するレコード数の上限
+    #  @param columns 結果に含めるパラメータ名のリスト
+    #  @return 検索結果の辞書のリスト
+    def query(self, where=(), sort_key=None, limit=None, columns=()):
+        clauses = []
+        values = []
+        for cond in where:
+            key, op, value = parse_condition(cond)
+            if op == '==':
+                op = '='
+            if key in RUN_COLUMNS:
+                clauses.append('r.%s %s ?' % (key, op))
+                if key in RUN_NUMERIC_COLUMNS:
+                    value = _to_number(value, value)
+                values.append(value)
+                continue
+            section_clause, section, key = _split_section(key)
+            num = _to_number(value)
+            column = 'num' if num is not None else 'text'
+            clauses.append(
+                'EXISTS (SELECT 1 FROM params p WHERE p.run_id = r.id '
+                'AND p.key = ?%s AND p.%s %s ?)' % (section_clause, column, op)
+            )
+            values.append(key)
+            if section is not None:
+                values.append(section)
+            values.append(num if num is not None else value)
+
+        sql = 'SELECT r.id, %s FROM runs r' % ', '.join(
+            'r.%s' % c for c in RUN_COLUMNS
+        )
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        if sort_key is not None:
+            order = 'ASC'
+            if sort_key.startswith('-'):
+                sort_key = sort_key[1:]
+                order = 'DESC'
+            if sort_key in RUN_COLUMNS:
+                sql += ' ORDER BY r.%s %s' % (sort_key, order)
+            else:
+                section_clause, section, key = _split_section(sort_key)
+                sql += (
+                    ' ORDER BY (SELECT COALESCE(p.num, p.text) FROM params p '
+                    'WHERE p.run_id = r.id AND p.key = ?%s) %s' %
+                    (section_clause, order)
+                )
+                values.append(key)
+                if section is not None:
+                    values.append(section)
+        if limit is not None:
+            sql += ' LIMIT %d' % limit
+
+        results = []
+        for row in self.conn.execute(sql, values):
+            result = dict(zip(RUN_COLUMNS, row[1:]))
+            for column in columns:
+                if column in RUN_COLUMNS:
+                    continue
+                section_clause, section, key = _split_section(column)
+                param_values = [row[0], key]
+                if section is not None:
+                    param_values.append(section)
+                param = self.conn.execute(
+                    'SELECT num, text FROM params p WHERE p.run_id = ? '
+                    'AND p.key = ?%s' % section_clause, param_values
+                ).fetchone()
+                if param is None:
+                    result[column] = None
+                elif param[0] is not None:
+                    result[column] = param[0]
+                else:
+                    result[column] = param[1]
+            results.append(result)
+        return results
+
+
+## 検索条件の文字列を(KEY, OP, VALUE)に分解する関数
+#  @param cond 検索条件の文字列
+#  @return (KEY, OP, VALUE)のタプル
+def parse_condition(cond):
+    best = None
+    for op in OPERATORS:
+        pos = cond.find(op)
+        if pos > 0 and (best is None or pos < best[0]):
+            best = (pos, op)
+    if best is None:
+        raise ValueError('invalid condition: %s' % cond)
+    pos, op = best
+    return cond[:pos].strip(), op, cond[pos + len(op):].strip()
+
+
+## 文字列を数値に変換する関数
+#  @param value 変換する文字列
+#  @param default 数値に変換できない場合の返り値
+#  @return 変換した数値
+def _to_number(value, default=None):
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+
+## パラメータ名から入出力の区別を取り出す関数
+#  @param key パラメータ名
+#  @return (SQLの条件文字列, 入出力の区別, パラメータ名)のタプル
+def _split_section(key):
+    for section in ('input_params', 'output_params'):
+        if key.startswith(section + '.'):
+            return ' AND p.section = ?', section, key[len(section) + 1:]
+    return '', None, key
+
+
+## 実行ディレクトリからレコードを生成する関数(ワーカープロセス用)
+#  @param run_dir 実行の出力ディレクトリのパス文字列
+#  @return レコードの辞書(読み込みに失敗した場合はNone)
+def _make_record_safe(run_dir):
+    try:
+        return make_record(run_dir)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+## 既存の出力ディレクトリを走査してインデックスを再構築する関数
+#
+#  jsonファイルの読み込みは複数のワーカープロセスで並列に行い,
+#  データベースへの書き込みは1つのトランザクションで行う.
+#  @param root 実験のルートディレクトリのパス文字列
+#  @param db_path データベースファイルのパス文字列
+#  @param jobs ワーカープロセス数(Noneの場合はCPU数)
+#  @return 登録したレコード数
+def rebuild(root, db_path, jobs=None):
+    import multiprocessing
+    run_dirs = list(iter_run_dirs(root))
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    if jobs > 1 and len(run_dirs) > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            records = list(pool.imap(_make_record_safe, run_dirs, 64))
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        records = [_make_record_safe(d) for d in run_dirs]
+    records = [r for r in records if r is not None]
+
+    index = RunIndex(db_path)
+    try:
+        index.replace_all(records)
+    finally:
+        index.close()
+    return len(records)
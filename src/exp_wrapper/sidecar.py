@@ -0,0 +1,189 @@
+# -*- coding:utf-8 -*-
+## @package sidecar
+#
+#  大きな数値配列のパラメータをjsonとは別のバイナリファイル(サイドカー)に
+#  保存するためのパッケージ
+#
+#  NumPyが利用できる場合は.npy形式で保存し, memmapとして読み込む.@n
+#  利用できない場合は数値(boolを含む)のリストをarrayモジュールで生のバイナリとして保存する.@n
+#  NumPyのimportには時間がかかるため, 必要になった時点でimportする.
+import array
+import hashlib
+import os
+import re
+import sys
+
+## _numpy()がimportしたnumpyモジュール(未importの場合はFalse)
+_numpy_module = False
+
+## サイドカーへの参照であることを示すキー
+SIDECAR_KEY = '__sidecar__'
+
+## サイドカーを保存するディレクトリの名前
+SIDECAR_DIRNAME = 'sidecars'
+
+_BYTEORDER = '<' if sys.byteorder == 'little' else '>'
+
+
+## numpyモジュールを返す関数
+#
+#  初めて呼び出された時にimportする.
+#  @return numpyモジュール(利用できない場合はNone)
+def _numpy():
+    global _numpy_module
+    if _numpy_module is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy_module = numpy
+    return _numpy_module
+
+
+## 値がサイドカーに保存すべき大きな数値配列であるかを判定する関数
+#  @param value 判定する値
+#  @param threshold 要素数の閾値
+#  @return サイドカーに保存すべき場合はTrue
+def is_large_array(value, threshold):
+    if threshold <= 0:
+        return False
+    # ndarrayであればnumpyはimport済みであるため, importを引き起こさない
+    numpy = sys.modules.get('numpy')
+    if numpy is not None and isinstance(value, numpy.ndarray):
+        return value.size >= threshold and \
+            value.dtype.kind in ('b', 'i', 'u', 'f', 'c')
+    if isinstance(value, (list, tuple)) and len(value) >= threshold:
+        numpy = _numpy()
+        if numpy is not None:
+            return numpy.asarray(value).dtype.kind in ('b', 'i', 'u', 'f')
+        return all(isinstance(v, (int, long, float)) for v in value)
+    return False
+
+
+## サイドカーのファイル名(拡張子を除く)を返す関数
+#
+#  ファイル名に使えない文字は'_'に置き換えるため, 置き換えによって異なるキーが
+#  同じファイル名にならないように, 元の名前のsha1の先頭8文字を付加する.
+#  @param name パラメータのキーから生成した名前
+#  @return ファイル名
+def _file_name(name):
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    digest = hashlib.sha1(name).hexdigest()[:8]
+    return '%s-%s' % (re.sub(r'[^A-Za-z0-9_.-]', '_', name), digest)
+
+
+## 大きな数値配列をサイドカーに保存し, 参照の辞書を返す関数
+#  @param value 保存する値
+#  @param base_dir 出力ディレクトリのパス文字列
+#  @param name パラメータのキーから生成した名前(ファイル名は_file_name()で決める)
+#  @return サイドカーへの参照の辞書
+def write_sidecar(value, base_dir, name):
+    sidecar_dir = os.path.join(base_dir, SIDECAR_DIRNAME)
+    if not os.path.isdir(sidecar_dir):
+        os.makedirs(sidecar_dir)
+    name = _file_name(name)
+    numpy = _numpy()
+    if numpy is not None:
+        a = numpy.ascontiguousarray(value)
+        rel_path = os.path.join(SIDECAR_DIRNAME, name + '.npy')
+        numpy.save(os.path.join(base_dir, rel_path), a)
+        return {
+            SIDECAR_KEY: 'npy',
+            'dtype': a.dtype.str,
+            'shape': list(a.shape),
+            'path': rel_path,
+        }
+    if all(isinstance(v, bool) for v in value):
+        a = array.array('B', value)
+        dtype = '|b1'
+    elif all(isinstance(v, (int, long)) for v in value):
+        a = array.array('l', value)
+        dtype = '%si%d' % (_BYTEORDER, a.itemsize)
+    else:
+        a = array.array('d', value)
+        dtype = '%sf%d' % (_BYTEORDER, a.itemsize)
+    rel_path = os.path.join(SIDECAR_DIRNAME, name + '.bin')
+    with open(os.path.join(base_dir, rel_path), 'wb') as f:
+        a.tofile(f)
+    return {
+        SIDECAR_KEY: 'raw',
+        'dtype': dtype,
+        'shape': [len(a)],
+        'path': rel_path,
+    }
+
+
+## 辞書に含まれる大きな数値配列をサイドカーへの参照に置き換える関数
+#
+#  入れ子の辞書も再帰的に処理する. 引数の辞書は変更せず, 新しい辞書を返す.
+#  @param params パラメータの辞書
+#  @param base_dir 出力ディレクトリのパス文字列
+#  @param prefix サイドカーのファイル名に付加するprefix
+#  @param threshold 要素数の閾値
+#  @return 置き換え後の辞書
+def replace_large_values(params, base_dir, prefix, threshold):
+    replaced = {}
+    for key, value in params.items():
+        name = '%s.%s' % (prefix, key)
+        if isinstance(value, dict):
+            replaced[key] = replace_large_values(
+                value, base_dir, name, threshold
+            )
+        elif is_large_array(value, threshold):
+            replaced[key] = write_sidecar(value, base_dir, name)
+        else:
+            replaced[key] = value
+    return replaced
+
+
+## 値がサイドカーへの参照であるかを判定する関数
+#  @param value 判定する値
+#  @return 参照である場合はTrue
+def is_sidecar(value):
+    return isinstance(value, dict) and SIDECAR_KEY in value
+
+
+## サイドカーへの参照から配列を読み込む関数
+#
+#  NumPyが利用できる場合は読み込み専用のmemmapを返す.@n
+#  利用できない場合は, 生のバイナリをarray.arrayとして読み込む.
+#  @param ref サイドカーへの参照の辞書
+#  @param base_dir 出力ディレクトリのパス文字列
+#  @return 配列
+def load(ref, base_dir):
+    path = os.path.join(base_dir, ref['path'])
+    numpy = _numpy()
+    if ref[SIDECAR_KEY] == 'npy':
+        if numpy is None:
+            raise ImportError('numpy is required to load %s' % path)
+        return numpy.load(path, mmap_mode='r')
+    if numpy is not None:
+        return numpy.memmap(
+            path, dtype=numpy.dtype(str(ref['dtype'])), mode='r',
+            shape=tuple(ref['shape'])
+        )
+    a = array.array({'b': 'B', 'i': 'l'}.get(ref['dtype'][1], 'd'))
+    with open(path, 'rb') as f:
+        a.fromfile(f, ref['shape'][0])
+    if ref['dtype'][0] != _BYTEORDER:
+        a.byteswap()
+    return a
+
+
+## 辞書に含まれるサイドカーへの参照を配列に置き換える関数
+#
+#  io_params_*.jsonを読み込んだ辞書に対して用いる.
+#  @param params パラメータの辞書
+#  @param base_dir 出力ディレクトリのパス文字列
+#  @return 置き換え後の辞書
+def load_params(params, base_dir):
+    loaded = {}
+    for key, value in params.items():
+        if is_sidecar(value):
+            loaded[key] = load(value, base_dir)
+        elif isinstance(value, dict):
+            loaded[key] = load_params(value, base_dir)
+        else:
+            loaded[key] = value
+    return loaded
@@ -0,0 +1,97 @@
+# -*- coding:utf-8 -*-
+## @package sweep
+#
+#  パラメータスイープ(複数のコマンドライン引数の組による一括実行)に関するパッケージ
+import itertools
+import shlex
+import sys
+
+from exp_wrapper import logutil
+
+
+## コマンドライン引数の組を記述したファイルを読み込む関数
+#
+#  1行を1回分の実行に対応するコマンドライン引数として扱い,
+#  シェルと同様の規則で分割する.@n
+#  空行および'#'で始まる行は無視する.
+#  @param filepath 読み込むファイルのパス文字列
+#  @return コマンドライン引数のリストのリスト
+def read_argv_file(filepath):
+    argv_sets = []
+    with open(filepath, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            argv_sets.append(shlex.split(line))
+    return argv_sets
+
+
+## グリッドの指定文字列を解釈する関数
+#
+#  'KEY=V1,V2,...'の形式の文字列のリストを, キーと値のリストの組に変換する.
+#  @param grid_specs グリッドの指定文字列のリスト
+#  @return (キー, 値のリスト)のリスト
+def parse_grid(grid_specs):
+    grid = []
+    for spec in grid_specs:
+        if '=' not in spec:
+            raise ValueError('invalid grid specification: %s' % spec)
+        key, values = spec.split('=', 1)
+        grid.append((key, values.split(',')))
+    return grid
+
+
+## コマンドライン引数の組とグリッドの直積を展開する関数
+#
+#  各コマンドライン引数に含まれる'{KEY}'をグリッドの値で置換する.@n
+#  グリッドが空の場合には, argv_setsをそのまま返す.
+#  @param argv_sets コマンドライン引数のリストのリスト
+#  @param grid parse_grid()で生成した(キー, 値のリスト)のリスト
+#  @return 展開後のコマンドライン引数のリストのリスト
+def expand_grid(argv_sets, grid):
+    if not grid:
+        return [list(argv) for argv in argv_sets]
+    keys = [key for key, _ in grid]
+    expanded = []
+    for argv in argv_sets:
+        for values in itertools.product(*[v for _, v in grid]):
+            point = []
+            for arg in argv:
+                for key, value in zip(keys, values):
+                    arg = arg.replace('{%s}' % key, value)
+                point.append(arg)
+            expanded.append(point)
+    return expanded
+
+
+## 関数を複数のワーカープロセスで並列に実行する関数
+#
+#  ワーカープロセスはforkで生成されるため, 呼び出し前にimportした
+#  モジュールやクラスはそのままワーカーから利用できる.@n
+#  実行ごとの状態(ロガーのハンドラ等)が残らないように, 1プロセスにつき1タスクを実行する.
+#  ワーカープロセスではlogutil.after_fork()でロガーのロックを作成し直す.
+#  @param func 各タスクに対して実行する関数(pickle可能である必要がある)
+#  @param tasks funcに渡す引数のリスト
+#  @param jobs ワーカープロセス数(Noneの場合はCPU数)
+#  @return 各タスクに対するfuncの返り値のリスト
+def run_parallel(func, tasks, jobs=None):
+    import multiprocessing
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    if jobs <= 1:
+        return [func(task) for task in tasks]
+    logutil.before_fork()
+    pool = multiprocessing.Pool(
+        jobs, initializer=logutil.after_fork, maxtasksperchild=1
+    )
+    try:
+        # get()にタイムアウトを与えないとKeyboardInterruptを受け取れない
+        results = pool.map_async(func, tasks, chunksize=1).get(sys.maxint)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
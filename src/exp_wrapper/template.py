@@ -4,12 +4,37 @@
 #  実験用スクリプトのテンプレートが定義されているパッケージ
 import json
 import argparse
+import os
 from logging import getLogger
 from logging import StreamHandler, FileHandler
 from logging import INFO, DEBUG
 from logging import Formatter
 from inspect import currentframe
-from os.path import splitext, split
+from os.path import splitext, split, join
+import time
+from exp_wrapper import metrics, sidecar, logutil, checkpoint
+
+## 生成したパーサのキャッシュ
+#
+#  クラスをキーとし, パーサ名をキーとするパーサの辞書を値とする.
+_parser_cache = {}
+
+
+## クラスごとにキャッシュしたパーサを返す関数
+#
+#  objのクラスに対して初めて呼び出された場合はmakeでパーサを生成してキャッシュする.@n
+#  objのcache_parserがFalseの場合はキャッシュせずに毎回生成する.
+#  @param obj template.Mainを継承したオブジェクト
+#  @param name パーサ名
+#  @param make パーサを生成する関数
+#  @return パーサオブジェクト
+def cached_parser(obj, name, make):
+    if not getattr(obj, 'cache_parser', False):
+        return make()
+    parsers = _parser_cache.setdefault(type(obj), {})
+    if name not in parsers:
+        parsers[name] = make()
+    return parsers[name]
 
 
 ## スクリプトのメインとなるテンプレートクラス
@@ -17,7 +42,29 @@ from os.path import splitext, split
 #  実験用スクリプトのメインとなるテンプレートクラス.@n
 #  このMainクラスは継承して利用することを想定している.@n
 #  継承先のクラスでは, excute()とmake_parser()をオーバーライドする.@n
+#  make_parser()がインスタンスの状態に依存する既存のクラスの動作を変えないように,
+#  パーサは既定では毎回生成する. クラス変数cache_parserをTrueにすると
+#  パーサがクラスごとにキャッシュされ, 2つ目以降のインスタンスでは
+#  コマンドライン引数のパースのみを行う.@n
+#  入力パラメータに含めない実行時の設定はクラス変数として持ち,
+#  継承先のクラスもしくはexperimentスクリプトの++オプションで変更する.
 class Main(object):
+    ## @var cache_parser
+    #  パーサをクラスごとにキャッシュするかどうかのbool変数
+    cache_parser = False
+    ## @var sidecar_threshold
+    #  この要素数以上の数値配列をサイドカーに保存する(0の場合は保存しない)
+    sidecar_threshold = 1024
+    ## @var async_log
+    #  ログの書式化と出力をバックグラウンドのスレッドで行うかどうかのbool変数
+    async_log = False
+    ## @var checkpoint_keep
+    #  残すチェックポイントの数(0の場合は全て残す)
+    checkpoint_keep = 3
+    ## @var checkpoint_interval
+    #  checkpoint()でチェックポイントを保存する最小の間隔(秒)
+    checkpoint_interval = 60.0
+
     ## コンストラクタ
     #  @param self オブジェクト自身に対するポインタ
     #  @param argv コマンドライン引数を保持するリスト
@@ -43,10 +90,26 @@ class Main(object):
         ## @var out_symlinks
         #  シンボリックリンクを張りたい出力ファイル名を記述する辞書
         self.out_symlinks = dict()
+        ## @var output_dir
+        #  実験結果の出力ディレクトリ(experimentスクリプトから実行された場合に設定される)
+        self.output_dir = None
+        ## @var metrics
+        #  log_metrics()で記録した指標の書き込みを行うオブジェクト
+        self.metrics = None
+        ## @var checkpoint_step
+        #  最後に保存もしくは読み込んだチェックポイントのステップ数
+        self.checkpoint_step = None
+        ## @var resumed_step
+        #  load_checkpoint()で再開したチェックポイントのステップ数
+        self.resumed_step = None
+        self._checkpoint_saved = 0
+        self._checkpoint_time = time.time()
         pyfile_str = currentframe().f_back.f_code.co_filename
         abspath_without_ext = splitext(pyfile_str)[0]
         module_name = split(abspath_without_ext)[1]
-        self.make_logger(module_name, self.args.verbose, self.args.logfile)
+        self.make_logger(
+            module_name, self.args.verbose, self.args.logfile, self.async_log
+        )
         formatter = Formatter(
             "[%(asctime) -15s]\n%(filename)s,"
             "L%(lineno)s:%(levelname)s\t%(message)s"
@@ -60,32 +123,145 @@ class Main(object):
     #  ただし, ログファイル名を指定しなかった場合(logfile_name=Noneの場合)には
     #  ファイル出力は行わない.@n
     #  また, ファイルへのログレベルはDEBUGに設定している.@n
+    #  同じ名前のロガーに対して以前に登録したハンドラは取り除かれるため,
+    #  複数のインスタンスを生成してもハンドラは重複しない.@n
+    #  async_logがTrueの場合は, 書式化と出力をバックグラウンドのスレッドで行う.
     #  @param self オブジェクト自身に対するポインタ
     #  @param name ロガーの名前
     #  @param level 標準出力のハンドラに対するログレベル
     #  @param logfile_name ログをファイル出力する場合のファイル名
-    def make_logger(self, name, level, logfile_name=None):
+    #  @param async_log 非同期にログを出力するかどうかのbool変数
+    def make_logger(self, name, level, logfile_name=None, async_log=False):
         ## @var logger
         #  メソッドexcute()内で利用するロガーオブジェクト
         self.logger = getLogger(name)
         self.logger.setLevel(DEBUG)
         sh = StreamHandler()
         sh.setLevel(level)
-        self.logger.addHandler(sh)
+        handlers = [sh]
         if logfile_name is not None:
             fh = FileHandler(logfile_name, 'w')
             fh.setLevel(DEBUG)
-            self.logger.addHandler(fh)
+            handlers.append(fh)
             self.out_files['log'] = logfile_name
+        logutil.install(self.logger, handlers, async_log)
         self.logger.propagate = False
 
     ## ロガーに対してフォーマッタを設定するメソッド
     #  @param self オブジェクト自身に対するポインタ
     #  @param formatter メンバ変数loggerに設定したいフォーマッタオブジェクト
     def set_logger_format(self, formatter):
-        for handler in self.logger.handlers:
+        for handler in logutil.handlers(self.logger):
             handler.setFormatter(formatter)
 
+    ## 指標を逐次記録するメソッド
+    #
+    #  記録はJSON Lines形式で出力ディレクトリのmetrics.jsonlに追記される.@n
+    #  experimentスクリプトを用いずに実行した場合はカレントディレクトリに出力し,
+    #  out_filesに登録する.@n
+    #  記録の要約はmake_output_json()でout_paramsの'metrics'に保存される
+    #  (execute()で'metrics'を設定した場合は保存されない).
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param step ステップ数(Noneの場合は記録しない)
+    #  @param values 記録する指標の名前と値
+    def log_metrics(self, step=None, **values):
+        if self.metrics is None:
+            if self.output_dir is not None:
+                path = join(self.output_dir, metrics.METRICS_FILENAME)
+            else:
+                path = metrics.METRICS_FILENAME
+                self.out_files['metrics'] = path
+            self.metrics = metrics.MetricsWriter(path)
+        record = dict(values)
+        if step is not None:
+            record['step'] = step
+        record['time'] = time.time()
+        self.metrics.append(record)
+
+    ## チェックポイントのディレクトリのパス文字列を返すメソッド
+    #
+    #  experimentスクリプトを用いずに実行した場合はカレントディレクトリ以下とする.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @return パス文字列
+    def checkpoint_dir(self):
+        if self.output_dir is not None:
+            return join(self.output_dir, checkpoint.CHECKPOINT_DIRNAME)
+        return checkpoint.CHECKPOINT_DIRNAME
+
+    ## チェックポイントを保存するメソッド
+    #
+    #  状態はpickle化して出力ディレクトリのcheckpointsにアトミックに保存され,
+    #  checkpoint_keepで指定した数の新しいものだけが残される.@n
+    #  experimentスクリプトを用いずに実行した場合はカレントディレクトリに保存し,
+    #  out_filesに登録する.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param state 保存する状態(pickle化できるオブジェクト)
+    #  @param step ステップ数(Noneの場合は前回のステップ数に1を加えた値)
+    #  @return 保存したファイルのパス文字列
+    def save_checkpoint(self, state, step=None):
+        if step is None:
+            if self.checkpoint_step is None:
+                step = 0
+            else:
+                step = self.checkpoint_step + 1
+        path = checkpoint.save(
+            self.checkpoint_dir(), state, step, self.checkpoint_keep
+        )
+        if self.output_dir is None:
+            self.out_files['checkpoints'] = checkpoint.CHECKPOINT_DIRNAME
+        self.checkpoint_step = step
+        self._checkpoint_saved += 1
+        self._checkpoint_time = time.time()
+        self.logger.debug('checkpoint has been saved to %s' % path)
+        return path
+
+    ## 前回のチェックポイントの保存からcheckpoint_intervalで指定した時間が
+    #  経過していればチェックポイントを保存するメソッド
+    #
+    #  execute()のループの中で毎回呼び出すことで, 一定時間ごとに状態を保存できる.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param state 保存する状態(pickle化できるオブジェクト)
+    #  @param step ステップ数
+    #  @return 保存したファイルのパス文字列(保存しなかった場合はNone)
+    def checkpoint(self, state, step=None):
+        elapsed = time.time() - self._checkpoint_time
+        if elapsed < self.checkpoint_interval:
+            return None
+        return self.save_checkpoint(state, step)
+
+    ## 最新のチェックポイントを読み込むメソッド
+    #
+    #  experiment +resumeで中断した実行を再開した場合に, 保存済みの状態を返す.@n
+    #  以降のsave_checkpoint()のステップ数は, 読み込んだステップ数から続く.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @return 保存した状態(チェックポイントが無い場合はNone)
+    def load_checkpoint(self):
+        step, state = checkpoint.load_latest(
+            self.checkpoint_dir(), self.logger
+        )
+        if step is None:
+            return None
+        self.checkpoint_step = step
+        self.resumed_step = step
+        self._checkpoint_time = time.time()
+        self.logger.info('resumed from the checkpoint at step %d' % step)
+        return state
+
+    ## ラッパーが生成した要約をout_paramsに保存するメソッド
+    #
+    #  execute()で同じ名前のキーが設定されている場合は, 上書きせずに警告する.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param key キー('metrics', 'checkpoint', 'profile'のいずれか)
+    #  @param summary 要約の辞書
+    def _add_summary(self, key, summary):
+        if key in self.out_params:
+            self.logger.warning(
+                "out_params['%s'] is already set; "
+                "the %s summary is not saved" % (key, key)
+            )
+            return
+        self.out_params[key] = summary
+
     ## メンバ変数in_params, out_params, in_symlinks, out_symlinks, out_filesの
     #  内容に基づいて, jsonファイルを生成するメソッド
     #  @param self オブジェクト自身に対するポインタ
@@ -115,9 +291,45 @@ class Main(object):
         else:
             json_dump_callback = skipvalues
 
+        # 逐次記録した指標は要約のみを出力する
+        if self.metrics is not None:
+            self.metrics.close()
+            summary = self.metrics.summary()
+            summary['path'] = metrics.METRICS_FILENAME
+            self._add_summary('metrics', summary)
+
+        # チェックポイントは要約のみを出力する
+        if self.checkpoint_step is not None:
+            self._add_summary('checkpoint', {
+                'step': self.checkpoint_step,
+                'saved': self._checkpoint_saved,
+                'resumed_step': self.resumed_step,
+                'path': checkpoint.CHECKPOINT_DIRNAME,
+            })
+
+        # 大きな数値配列はサイドカーに保存し, 参照のみをjsonに出力する
+        in_params = self.in_params
+        out_params = self.out_params
+        if self.sidecar_threshold > 0:
+            if self.output_dir is not None:
+                base_dir = self.output_dir
+            else:
+                base_dir = '.'
+            in_params = sidecar.replace_large_values(
+                in_params, base_dir, 'input_params',
+                self.sidecar_threshold
+            )
+            out_params = sidecar.replace_large_values(
+                out_params, base_dir, 'output_params',
+                self.sidecar_threshold
+            )
+            if self.output_dir is None and \
+                    os.path.isdir(sidecar.SIDECAR_DIRNAME):
+                self.out_files['sidecars'] = sidecar.SIDECAR_DIRNAME
+
         io_params_dict = {
-            'input_params': self.in_params,
-            'output_params': self.out_params
+            'input_params': in_params,
+            'output_params': out_params
         }
         io_params_json = json.dumps(
             io_params_dict, indent=4,
@@ -226,10 +438,16 @@ class Main(object):
         return parser
 
     def parse_args(self, argv):
-        parser = self.make_parser()
-        parents = self.parents_dict.values()
-        parents.append(parser)
-        aggregated_parser = self.make_aggregated_parser(parents)
+        parser = cached_parser(self, 'main', self.make_parser)
+        names = [name for name in self.parents_dict if name != 'main']
+        parents = [self.parents_dict[name] for name in names]
+
+        def make():
+            return self.make_aggregated_parser(parents + [parser])
+        # 集約したパーサは親のパーサの組み合わせごとにキャッシュする
+        aggregated_parser = cached_parser(
+            self, ('aggregated',) + tuple(sorted(names)), make
+        )
         aggregated_parser.parse_args(argv)
         remain_args = argv
         self.parents_dict['main'] = parser
@@ -246,11 +464,16 @@ class Main(object):
 #  この関数にtemplate.Mainを継承したオブジェクトを引数として渡し,
 #  excute()メソッドを実行する. @n
 #  excute()内で例外が発生した場合にはロガーにtracebackの内容を出力する.@n
+#  profilerを指定した場合には, excute()の実行中のプロファイルを出力ディレクトリに保存し,
+#  その要約をout_paramsの'profile'に保存する(保存に失敗した場合は警告のみを出力する).
 #  @param obj template.Mainを継承したオブジェクト
+#  @param profiler profiler.Profilerオブジェクト
 #  @return パラメータおよびファイルに関するjsonファイルオブジェクトおよびerrorに関する文字列
-def main(obj):
+def main(obj, profiler=None):
     error = None
 
+    if profiler is not None:
+        profiler.start()
     try:
         obj.execute()
     except Exception:
@@ -262,4 +485,20 @@ def main(obj):
         error = exc_type_str
     except KeyboardInterrupt:
         error = 'KeyboardInterrupted'
+    finally:
+        if profiler is not None:
+            profiler.stop()
+    if profiler is not None:
+        if obj.output_dir is not None:
+            profile_dir = obj.output_dir
+        else:
+            profile_dir = '.'
+        try:
+            summary = profiler.save(profile_dir)
+        except Exception as e:
+            obj.logger.warning('failed to save the profile: %s' % e)
+        else:
+            obj._add_summary('profile', summary)
+    # 非同期に出力しているログを出力し終えるまで待つ
+    logutil.flush(obj.logger)
     return obj.make_output_json(), error
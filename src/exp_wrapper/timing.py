@@ -0,0 +1,147 @@
+# -*- coding:utf-8 -*-
+## @package timing
+#
+#  ラッパーの各処理(フェーズ)の実行時間を計測するためのパッケージ
+#
+#  計測には単調増加する時計を用いる. Python 2ではtime.monotonic()が存在しないため,
+#  ctypesでclock_gettime(CLOCK_MONOTONIC)を呼び出し,
+#  それも利用できない場合はtime.time()で代用する.
+import ctypes
+import ctypes.util
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+## 計測結果のファイル名
+TIMINGS_FILENAME = 'timings.json'
+
+## Chrome trace形式のファイル名
+TRACE_FILENAME = 'trace.json'
+
+## ラッパーの処理に含めないフェーズの名前
+TARGET_PHASE = 'template.main'
+
+_CLOCK_MONOTONIC = 1
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+## 単調増加する時計の関数を返す関数
+#  @return 秒を返す関数と時計の名前
+def _make_clock():
+    if hasattr(time, 'monotonic'):
+        return time.monotonic, 'monotonic'
+    for name in ('c', 'rt'):
+        path = ctypes.util.find_library(name)
+        if path is None:
+            continue
+        try:
+            clock_gettime = ctypes.CDLL(path, use_errno=True).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+
+        def monotonic():
+            # ctypesは呼び出し中にGILを解放するため, スレッド間で共有せずに毎回確保する
+            ts = _timespec()
+            if clock_gettime(_CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+                raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+        return monotonic, 'clock_gettime'
+    return time.time, 'time'
+
+
+monotonic, CLOCK_NAME = _make_clock()
+
+
+## フェーズごとの実行時間を計測するクラス
+#
+#  同じ名前のフェーズを複数回計測した場合, 計測結果では合計される.
+class PhaseTimer(object):
+    ## コンストラクタ
+    #  @param self オブジェクト自身に対するポインタ
+    def __init__(self):
+        ## @var origin
+        #  計測開始時の時計の値
+        self.origin = monotonic()
+        ## @var started
+        #  計測開始時の時刻(エポック秒)
+        self.started = time.time()
+        ## @var events
+        #  (フェーズ名, 開始, 終了, スレッドID)のリスト
+        self.events = []
+        ## @var saved_dir
+        #  最後に計測結果を保存したディレクトリのパス文字列
+        self.saved_dir = None
+
+    ## フェーズの実行時間を計測するコンテキストマネージャ
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param name フェーズ名
+    @contextmanager
+    def phase(self, name):
+        begin = monotonic()
+        try:
+            yield
+        finally:
+            self.events.append(
+                (name, begin, monotonic(), threading.current_thread().ident)
+            )
+
+    ## フェーズごとの実行時間を返すメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @return フェーズ名をキーとする実行時間(秒)のOrderedDict
+    def durations(self):
+        durations = OrderedDict()
+        for name, begin, end, _ in self.events:
+            durations[name] = durations.get(name, 0.0) + (end - begin)
+        return durations
+
+    ## 計測結果の辞書を返すメソッド
+    #
+    #  wrapper_overheadは全体の時間からtemplate.mainの時間を除いたものである.
+    #  @param self オブジェクト自身に対するポインタ
+    #  @return 計測結果の辞書
+    def summary(self):
+        durations = self.durations()
+        total = monotonic() - self.origin
+        return OrderedDict([
+            ('clock', CLOCK_NAME),
+            ('started', self.started),
+            ('total', total),
+            ('wrapper_overhead', total - durations.get(TARGET_PHASE, 0.0)),
+            ('phases', durations),
+        ])
+
+    ## Chrome trace形式の辞書を返すメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @return chrome://tracingやPerfettoで読み込める形式の辞書
+    def trace(self):
+        pid = os.getpid()
+        events = [{
+            'name': 'process_name', 'ph': 'M', 'pid': pid,
+            'args': {'name': 'experiment'},
+        }]
+        for name, begin, end, tid in self.events:
+            events.append({
+                'name': name, 'cat': 'wrapper', 'ph': 'X', 'pid': pid,
+                'tid': tid, 'ts': (begin - self.origin) * 1e6,
+                'dur': (end - begin) * 1e6,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    ## 計測結果をファイルに保存するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param output_dir 保存先のディレクトリのパス文字列
+    #  @param trace Chrome trace形式のファイルも保存するかどうかのbool変数
+    def save(self, output_dir, trace=False):
+        with open(os.path.join(output_dir, TIMINGS_FILENAME), 'w') as f:
+            json.dump(self.summary(), f, indent=4)
+        if trace:
+            with open(os.path.join(output_dir, TRACE_FILENAME), 'w') as f:
+                json.dump(self.trace(), f)
+        self.saved_dir = output_dir
@@ -0,0 +1,69 @@
+# -*- coding:utf-8 -*-
+## @package test_aggregate
+#
+#  aggregateパッケージ(実行結果の表への集約)のテスト
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from exp_wrapper import aggregate
+
+
+class AggregateTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.class_dir = os.path.join(self.tmp, 'module.Class')
+        os.mkdir(self.class_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    ## 実行の出力ディレクトリを作成するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param name ディレクトリ名
+    #  @param output_params 出力パラメータの辞書
+    def add_run(self, name, output_params):
+        run_dir = os.path.join(self.class_dir, name)
+        os.mkdir(run_dir)
+        with open(os.path.join(run_dir, 'io_params_0.json'), 'w') as f:
+            json.dump(
+                {'input_params': {}, 'output_params': output_params}, f
+            )
+
+    ## 集約した表の列の値を返すメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param name 列名
+    #  @return 値のリスト(実行ディレクトリ名の順)
+    def column(self, name):
+        table = aggregate.load(self.class_dir)
+        return [
+            v for _, v in sorted(zip(table['name'], table[name].tolist()))
+        ]
+
+    def test_promote_to_string(self):
+        self.add_run('run1', {'x': 0.1234567891})
+        self.add_run('run2', {'x': None})
+        aggregate.update(self.class_dir, jobs=1)
+        self.add_run('run3', {'x': 'ab'})
+        aggregate.update(self.class_dir, jobs=1)
+        # 既存の値は切り詰められず, 欠損値は'nan'にならない
+        self.assertEqual(
+            self.column('output_params.x'), [u'0.1234567891', u'', u'ab']
+        )
+
+    def test_promote_int_and_bool(self):
+        self.add_run('run1', {'n': 123456789, 'b': True})
+        self.add_run('run2', {})
+        aggregate.update(self.class_dir, jobs=1)
+        self.add_run('run3', {'n': 'a', 'b': 'c'})
+        aggregate.update(self.class_dir, jobs=1)
+        self.assertEqual(
+            self.column('output_params.n'), [u'123456789', u'', u'a']
+        )
+        self.assertEqual(self.column('output_params.b'), [u'True', u'', u'c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
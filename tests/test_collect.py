@@ -0,0 +1,98 @@
+# -*- coding:utf-8 -*-
+## @package test_collect
+#
+#  collectパッケージ(出力ファイルを出力ディレクトリに集める処理)のテスト
+import os
+import shutil
+import tempfile
+import unittest
+
+from exp_wrapper import collect
+
+
+class CollectTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.dst_dir = os.path.join(self.tmp, 'output_files')
+        os.mkdir(self.dst_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    ## ファイルを作成するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param rel_path 一時ディレクトリからの相対パス文字列
+    #  @param data 書き込む内容
+    #  @return 作成したファイルのパス文字列
+    def write(self, rel_path, data):
+        path = os.path.join(self.tmp, rel_path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    ## 読み込んだファイルの内容を返すメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param path ファイルのパス文字列
+    #  @return ファイルの内容
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_same_basename(self):
+        for strategy in collect.METHODS:
+            shutil.rmtree(self.dst_dir)
+            os.mkdir(self.dst_dir)
+            a = self.write('a/model.ckpt', 'A')
+            b = self.write('b/model.ckpt', 'B')
+            record_a = collect.collect(a, self.dst_dir, strategy)
+            record_b = collect.collect(b, self.dst_dir, strategy)
+            self.assertEqual(
+                record_a['path'], os.path.join(self.dst_dir, 'model.ckpt')
+            )
+            self.assertEqual(
+                record_b['path'], os.path.join(self.dst_dir, 'model_1.ckpt')
+            )
+            self.assertEqual(self.read(record_a['path']), 'A')
+            self.assertEqual(self.read(record_b['path']), 'B')
+
+    def test_same_basename_suffixed(self):
+        for name in ('model.ckpt', 'model.ckpt.index'):
+            self.write('a/' + name, 'A')
+            self.write('b/' + name, 'B')
+        paths = []
+        for d in ('a', 'b'):
+            outputs = collect.find_outputs(
+                [os.path.join(self.tmp, d, 'model.ckpt')]
+            )
+            paths += [
+                os.path.basename(collect.collect(o, self.dst_dir)['path'])
+                for o in outputs
+            ]
+        self.assertEqual(sorted(paths), [
+            'model.ckpt', 'model.ckpt.index',
+            'model_1.ckpt', 'model_1.ckpt.index'
+        ])
+
+    def test_auto_skips_reflink(self):
+        self.assertNotIn('reflink', collect.method_chain('auto'))
+        self.assertEqual(collect.method_chain('reflink'), ['reflink', 'copy'])
+
+    def test_copy_directory(self):
+        data = os.urandom(300000)
+        self.write('d/sub/big', data)
+        self.write('d/small', 'x')
+        os.symlink('small', os.path.join(self.tmp, 'd', 'link'))
+        src = os.path.join(self.tmp, 'd')
+        record = collect.collect(src, self.dst_dir, 'copy', 3, 65536)
+        self.assertEqual(record['method'], 'copy')
+        self.assertTrue(record['checksum'].startswith('sha1-tree:'))
+        self.assertFalse(os.path.exists(src))
+        dst = os.path.join(self.dst_dir, 'd')
+        self.assertEqual(self.read(os.path.join(dst, 'sub', 'big')), data)
+        self.assertEqual(os.readlink(os.path.join(dst, 'link')), 'small')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# -*- coding:utf-8 -*-
+## @package test_daemon
+#
+#  daemonパッケージ(常駐プロセスへの実行要求)のテスト
+import os
+import shutil
+import signal
+import tempfile
+import time
+import unittest
+from StringIO import StringIO
+from logging import getLogger, NullHandler
+
+from exp_wrapper import daemon, forkrun
+
+
+## 受け取ったコマンドライン引数を出力するハンドラ
+#
+#  strでない引数を受け取った場合は終了コード1で終了する.
+#  @param argv コマンドライン引数のリスト
+#  @return 出力ディレクトリのパス文字列とerrorに関する文字列
+def _echo(argv):
+    if not all(isinstance(a, str) for a in argv):
+        raise SystemExit(1)
+    print(' '.join(argv))
+    if argv == ['fail']:
+        raise SystemExit(2)
+    return os.getcwd(), None
+
+
+class DaemonTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp, 'd.sock')
+        logger = getLogger('test_daemon')
+        logger.addHandler(NullHandler())
+        self.pid = os.fork()
+        if self.pid == 0:
+            try:
+                daemon.serve(self.socket_path, _echo, 2, logger)
+            finally:
+                os._exit(0)
+        for _ in range(100):
+            if os.path.exists(self.socket_path):
+                break
+            time.sleep(0.05)
+
+    def tearDown(self):
+        os.kill(self.pid, signal.SIGTERM)
+        forkrun.wait(self.pid)
+        shutil.rmtree(self.tmp)
+
+    def test_non_ascii_argv(self):
+        out = StringIO()
+        code = daemon.request(self.socket_path, ['+c', 'コメント'], out)
+        self.assertEqual(code, 0)
+        self.assertEqual(out.getvalue(), '+c コメント\n')
+
+    def test_exit_code(self):
+        out = StringIO()
+        self.assertEqual(daemon.request(self.socket_path, ['fail'], out), 2)
+
+
+class ScriptStampTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'script.py')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_changed(self):
+        with open(self.path, 'w') as f:
+            f.write('VALUE = 1\n')
+        stamp = daemon.script_stamp(self.path)
+        mtime = os.path.getmtime(self.path)
+        with open(self.path, 'w') as f:
+            f.write('VALUE = 2\n')
+        # mtimeが変わらない変更もハッシュ値で検出する
+        os.utime(self.path, (mtime, mtime))
+        self.assertNotEqual(daemon.script_stamp(self.path), stamp)
+        module = daemon.reload_script(self.path, '_test_daemon_script')
+        self.assertEqual(module.VALUE, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
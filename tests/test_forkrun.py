@@ -0,0 +1,91 @@
+# -*- coding:utf-8 -*-
+## @package test_forkrun
+#
+#  forkrunパッケージ(子プロセスでの実行と状態の判定)のテスト
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from exp_wrapper import forkrun
+
+
+## 子プロセスで実行し, 実行結果と終了コードを返す関数
+#  @param handler 子プロセスで実行する関数
+#  @param argv handlerに渡すコマンドライン引数のリスト
+#  @return 実行結果の辞書と終了コード
+def _run(handler, argv):
+    pid, fd = forkrun.spawn(handler, argv)
+    result = forkrun.read_result(fd)
+    _, code = forkrun.wait(pid)
+    return result, code
+
+
+class StatusTest(unittest.TestCase):
+    def test_ok(self):
+        self.assertEqual(
+            forkrun.status({'output_dir': '/x', 'error': None}, 0), 'ok'
+        )
+
+    def test_error(self):
+        self.assertEqual(
+            forkrun.status({'output_dir': '/x', 'error': 'Abort'}, 0),
+            'Abort'
+        )
+
+    def test_exit_code(self):
+        self.assertEqual(forkrun.status({}, 2), 'exit=2')
+        self.assertEqual(forkrun.status({}, 0), 'exit=0')
+
+
+class SpawnTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_error_through_pipe(self):
+        # 出力ディレクトリ名に依存せず, ハンドラが返したエラー名を状態とする
+        run_dir = os.path.join(self.tmp, 'run_StopIteration_x')
+        result, code = _run(lambda argv: (run_dir, 'StopIteration'), [])
+        self.assertEqual(code, 0)
+        self.assertEqual(result['output_dir'], run_dir)
+        self.assertEqual(forkrun.status(result, code), 'StopIteration')
+
+    def test_ok_with_error_like_name(self):
+        run_dir = os.path.join(self.tmp, 'run_ValueError')
+        result, code = _run(lambda argv: (run_dir, None), [])
+        self.assertEqual(forkrun.status(result, code), 'ok')
+
+    def test_exit(self):
+        def handler(argv):
+            raise SystemExit(3)
+        result, code = _run(handler, [])
+        self.assertEqual(forkrun.status(result, code), 'exit=3')
+
+    def test_non_ascii_argv(self):
+        argv = ['+c', 'コメント']
+
+        def handler(received):
+            if received != argv or not isinstance(received[1], str):
+                raise SystemExit(1)
+            return self.tmp, None
+        loaded = forkrun.native_str(json.loads(json.dumps(argv)))
+        result, code = _run(handler, loaded)
+        self.assertEqual(forkrun.status(result, code), 'ok')
+        self.assertIsInstance(result['output_dir'], str)
+
+
+class NativeStrTest(unittest.TestCase):
+    def test_nested(self):
+        value = json.loads(json.dumps({'argv': ['コメント'], 'n': 1}))
+        converted = forkrun.native_str(value)
+        self.assertEqual(converted, {'argv': ['コメント'], 'n': 1})
+        self.assertIsInstance(converted['argv'][0], str)
+        self.assertIsInstance(list(converted)[0], str)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+# -*- coding:utf-8 -*-
+## @package test_jobqueue
+#
+#  jobqueueパッケージ(ファイルベースのジョブキュー)のテスト
+import shutil
+import tempfile
+import unittest
+
+from exp_wrapper import jobqueue
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.queue = jobqueue.JobQueue(self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_non_ascii_argv(self):
+        argv = ['script.py', 'Main', '+c', 'コメント']
+        self.queue.enqueue([argv], '/tmp/作業')
+        job = self.queue.claim('worker')
+        self.assertEqual(job['argv'], argv)
+        self.assertEqual(job['cwd'], '/tmp/作業')
+        self.assertTrue(all(isinstance(a, str) for a in job['argv']))
+        # ジョブIDとの連結でUnicodeDecodeErrorが発生しない
+        ' '.join([job['id']] + job['argv'])
+
+    def test_claim_empty(self):
+        self.assertIsNone(self.queue.claim('worker'))
+
+
+if __name__ == '__main__':
+    unittest.main()
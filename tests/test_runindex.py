@@ -0,0 +1,53 @@
+# -*- coding:utf-8 -*-
+## @package test_runindex
+#
+#  runindexパッケージ(実行結果のインデックス)のうち, 実行の状態の判定のテスト
+import os
+import shutil
+import tempfile
+import unittest
+
+from exp_wrapper import runindex
+
+
+class StatusTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    ## 出力ディレクトリを作成するメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param name ディレクトリ名
+    #  @return 出力ディレクトリのパス文字列
+    def make_dir(self, name):
+        path = os.path.join(self.tmp, name)
+        os.mkdir(path)
+        return path
+
+    def test_recorded_error(self):
+        # ERROR_DIR_PATTERNに一致しないエラー名も判定できる
+        run_dir = self.make_dir('20260101_0000_00_1_StopIteration')
+        runindex.write_error(run_dir, 'StopIteration', '_1_StopIteration')
+        self.assertEqual(runindex.parse_status(run_dir), 'StopIteration')
+        self.assertEqual(
+            runindex.read_error(run_dir)['suffix'], '_1_StopIteration'
+        )
+
+    def test_recorded_error_precedes_name(self):
+        run_dir = self.make_dir('20260101_0000_00_ValueError')
+        self.assertEqual(runindex.parse_status(run_dir), 'ValueError')
+        runindex.write_error(run_dir, 'Abort', '_Abort')
+        self.assertEqual(runindex.parse_status(run_dir), 'Abort')
+        runindex.remove_error(run_dir)
+        runindex.remove_error(run_dir)
+        self.assertIsNone(runindex.read_error(run_dir))
+
+    def test_ok(self):
+        run_dir = self.make_dir('20260101_0000_00')
+        self.assertIsNone(runindex.parse_status(run_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
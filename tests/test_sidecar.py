@@ -0,0 +1,50 @@
+# -*- coding:utf-8 -*-
+## @package test_sidecar
+#
+#  sidecarパッケージ(大きな数値配列のバイナリファイルへの保存)のテスト
+import shutil
+import tempfile
+import unittest
+
+from exp_wrapper import sidecar
+
+
+class SidecarTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.numpy_module = sidecar._numpy_module
+
+    def tearDown(self):
+        sidecar._numpy_module = self.numpy_module
+        shutil.rmtree(self.tmp)
+
+    ## 保存して読み込んだ値を返すメソッド
+    #  @param self オブジェクト自身に対するポインタ
+    #  @param params パラメータの辞書
+    #  @return 参照の辞書と読み込んだ値の辞書
+    def roundtrip(self, params):
+        refs = sidecar.replace_large_values(params, self.tmp, 'out', 3)
+        loaded = sidecar.load_params(refs, self.tmp)
+        return refs, dict((k, list(v)) for k, v in loaded.items())
+
+    def test_name_collision(self):
+        for numpy in (False, None):
+            # Noneの場合はNumPyが利用できない場合の生のバイナリで保存する
+            sidecar._numpy_module = numpy
+            params = {'a b': [1] * 4, 'a_b': [2] * 4, u'aあb': [3] * 4}
+            refs, loaded = self.roundtrip(params)
+            self.assertEqual(len(set(r['path'] for r in refs.values())), 3)
+            self.assertEqual(loaded, params)
+
+    def test_bool_list(self):
+        for numpy in (False, None):
+            sidecar._numpy_module = numpy
+            params = {'mask': [True, False] * 4}
+            self.assertTrue(sidecar.is_large_array(params['mask'], 3))
+            refs, loaded = self.roundtrip(params)
+            self.assertEqual(refs['mask']['dtype'], '|b1')
+            self.assertEqual([bool(v) for v in loaded['mask']], params['mask'])
+
+
+if __name__ == '__main__':
+    unittest.main()